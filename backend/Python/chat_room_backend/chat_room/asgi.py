@@ -2,6 +2,8 @@
 ASGI config for chat_room project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Lifespan events, which Django does not handle, are answered here so the
+pooled async LLM clients are closed on server shutdown.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,20 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_room.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from llm.views.utils import aclose_llm_clients  # noqa: E402  needs the app registry
+
+
+async def application(scope, receive, send):
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await aclose_llm_clients()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -30,6 +30,93 @@ import os
 
 # Zhipu AI API Configuration
 ZHIPU_API_KEY = os.getenv('ZHIPU_API_KEY')
+ZHIPU_BASE_URL = os.getenv('ZHIPU_BASE_URL', 'https://open.bigmodel.cn/api/paas/v4')
+
+# LLM client connection pool (per API key/model, per process)
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv('LLM_POOL_MAX_CONNECTIONS', '100'))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv('LLM_POOL_MAX_KEEPALIVE', '20'))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv('LLM_POOL_KEEPALIVE_EXPIRY', '60'))
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', '300'))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '8'))
+
+# LLM admission control (per process); 0 disables a rate limit
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '64'))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv('LLM_REQUESTS_PER_MINUTE', '0'))
+LLM_TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', '0'))
+LLM_QUEUE_MAX = int(os.getenv('LLM_QUEUE_MAX', '200'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '30'))
+
+# LLM call deadlines, hedging and circuit breaking; a request may shorten
+# its deadline with the X-Request-Timeout header (seconds)
+LLM_REQUEST_DEADLINE = float(os.getenv('LLM_REQUEST_DEADLINE', '120'))
+LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'true').lower() == 'true'
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+LLM_HEDGE_MODEL = os.getenv('LLM_HEDGE_MODEL', '')
+LLM_HEDGE_API_KEY = os.getenv('LLM_HEDGE_API_KEY', '')
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+
+# Speculative actor calls of /api/ai/turn, started while the admin call runs
+SPECULATIVE_ACTOR_ENABLED = os.getenv('SPECULATIVE_ACTOR_ENABLED', 'false').lower() == 'true'
+SPECULATIVE_ACTOR_CANDIDATES = int(os.getenv('SPECULATIVE_ACTOR_CANDIDATES', '1'))
+SPECULATIVE_CALLS_PER_MINUTE = int(os.getenv('SPECULATIVE_CALLS_PER_MINUTE', '30'))
+
+# Per-room core memory cache (in-process, write-through)
+CORE_MEMORY_CACHE_ENABLED = os.getenv('CORE_MEMORY_CACHE_ENABLED', 'true').lower() == 'true'
+CORE_MEMORY_CACHE_MAX_ROOMS = int(os.getenv('CORE_MEMORY_CACHE_MAX_ROOMS', '10000'))
+CORE_MEMORY_CACHE_MAX_BYTES = int(os.getenv('CORE_MEMORY_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Group commit of conversation history and admin analysis inserts: writes
+# arriving within WRITE_BUFFER_WINDOW_MS share one transaction
+WRITE_BUFFER_ENABLED = os.getenv('WRITE_BUFFER_ENABLED', 'true').lower() == 'true'
+WRITE_BUFFER_WINDOW_MS = float(os.getenv('WRITE_BUFFER_WINDOW_MS', '5'))
+WRITE_BUFFER_MAX_ROWS = int(os.getenv('WRITE_BUFFER_MAX_ROWS', '500'))
+
+# Estimated prompt token budget; 0 keeps the fixed dialogue/memory counts
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '0'))
+
+# Embedding provider ('zhipu', 'fake' or a dotted path to an EmbeddingProvider subclass)
+EMBEDDING_PROVIDER = os.getenv('EMBEDDING_PROVIDER', 'zhipu')
+EMBEDDING_CACHE_MAX_ITEMS = int(os.getenv('EMBEDDING_CACHE_MAX_ITEMS', '20000'))
+
+# Long-term memory retrieval
+LONG_TERM_MEMORY_ENABLED = os.getenv('LONG_TERM_MEMORY_ENABLED', 'true').lower() == 'true'
+LONG_TERM_MEMORY_BUDGET_MS = int(os.getenv('LONG_TERM_MEMORY_BUDGET_MS', '200'))
+LONG_TERM_INDEX_MAX_BYTES = int(os.getenv('LONG_TERM_INDEX_MAX_BYTES', str(512 * 1024 * 1024)))
+# Seconds between checks of a cached room against writes of other processes (0: every search)
+LONG_TERM_INDEX_CHECK_SECONDS = float(os.getenv('LONG_TERM_INDEX_CHECK_SECONDS', '30'))
+
+# On-disk ANN index of long-term memories, used for rooms above LONG_TERM_ANN_MIN_ROWS
+LONG_TERM_ANN_ENABLED = os.getenv('LONG_TERM_ANN_ENABLED', 'true').lower() == 'true'
+LONG_TERM_ANN_DIR = os.getenv('LONG_TERM_ANN_DIR', str(BASE_DIR / 'ann_index'))
+LONG_TERM_ANN_MIN_ROWS = int(os.getenv('LONG_TERM_ANN_MIN_ROWS', '20000'))
+LONG_TERM_ANN_NPROBE = int(os.getenv('LONG_TERM_ANN_NPROBE', '16'))
+LONG_TERM_ANN_REBUILD_RATIO = float(os.getenv('LONG_TERM_ANN_REBUILD_RATIO', '0.2'))
+
+# Finished responses of retried AI calls (in-process, by Idempotency-Key or body hash)
+IDEMPOTENCY_ENABLED = os.getenv('IDEMPOTENCY_ENABLED', 'true').lower() == 'true'
+IDEMPOTENCY_HASH_BODY = os.getenv('IDEMPOTENCY_HASH_BODY', 'false').lower() == 'true'
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', '600'))
+IDEMPOTENCY_CACHE_MAX_ITEMS = int(os.getenv('IDEMPOTENCY_CACHE_MAX_ITEMS', '2000'))
+
+# AI responses: 'minimal' (reply and character state) or 'debug' (also core
+# memory, prompt and raw model result); X-Response-Profile overrides per request
+AI_RESPONSE_PROFILE = os.getenv('AI_RESPONSE_PROFILE', 'minimal')
+# Parse request bodies straight into their schema and encode responses with orjson
+FAST_JSON_ENABLED = os.getenv('FAST_JSON_ENABLED', 'false').lower() == 'true'
+# Gzip responses of at least this many bytes for clients accepting it (0: off)
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', '1024'))
+
+# Per-stage request timings (Server-Timing header) and /metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Request traces for replay_traces: gzip NDJSON files in TRACE_DIR, rotated at
+# TRACE_ROTATE_MB, keeping the newest TRACE_KEEP_FILES (0: all)
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'false').lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+TRACE_DIR = os.getenv('TRACE_DIR', str(BASE_DIR / 'traces'))
+TRACE_ROTATE_MB = int(os.getenv('TRACE_ROTATE_MB', '64'))
+TRACE_KEEP_FILES = int(os.getenv('TRACE_KEEP_FILES', '20'))
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -41,7 +128,7 @@ ALLOWED_HOSTS = []
 
 INSTALLED_APPS = ['llm',]
 
-MIDDLEWARE = []
+MIDDLEWARE = ['llm.middleware.LargeResponseGZipMiddleware']
 
 ROOT_URLCONF = 'chat_room.urls'
 
@@ -68,13 +155,37 @@ STATIC_URL = 'static/'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# WAL lets readers run alongside the writer; IMMEDIATE transactions take
+# the write lock when they begin instead of failing to upgrade a read lock
+SQLITE_OPTIONS = {
+    'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 20,
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS,
     }
 }
 
+# Per-room shards: with ROOM_SHARDS > 0, the rows of each room live in one
+# of ROOM_SHARDS databases chosen by hashing the room ID (see llm.db_router).
+# Create them with `migrate_room_shards`, which also moves existing rooms.
+ROOM_SHARDS = int(os.getenv('ROOM_SHARDS', '0'))
+ROOM_SHARD_DIR = os.getenv('ROOM_SHARD_DIR', str(BASE_DIR / 'shards'))
+
+for _index in range(ROOM_SHARDS):
+    DATABASES[f'room_shard_{_index:02d}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(ROOM_SHARD_DIR, f'room_shard_{_index:02d}.sqlite3'),
+        'OPTIONS': SQLITE_OPTIONS,
+    }
+
+DATABASE_ROUTERS = ['llm.db_router.RoomShardRouter']
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -3,10 +3,16 @@ from .models.db_models import (
     ShortTermMemory,
     LongTermMemory,
     ConversationHistory,
-    AdminAnalysisRecord
+    AdminAnalysisRecord,
+    RoomStats,
+    CompactionCheckpoint,
+    EmbeddingCache
 )
 
 admin.site.register(ShortTermMemory)
 admin.site.register(LongTermMemory)
 admin.site.register(ConversationHistory)
 admin.site.register(AdminAnalysisRecord)
+admin.site.register(RoomStats)
+admin.site.register(CompactionCheckpoint)
+admin.site.register(EmbeddingCache)
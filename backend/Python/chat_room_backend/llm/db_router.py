@@ -0,0 +1,71 @@
+"""
+Database routing of the llm application.
+
+With ``ROOM_SHARDS`` set, the rows of each room (conversation history,
+short- and long-term memories, admin analyses, room stats and compaction
+checkpoints) live in one of ``ROOM_SHARDS`` SQLite databases, chosen by a
+stable hash of the room ID. SQLite serializes writers per database file,
+so rooms on different shards are written in parallel. Rows that are not
+per-room (the embedding cache) stay in ``default``.
+
+Django routers only see the model of a query, so queries by room select
+their database explicitly with ``room_db(room_id)``; the router places
+saved instances by their ``room_id`` and keeps room tables on the shards.
+"""
+
+import zlib
+from typing import List
+
+from django.conf import settings
+
+# Models whose rows belong to one room, by ``model_name``
+ROOM_MODELS = frozenset({
+    'conversationhistory',
+    'shorttermmemory',
+    'longtermmemory',
+    'adminanalysisrecord',
+    'roomstats',
+    'compactioncheckpoint'
+})
+
+
+def shard_alias(index: int) -> str:
+    return f'room_shard_{index:02d}'
+
+
+def room_db(room_id: str) -> str:
+    """Database alias holding the rows of a room."""
+    if not settings.ROOM_SHARDS:
+        return 'default'
+    return shard_alias(zlib.crc32(room_id.encode('utf-8')) % settings.ROOM_SHARDS)
+
+
+def room_databases() -> List[str]:
+    """Database aliases holding room rows."""
+    if not settings.ROOM_SHARDS:
+        return ['default']
+    return [shard_alias(index) for index in range(settings.ROOM_SHARDS)]
+
+
+def _is_room_model(model) -> bool:
+    return model._meta.app_label == 'llm' and model._meta.model_name in ROOM_MODELS
+
+
+class RoomShardRouter:
+    """Routes per-room models to the shard of their room."""
+
+    def _db_for_instance(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and _is_room_model(model):
+            return room_db(instance.room_id)
+        return None
+
+    db_for_read = _db_for_instance
+    db_for_write = _db_for_instance
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default':
+            return None
+        if db.startswith('room_shard_'):
+            return app_label == 'llm' and model_name in ROOM_MODELS
+        return None
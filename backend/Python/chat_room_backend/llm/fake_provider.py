@@ -0,0 +1,361 @@
+"""
+Local stand-in for the Zhipu chat completions and embeddings API.
+
+Used by ``run_fake_llm`` and ``benchmark_load`` to load-test the service
+offline. Chat completions answer after a latency drawn from a configurable
+distribution, with a tool call filled in from the requested tool's JSON
+schema (or plain text without tools), streamed as Server-Sent Events when
+asked. Usage counts are estimated from the message lengths. A share of
+calls can fail with 503 to exercise retries and circuit breaking.
+
+``RecordedProvider`` answers with the provider responses recorded in
+request traces instead, for ``replay_traces``.
+
+Latency specs:
+    fixed:SECONDS
+    uniform:LOW,HIGH
+    lognormal:MEDIAN,SIGMA
+"""
+
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+# Characters of generated long text fields (replies, analyses, summaries)
+CONTENT_CHARS = 120
+STREAM_CHUNK_CHARS = 8
+
+# Dialogue and memory timestamps in prompts, which differ between a request and its replay
+PROMPT_TIMESTAMP = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?([+-]\d{2}:\d{2}|Z)?')
+
+
+class LatencyModel:
+    """Random call latency parsed from a spec such as ``lognormal:0.8,0.5``."""
+
+    def __init__(self, spec: str):
+        kind, _, values = spec.partition(':')
+        try:
+            params = [float(value) for value in values.split(',')] if values else []
+        except ValueError:
+            raise ValueError(f"无效的延迟分布: {spec}")
+        expected = {'fixed': 1, 'uniform': 2, 'lognormal': 2}.get(kind)
+        if expected is None or len(params) != expected:
+            raise ValueError(f"无效的延迟分布: {spec}")
+        self.spec = spec
+        self.kind = kind
+        self.params = params
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'fixed':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return rng.uniform(*self.params)
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 2)
+
+
+def _fake_value(name: str, schema: Dict[str, Any], rng: random.Random) -> Any:
+    if schema.get('enum'):
+        return rng.choice(schema['enum'])
+    kind = schema.get('type', 'string')
+    if kind in ('integer', 'number'):
+        return rng.randint(0, 10)
+    if kind == 'boolean':
+        return rng.random() < 0.5
+    if kind == 'array':
+        return [_fake_value(name, schema.get('items', {}), rng)]
+    if name.endswith('content') or name == 'summary':
+        sentence = "这是一段用于压测的模拟回复。"
+        return (sentence * (CONTENT_CHARS // len(sentence) + 1))[:CONTENT_CHARS]
+    return f"模拟{name}{rng.randint(1, 5)}"
+
+
+def fake_tool_arguments(tool: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    """Arguments for every property of a function tool's parameter schema."""
+    properties = tool['function'].get('parameters', {}).get('properties', {})
+    return {name: _fake_value(name, schema, rng) for name, schema in properties.items()}
+
+
+class FakeProvider:
+    """Threaded HTTP server answering chat completions and embeddings."""
+
+    def __init__(
+        self,
+        latency: str = 'lognormal:0.8,0.5',
+        chunk_delay: float = 0.02,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.latency = LatencyModel(latency)
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.calls: Dict[str, int] = {}
+        self.errors = 0
+
+    def _draw(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Latency, failure and a seed for one call, and optionally its
+        ``completion``; the shared RNG is not thread-safe.
+        """
+        with self._lock:
+            return {
+                'latency': self.latency.sample(self._rng),
+                'fail': self._rng.random() < self.error_rate,
+                'seed': self._rng.getrandbits(32)
+            }
+
+    def _count(self, path: str, failed: bool) -> None:
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            self.errors += failed
+
+    def completion(self, body: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+        """Chat completion response for a request body."""
+        tools = body.get('tools') or []
+        if tools:
+            arguments = json.dumps(fake_tool_arguments(tools[0], rng), ensure_ascii=False)
+            message = {
+                'role': 'assistant',
+                'content': None,
+                'tool_calls': [{
+                    'id': f"call_{rng.getrandbits(32):08x}",
+                    'type': 'function',
+                    'function': {'name': tools[0]['function']['name'], 'arguments': arguments}
+                }]
+            }
+            output = arguments
+        else:
+            output = "这是一段用于压测的模拟回复。"
+            message = {'role': 'assistant', 'content': output}
+        return {
+            'id': f"fake-{rng.getrandbits(48):012x}",
+            'model': body.get('model'),
+            'choices': [{
+                'index': 0,
+                'message': message,
+                'finish_reason': 'tool_calls' if tools else 'stop'
+            }],
+            'usage': self.usage(body, output)
+        }
+
+    def usage(self, body: Dict[str, Any], output: str) -> Dict[str, Any]:
+        messages = body.get('messages') or []
+        prompt_tokens = sum(_estimate_tokens(message.get('content') or '') for message in messages)
+        # The room's system message is the prefix the provider would cache
+        cached_tokens = _estimate_tokens(messages[0].get('content') or '') if len(messages) > 1 else 0
+        completion_tokens = _estimate_tokens(output)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens}
+        }
+
+    def stream_chunks(self, completion: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Stream chunks of a completion, the last one carrying its usage."""
+        message = completion['choices'][0]['message']
+        chunks = []
+        if message.get('tool_calls'):
+            function = message['tool_calls'][0]['function']
+            text = function['arguments']
+            for start in range(0, len(text), STREAM_CHUNK_CHARS):
+                chunks.append({'tool_calls': [{
+                    'index': 0,
+                    'id': message['tool_calls'][0].get('id'),
+                    'type': 'function',
+                    'function': {
+                        'name': function['name'] if start == 0 else None,
+                        'arguments': text[start:start + STREAM_CHUNK_CHARS]
+                    }
+                }]})
+        else:
+            text = message.get('content') or ''
+            for start in range(0, len(text), STREAM_CHUNK_CHARS):
+                chunks.append({'content': text[start:start + STREAM_CHUNK_CHARS]})
+        events = [{'id': completion.get('id'), 'choices': [{'index': 0, 'delta': delta}]} for delta in chunks]
+        events.append({
+            'id': completion.get('id'),
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': completion['choices'][0].get('finish_reason')}],
+            'usage': completion.get('usage')
+        })
+        return events
+
+    def embeddings(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Deterministic unit vectors per input text."""
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        dimensions = body.get('dimensions') or 1024
+        data = []
+        for index, text in enumerate(inputs):
+            rng = random.Random(text)
+            vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+            norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+            data.append({'index': index, 'object': 'embedding', 'embedding': [value / norm for value in vector]})
+        tokens = sum(_estimate_tokens(text) for text in inputs)
+        return {'data': data, 'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}}
+
+    def bind(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Open the listening socket; returns the API base URL."""
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        return self.base_url
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Serve in a background thread; returns the API base URL."""
+        base_url = self.bind(host, port)
+        threading.Thread(target=self._server.serve_forever, name='fake-llm', daemon=True).start()
+        return base_url
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/paas/v4"
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'calls': dict(self.calls), 'errors': self.errors}
+
+
+class _RecordedCall:
+    def __init__(self, call: Dict[str, Any]):
+        self.latency = call['latency']
+        self.completion = call['response']
+        self.used = False
+
+
+def _messages_key(messages: List[Dict[str, Any]]) -> str:
+    text = PROMPT_TIMESTAMP.sub('', json.dumps(messages, ensure_ascii=False, sort_keys=True))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _pop_unused(queue: Optional[Deque[_RecordedCall]]) -> Optional[_RecordedCall]:
+    while queue:
+        call = queue.popleft()
+        if not call.used:
+            call.used = True
+            return call
+    return None
+
+
+class RecordedProvider(FakeProvider):
+    """
+    Answers chat completions with the provider responses of request traces.
+
+    A call gets the recorded response of a call with the same messages,
+    timestamps aside, or, when the prompt differs (the replay's history or
+    memories diverged), the next unused response of the same tool.
+    Latencies are the recorded ones divided by ``speed``; 0 answers at
+    once. Calls without any recorded response left get a generated one.
+    """
+
+    def __init__(self, records: Iterable[Dict[str, Any]], speed: float = 1.0, chunk_delay: float = 0.0):
+        super().__init__(latency='fixed:0', chunk_delay=chunk_delay)
+        self.speed = speed
+        self._by_messages: Dict[str, Deque[_RecordedCall]] = {}
+        self._by_kind: Dict[str, Deque[_RecordedCall]] = {}
+        self.matches = {'messages': 0, 'kind': 0, 'missed': 0}
+        for record in records:
+            for call in record.get('model_calls') or []:
+                recorded = _RecordedCall(call)
+                self._by_messages.setdefault(_messages_key(call['messages']), deque()).append(recorded)
+                self._by_kind.setdefault(call['kind'], deque()).append(recorded)
+
+    def _draw(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        tools = body.get('tools')
+        kind = tools[0]['function']['name'] if tools else 'text'
+        key = _messages_key(body.get('messages') or [])
+        with self._lock:
+            call = _pop_unused(self._by_messages.get(key))
+            match = 'messages'
+            if call is None:
+                call = _pop_unused(self._by_kind.get(kind))
+                match = 'kind' if call is not None else 'missed'
+            self.matches[match] += 1
+            seed = self._rng.getrandbits(32)
+        if call is None:
+            return {'latency': 0.0, 'fail': False, 'seed': seed}
+        return {
+            'latency': call.latency / self.speed if self.speed else 0.0,
+            'fail': False,
+            'seed': seed,
+            'completion': call.completion
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'calls': dict(self.calls), 'matches': dict(self.matches)}
+
+
+def _handler(provider: FakeProvider):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+            content = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            path = self.path.rsplit('/', 1)[-1]
+            if path == 'embeddings':
+                provider._count(path, False)
+                self._send_json(200, provider.embeddings(body))
+                return
+            if path != 'completions':
+                self._send_json(404, {'error': {'message': 'not found'}})
+                return
+
+            draw = provider._draw(body)
+            rng = random.Random(draw['seed'])
+            provider._count(path, draw['fail'])
+            time.sleep(draw['latency'])
+            if draw['fail']:
+                self._send_json(503, {'error': {'code': '1305', 'message': '模拟的服务过载'}})
+                return
+            completion = draw.get('completion') or provider.completion(body, rng)
+            if not body.get('stream'):
+                self._send_json(200, completion)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            for chunk in provider.stream_chunks(completion):
+                self.wfile.write(b"data: " + json.dumps(chunk, ensure_ascii=False).encode('utf-8') + b"\n\n")
+                self.wfile.flush()
+                time.sleep(provider.chunk_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return Handler
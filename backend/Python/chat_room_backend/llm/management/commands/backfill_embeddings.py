@@ -0,0 +1,70 @@
+"""
+Fill the embedding of long-term memories that have none yet.
+
+Usage:
+    python manage.py backfill_embeddings
+    python manage.py backfill_embeddings --room-id <room_id> --batch-size 256
+"""
+
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from llm.db_router import room_db, room_databases
+from llm.models import LongTermMemory
+from llm.views.utils import get_embeddings, get_embedding_stats, ann_store
+
+
+class Command(BaseCommand):
+    help = "Embed long-term memories without an embedding"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room-id', help="Only backfill this room")
+        parser.add_argument('--batch-size', type=int, default=256, help="Rows embedded and saved per batch")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['room_id']:
+            databases = [room_db(options['room_id'])]
+        else:
+            databases = room_databases()
+
+        total = 0
+        for database in databases:
+            pending = LongTermMemory.objects.using(database).filter(embedding=b'')
+            if options['room_id']:
+                pending = pending.filter(room_id=options['room_id'])
+
+            while True:
+                memories = list(pending.order_by('id')[:options['batch_size']])
+                if not memories:
+                    break
+
+                vectors = get_embeddings([memory.content for memory in memories])
+                updated_at = timezone.now()
+                for memory, vector in zip(memories, vectors):
+                    memory.embedding = vector.tobytes()
+                    memory.updated_at = updated_at
+                # Running servers see the new updated_at and reload the rooms.
+                # bulk_update sends no post_save signal, so extend the ANN indexes here
+                LongTermMemory.objects.using(database).bulk_update(memories, ['embedding', 'updated_at'])
+
+                rooms = {}
+                for memory, vector in zip(memories, vectors):
+                    rooms.setdefault(memory.room_id, ([], []))
+                    rooms[memory.room_id][0].append(memory.id)
+                    rooms[memory.room_id][1].append(vector)
+                for room_id, (ids, room_vectors) in rooms.items():
+                    ann_store.append(room_id, ids, np.stack(room_vectors))
+
+                total += len(memories)
+                self.stdout.write(f"{total} memories embedded")
+
+        stats = get_embedding_stats()
+        self.stdout.write(
+            f"Done: {total} memories in {time.monotonic() - started:.2f}s, "
+            f"{stats['provider_calls']} provider calls, {stats['embedded']} texts embedded, "
+            f"{stats['memory_hits'] + stats['table_hits']} cache hits"
+        )
@@ -0,0 +1,93 @@
+"""
+Compare recall and latency of the ANN index against exact search.
+
+Runs on synthetic clustered embeddings in a temporary directory, so it
+needs no database rows and no embedding API.
+
+Usage:
+    python manage.py benchmark_ann_index --rows 100000 --nprobe 4,8,16,32
+"""
+
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from llm.views.utils import RoomANNIndex, write_index, EMBEDDING_DIMENSIONS, LONG_TERM_MEMORY_TOP_K
+from llm.views.utils.constants import ANN_RERANK_CANDIDATES
+
+
+def _clustered_vectors(rng, rows, dims, clusters):
+    """Unit vectors drawn around random topic centers, roughly like text embeddings."""
+    centers = rng.standard_normal((clusters, dims)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, rows)] + 0.6 * rng.standard_normal((rows, dims)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _percentile_ms(samples, percentile):
+    return float(np.percentile(samples, percentile)) * 1000
+
+
+class Command(BaseCommand):
+    help = "Benchmark ANN index recall and latency against exact search"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--dims', type=int, default=EMBEDDING_DIMENSIONS)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=LONG_TERM_MEMORY_TOP_K)
+        parser.add_argument('--nprobe', default='4,8,16,32', help="Comma separated nprobe values")
+        parser.add_argument(
+            '--candidates',
+            type=int,
+            default=ANN_RERANK_CANDIDATES,
+            help="ANN candidates re-ranked exactly per query"
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        rows, dims, k = options['rows'], options['dims'], options['k']
+        vectors = _clustered_vectors(rng, rows, dims, clusters=max(1, rows // 500))
+        queries = vectors[rng.choice(rows, options['queries'], replace=False)]
+        noise = rng.standard_normal(queries.shape).astype(np.float32)
+        queries = queries + 0.3 * noise / np.linalg.norm(noise, axis=1, keepdims=True)
+        queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+        ids = [f"{i:036d}" for i in range(rows)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.monotonic()
+            meta = write_index(directory, ids, vectors, seed=options['seed'])
+            self.stdout.write(
+                f"build: {rows} rows x {dims} dims, {meta['nlist']} lists, "
+                f"{meta['subquantizers']} subquantizers in {time.monotonic() - started:.2f}s"
+            )
+            index = RoomANNIndex(directory)
+
+            exact, exact_seconds = [], []
+            for query in queries:
+                started = time.monotonic()
+                scores = vectors @ query
+                top = np.argpartition(-scores, k - 1)[:k]
+                exact.append(set(top[np.argsort(-scores[top])].tolist()))
+                exact_seconds.append(time.monotonic() - started)
+            self.stdout.write(
+                f"exact: recall@{k} 1.000, p50 {_percentile_ms(exact_seconds, 50):.2f}ms, "
+                f"p99 {_percentile_ms(exact_seconds, 99):.2f}ms"
+            )
+
+            for nprobe in [int(value) for value in options['nprobe'].split(',')]:
+                hits, seconds = 0, []
+                for query, expected in zip(queries, exact):
+                    started = time.monotonic()
+                    candidates, _ = index.search(query, max(k, options['candidates']), nprobe)
+                    # Re-rank with exact vectors, as the service does with stored embeddings
+                    rows_found = np.array([int(memory_id) for memory_id in candidates], dtype=np.int64)
+                    reranked = rows_found[np.argsort(-(vectors[rows_found] @ query))[:k]]
+                    seconds.append(time.monotonic() - started)
+                    hits += len(expected & set(reranked.tolist()))
+                self.stdout.write(
+                    f"ann nprobe={nprobe}: recall@{k} {hits / (k * len(queries)):.3f}, "
+                    f"p50 {_percentile_ms(seconds, 50):.2f}ms, p99 {_percentile_ms(seconds, 99):.2f}ms"
+                )
@@ -0,0 +1,375 @@
+"""
+Load-test the AI endpoints against a local fake LLM provider.
+
+By default runs fully offline in this process: a fake Zhipu API
+(``llm.fake_provider``) answers model calls, the endpoints are called
+through Django's ASGI handler, and all databases are throwaway copies in
+a temporary directory. With ``--url`` it drives a running server instead,
+which should itself be pointed at ``run_fake_llm``.
+
+Requests go to ``/api/ai/admin``, ``/api/ai/actor`` and
+``/api/memory/cleanup`` (``--mix``) for ``--rooms`` rooms, picked with a
+Zipf distribution (``--skew``) so a few rooms get most of the traffic.
+Reports throughput and p50/p95/p99 latency per endpoint. ``--save-baseline``
+keeps the results under ``--name``; later runs of the same scenario are
+compared against it and regressions beyond ``--tolerance`` are reported.
+
+Usage:
+    python manage.py benchmark_load --requests 500 --concurrency 32
+    python manage.py benchmark_load --latency fixed:0.2 --save-baseline
+    python manage.py benchmark_load --fail-on-regression
+    python manage.py benchmark_load --url http://localhost:8000 --requests 2000
+"""
+
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from bisect import bisect
+from itertools import accumulate
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient
+
+from llm.db_router import room_databases
+from llm.fake_provider import FakeProvider
+
+ENDPOINTS = {
+    'admin': '/api/ai/admin',
+    'actor': '/api/ai/actor',
+    'actor_stream': '/api/ai/actor/stream',
+    'cleanup': '/api/memory/cleanup'
+}
+
+CHARACTERS = ["勇者亚瑟", "法师梅林", "黑暗领主", "游侠罗宾"]
+
+# Results compared against the baseline, and whether higher is better
+COMPARED = (('throughput', True), ('p50_ms', False), ('p95_ms', False), ('p99_ms', False))
+
+
+def _parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ENDPOINTS:
+            raise CommandError(f"未知的接口: {name}（可选 {', '.join(ENDPOINTS)}）")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f"无效的权重: {part}")
+    if not any(weight > 0 for weight in mix.values()):
+        raise CommandError("--mix至少需要一个正权重")
+    return mix
+
+
+class _Picker:
+    """Weighted random choice over fixed items."""
+
+    def __init__(self, items: List[Any], weights: List[float]):
+        self.items = items
+        self.cumulative = list(accumulate(weights))
+
+    def pick(self, rng: random.Random) -> Any:
+        return self.items[bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+def _room_body(endpoint: str, room: str, sequence: int) -> Dict[str, Any]:
+    """A realistic request body; the sequence keeps bodies distinct for idempotency."""
+    if endpoint == 'cleanup':
+        return {'room_id': room}
+    speaker, actor = CHARACTERS[sequence % len(CHARACTERS)], CHARACTERS[(sequence + 1) % len(CHARACTERS)]
+    body = {
+        'roomId': room,
+        'characterId': f"{room}-admin",
+        'history_dialogues': f"{speaker}：我们在第{sequence}个路口分头行动吧，天黑之前在城堡汇合。",
+        'character_settings': [f"{name}：王国中的一位重要人物，性格鲜明。" for name in CHARACTERS],
+        'worldview': "在一个充满魔法的中世纪王国里，黑暗领主正在威胁整个世界。",
+        'previous_speaker_id': f"{room}-{speaker}",
+        'previous_speaker_name': speaker,
+        'previous_speaker_location': "城堡大厅",
+        'previous_speaker_status': "警惕"
+    }
+    if endpoint in ('actor', 'actor_stream'):
+        body.update({
+            'characterId': f"{room}-{actor}",
+            'character_name': actor,
+            'current_location': "城堡大厅",
+            'status': "平静"
+        })
+    return body
+
+
+class InProcessTarget:
+    """Calls the endpoints through Django's ASGI handler."""
+
+    def __init__(self):
+        self.client = AsyncClient()
+
+    async def post(self, path: str, body: bytes, headers: Optional[Dict[str, str]] = None) -> int:
+        response = await self.client.post(path, body, content_type='application/json', headers=headers)
+        if response.streaming:
+            async for _ in response.streaming_content:
+                pass
+        return response.status_code
+
+    async def close(self) -> None:
+        pass
+
+
+class HTTPTarget:
+    """Calls the endpoints of a running server."""
+
+    def __init__(self, url: str, concurrency: int):
+        self.client = httpx.AsyncClient(
+            base_url=url,
+            timeout=httpx.Timeout(settings.LLM_REQUEST_TIMEOUT),
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        )
+
+    async def post(self, path: str, body: bytes, headers: Optional[Dict[str, str]] = None) -> int:
+        async with self.client.stream(
+            'POST', path, content=body, headers={'Content-Type': 'application/json', **(headers or {})}
+        ) as response:
+            async for _ in response.aiter_bytes():
+                pass
+            return response.status_code
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def summarize(samples: List[float], statuses: Dict[str, int], elapsed: float) -> Dict[str, Any]:
+    errors = sum(count for status, count in statuses.items() if int(status) >= 400 and status != '409')
+    summary = {
+        'requests': len(samples),
+        'errors': errors,
+        'statuses': dict(sorted(statuses.items())),
+        'throughput': round(len(samples) / elapsed, 2) if elapsed else 0.0
+    }
+    for percentile in (50, 95, 99):
+        summary[f'p{percentile}_ms'] = round(float(np.percentile(samples, percentile)) * 1000, 1) if samples else 0.0
+    return summary
+
+
+def isolate(base_url: str, directory: str) -> List:
+    """
+    Point model calls at a fake provider and every database at a temporary
+    copy; returns what ``teardown`` needs to drop the copies.
+    """
+    settings.ZHIPU_BASE_URL = base_url
+    settings.ZHIPU_API_KEY = settings.ZHIPU_API_KEY or 'fake-key'
+    settings.EMBEDDING_PROVIDER = 'fake'
+    settings.LONG_TERM_ANN_DIR = os.path.join(directory, 'ann_index')
+    settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+    settings.TRACE_ENABLED = False
+
+    test_databases = []
+    for alias in dict.fromkeys(['default'] + room_databases()):
+        connection = connections[alias]
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, f'{alias}.sqlite3')
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        test_databases.append((connection, old_name))
+    return test_databases
+
+
+def teardown(test_databases: List) -> None:
+    from llm.views.utils import write_buffer
+
+    # Pending group commits go to the test databases before they are dropped
+    write_buffer.close()
+    for connection, old_name in test_databases:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+class Command(BaseCommand):
+    help = "Load-test the AI endpoints offline against a fake LLM provider and compare with a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server; default runs in this process")
+        parser.add_argument('--requests', type=int, default=500, help="Measured requests")
+        parser.add_argument('--warmup', type=int, default=20, help="Requests sent before measuring")
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--rooms', type=int, default=200)
+        parser.add_argument('--skew', type=float, default=1.1, help="Zipf exponent of room popularity (0: uniform)")
+        parser.add_argument('--mix', default='admin=3,actor=6,cleanup=1', help="Endpoint weights, e.g. admin=3,actor=6")
+        parser.add_argument(
+            '--latency',
+            default='lognormal:0.8,0.5',
+            help="Fake model latency: fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA (seconds)"
+        )
+        parser.add_argument('--chunk-delay', type=float, default=0.02, help="Seconds between fake stream chunks")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of fake model calls failing with 503")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--name', default='default', help="Scenario name in the baseline file")
+        parser.add_argument(
+            '--baseline',
+            default=os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'),
+            help="Baseline results file"
+        )
+        parser.add_argument('--save-baseline', action='store_true', help="Store this run as the scenario's baseline")
+        parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed relative regression")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        mix = _parse_mix(options['mix'])
+        scenario = {
+            key: options[key]
+            for key in ('requests', 'concurrency', 'rooms', 'skew', 'mix', 'latency', 'chunk_delay', 'error_rate', 'seed')
+        }
+        scenario['target'] = options['url'] or 'in-process'
+
+        provider = None
+        test_databases = []
+        temp_dir = None
+        if options['url']:
+            target = HTTPTarget(options['url'].rstrip('/'), options['concurrency'])
+        else:
+            try:
+                provider = FakeProvider(
+                    latency=options['latency'],
+                    chunk_delay=options['chunk_delay'],
+                    error_rate=options['error_rate'],
+                    seed=options['seed']
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+            temp_dir = tempfile.TemporaryDirectory()
+            test_databases = isolate(provider.start(), temp_dir.name)
+            target = InProcessTarget()
+
+        try:
+            results = asyncio.run(self._run(target, mix, options))
+        finally:
+            if provider is not None:
+                teardown(test_databases)
+                provider.stop()
+                temp_dir.cleanup()
+
+        self._report(results, provider)
+        self._compare(scenario, results, options)
+
+    async def _run(self, target, mix: Dict[str, float], options) -> Dict[str, Any]:
+        rng = random.Random(options['seed'])
+        rooms = [f"bench-room-{index:05d}" for index in range(options['rooms'])]
+        room_picker = _Picker(rooms, [1 / (rank + 1) ** options['skew'] for rank in range(len(rooms))])
+        endpoint_picker = _Picker(list(mix), list(mix.values()))
+
+        total = options['warmup'] + options['requests']
+        issued = 0
+        samples: Dict[str, List[float]] = {name: [] for name in mix}
+        statuses: Dict[str, Dict[str, int]] = {name: {} for name in mix}
+        measuring_started: Optional[float] = None
+
+        async def worker():
+            nonlocal issued, measuring_started
+            while issued < total:
+                sequence = issued
+                issued += 1
+                endpoint = endpoint_picker.pick(rng)
+                body = json.dumps(_room_body(endpoint, room_picker.pick(rng), sequence), ensure_ascii=False)
+                if sequence == options['warmup'] and measuring_started is None:
+                    measuring_started = time.monotonic()
+
+                started = time.monotonic()
+                try:
+                    status = str(await target.post(ENDPOINTS[endpoint], body.encode('utf-8')))
+                except Exception as e:
+                    status = type(e).__name__
+                if sequence >= options['warmup']:
+                    samples[endpoint].append(time.monotonic() - started)
+                    statuses[endpoint][status] = statuses[endpoint].get(status, 0) + 1
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(options['concurrency'])])
+        finally:
+            await target.close()
+        elapsed = time.monotonic() - (measuring_started or time.monotonic())
+
+        results = {'elapsed': round(elapsed, 2), 'endpoints': {}}
+        for name in mix:
+            if samples[name]:
+                results['endpoints'][name] = summarize(samples[name], _numeric(statuses[name]), elapsed)
+        results['total'] = summarize(
+            [sample for values in samples.values() for sample in values],
+            _merge([_numeric(values) for values in statuses.values()]),
+            elapsed
+        )
+        return results
+
+    def _report(self, results: Dict[str, Any], provider: Optional[FakeProvider]) -> None:
+        self.stdout.write(f"{results['total']['requests']} requests in {results['elapsed']}s")
+        self.stdout.write(f"{'endpoint':<14}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, summary in [*results['endpoints'].items(), ('total', results['total'])]:
+            self.stdout.write(
+                f"{name:<14}{summary['requests']:>9}{summary['errors']:>8}{summary['throughput']:>9}"
+                f"{summary['p50_ms']:>10}{summary['p95_ms']:>10}{summary['p99_ms']:>10}"
+            )
+        if provider is not None:
+            self.stdout.write(f"fake provider: {provider.stats()}")
+
+    def _compare(self, scenario: Dict[str, Any], results: Dict[str, Any], options) -> None:
+        baselines = {}
+        if os.path.exists(options['baseline']):
+            with open(options['baseline'], encoding='utf-8') as file:
+                baselines = json.load(file)
+
+        baseline = baselines.get(options['name'])
+        regressions = []
+        if baseline is not None:
+            if baseline['scenario'] != scenario:
+                self.stdout.write(self.style.WARNING(
+                    f"Baseline '{options['name']}' was recorded with other parameters: {baseline['scenario']}"
+                ))
+            current = {**results['endpoints'], 'total': results['total']}
+            for name, before in {**baseline['results']['endpoints'], 'total': baseline['results']['total']}.items():
+                after = current.get(name)
+                if after is None:
+                    continue
+                for metric, higher_is_better in COMPARED:
+                    if not before[metric]:
+                        continue
+                    change = (after[metric] - before[metric]) / before[metric]
+                    if (-change if higher_is_better else change) > options['tolerance']:
+                        regressions.append(f"{name} {metric}: {before[metric]} -> {after[metric]} ({change:+.1%})")
+            if regressions:
+                for line in regressions:
+                    self.stdout.write(self.style.ERROR(f"REGRESSION {line}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"No regression against baseline '{options['name']}' (tolerance {options['tolerance']:.0%})"
+                ))
+
+        if options['save_baseline']:
+            baselines[options['name']] = {'scenario': scenario, 'results': results}
+            os.makedirs(os.path.dirname(options['baseline']) or '.', exist_ok=True)
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump(baselines, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Saved baseline '{options['name']}' to {options['baseline']}")
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{len(regressions)} regressions against baseline '{options['name']}'")
+
+
+def _numeric(statuses: Dict[str, int]) -> Dict[str, int]:
+    """Client-side failures (no HTTP status) are counted as 599."""
+    counts: Dict[str, int] = {}
+    for status, count in statuses.items():
+        key = status if status.isdigit() else '599'
+        counts[key] = counts.get(key, 0) + count
+    return counts
+
+
+def _merge(statuses: List[Dict[str, int]]) -> Dict[str, int]:
+    merged: Dict[str, int] = {}
+    for counts in statuses:
+        for status, count in counts.items():
+            merged[status] = merged.get(status, 0) + count
+    return merged
@@ -0,0 +1,56 @@
+"""
+Build the on-disk ANN index of long-term memories of rooms.
+
+Usage:
+    python manage.py build_ann_index --room-id <room_id>
+    python manage.py build_ann_index --all
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from llm.db_router import room_databases
+from llm.models import LongTermMemory
+from llm.views.utils import ann_store
+
+
+class Command(BaseCommand):
+    help = "Build the ANN index of long-term memories of rooms"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room-id', help="Build this room")
+        parser.add_argument('--all', action='store_true', help="Build every room with enough long-term memories")
+        parser.add_argument(
+            '--min-rows',
+            type=int,
+            default=settings.LONG_TERM_ANN_MIN_ROWS,
+            help="Minimum long-term memories of a room for --all"
+        )
+
+    def handle(self, *args, **options):
+        if options['room_id']:
+            room_ids = [options['room_id']]
+        elif options['all']:
+            room_ids = [
+                room_id
+                for database in room_databases()
+                for room_id in LongTermMemory.objects.using(database).values('room_id').annotate(
+                    rows=Count('id')
+                ).filter(rows__gte=options['min_rows']).values_list('room_id', flat=True)
+            ]
+        else:
+            raise CommandError("Specify --room-id or --all")
+
+        for room_id in room_ids:
+            started = time.monotonic()
+            meta = ann_store.build(room_id)
+            if meta is None:
+                self.stdout.write(f"{room_id}: skipped (no embeddings or already building)")
+                continue
+            self.stdout.write(
+                f"{room_id}: {meta['rows']} rows, {meta['nlist']} lists, "
+                f"{meta['subquantizers']} subquantizers in {time.monotonic() - started:.2f}s"
+            )
@@ -0,0 +1,48 @@
+"""
+Compact conversation history into short-term memories.
+
+Usage:
+    python manage.py compact_memories --room-id <room_id>
+    python manage.py compact_memories --all
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from llm.db_router import room_databases
+from llm.models import RoomStats
+from llm.views.utils import compact_room, COMPACTION_THRESHOLD
+
+
+class Command(BaseCommand):
+    help = "Summarize old conversation history of rooms into short-term memories"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room-id', help="Compact this room")
+        parser.add_argument('--all', action='store_true', help="Compact every room above the threshold")
+        parser.add_argument('--force', action='store_true', help="Compact even below the threshold")
+        parser.add_argument('--max-batches', type=int, help="Maximum batches per room")
+
+    def handle(self, *args, **options):
+        if options['room_id']:
+            room_ids = [options['room_id']]
+        elif options['all']:
+            room_ids = [
+                room_id
+                for database in room_databases()
+                for room_id in RoomStats.objects.using(database).filter(
+                    dialogue_count__gt=0 if options['force'] else COMPACTION_THRESHOLD
+                ).values_list('room_id', flat=True)
+            ]
+        else:
+            raise CommandError("Specify --room-id or --all")
+
+        for room_id in room_ids:
+            report = compact_room(room_id, force=options['force'], max_batches=options['max_batches'])
+            stages = ", ".join(
+                f"{stage} {values['rows']} rows/{values['seconds']}s"
+                for stage, values in report['stages'].items()
+            )
+            self.stdout.write(
+                f"{room_id}: {report['status']}, {report['batches']} batches, "
+                f"{report['rows_deleted']} rows compacted in {report['seconds']}s ({stages})"
+            )
@@ -0,0 +1,110 @@
+"""
+Create the room shard databases and move rooms to the shard they hash to.
+
+Run after setting or raising ``ROOM_SHARDS``, with the service stopped:
+rooms in ``default`` or in a shard they no longer hash to are copied to
+their shard and then deleted from where they were. A run that is
+interrupted can simply be run again.
+
+Usage:
+    python manage.py migrate_room_shards
+    python manage.py migrate_room_shards --dry-run
+"""
+
+import os
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from llm.db_router import room_db, room_databases
+from llm.models import (
+    ConversationHistory,
+    ShortTermMemory,
+    LongTermMemory,
+    AdminAnalysisRecord,
+    RoomStats,
+    CompactionCheckpoint
+)
+
+# RoomStats last, so its count can be recomputed from the moved history
+MODELS = (ConversationHistory, ShortTermMemory, LongTermMemory, AdminAnalysisRecord, CompactionCheckpoint, RoomStats)
+
+COPY_CHUNK = 1000
+
+
+class Command(BaseCommand):
+    help = "Migrate the room shard databases and move rooms to the shard of their room ID"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report the rooms that would move")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if settings.ROOM_SHARDS and not options['dry_run']:
+            os.makedirs(settings.ROOM_SHARD_DIR, exist_ok=True)
+            for database in room_databases():
+                call_command('migrate', database=database, verbosity=0)
+                self.stdout.write(f"{database}: migrated")
+
+        sources = ['default'] + [database for database in room_databases() if database != 'default']
+        moved_rooms = 0
+        moved_rows = {model._meta.model_name: 0 for model in MODELS}
+        for source in sources:
+            # Shards not created yet (dry run) hold no rooms; don't connect,
+            # which would fail on a missing directory or leave empty files
+            if not os.path.exists(connections[source].settings_dict['NAME']):
+                continue
+            if ConversationHistory._meta.db_table not in connections[source].introspection.table_names():
+                continue
+            room_ids = set()
+            for model in MODELS:
+                room_ids.update(model.objects.using(source).values_list('room_id', flat=True).distinct())
+            misplaced = sorted(room_id for room_id in room_ids if room_db(room_id) != source)
+            if not misplaced:
+                continue
+
+            self.stdout.write(f"{source}: {len(misplaced)} rooms to move")
+            if options['dry_run']:
+                continue
+            for room_id in misplaced:
+                for name, rows in self._move_room(room_id, source, room_db(room_id)).items():
+                    moved_rows[name] += rows
+                moved_rooms += 1
+
+        rows = ", ".join(f"{name} {count}" for name, count in moved_rows.items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved_rooms} rooms ({rows}) in {time.monotonic() - started:.2f}s"
+        ))
+
+    def _move_room(self, room_id, source, target):
+        """Copy the rows of a room to its shard, then delete them from the source."""
+        moved = {}
+        with transaction.atomic(using=target):
+            for model in MODELS:
+                rows = model.objects.using(source).filter(room_id=room_id).order_by('pk')
+                chunk = []
+                moved[model._meta.model_name] = 0
+                for row in rows.iterator(chunk_size=COPY_CHUNK):
+                    chunk.append(row)
+                    if len(chunk) == COPY_CHUNK:
+                        moved[model._meta.model_name] += self._copy(model, chunk, target)
+                        chunk = []
+                moved[model._meta.model_name] += self._copy(model, chunk, target)
+
+            # Rows copied by an interrupted earlier run are skipped above, so count again
+            RoomStats.objects.using(target).filter(room_id=room_id).update(
+                dialogue_count=ConversationHistory.objects.using(target).filter(room_id=room_id).count()
+            )
+
+        with transaction.atomic(using=source):
+            for model in MODELS:
+                model.objects.using(source).filter(room_id=room_id).delete()
+        return moved
+
+    def _copy(self, model, rows, target):
+        if rows:
+            model.objects.using(target).bulk_create(rows, ignore_conflicts=True)
+        return len(rows)
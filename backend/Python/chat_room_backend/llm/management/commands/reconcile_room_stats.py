@@ -0,0 +1,75 @@
+"""
+Rebuild per-room stats from conversation history.
+
+Running servers keep the dialogue counts of recently active rooms in
+their memory cache and don't see the rebuilt counts until they restart,
+so restart them after a run that changed anything.
+
+Usage:
+    python manage.py reconcile_room_stats
+    python manage.py reconcile_room_stats --room-id <room_id>
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+
+from llm.db_router import room_db, room_databases
+from llm.models import ConversationHistory, RoomStats
+
+
+class Command(BaseCommand):
+    help = "Rebuild room_stats (dialogue count, last activity, last speaker) from conversation_histories"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room-id', help="Only reconcile this room")
+
+    def handle(self, *args, **options):
+        if options['room_id']:
+            databases = [room_db(options['room_id'])]
+        else:
+            databases = room_databases()
+
+        reconciled = 0
+        changed = 0
+        removed = 0
+        for database in databases:
+            histories = ConversationHistory.objects.using(database).all()
+            if options['room_id']:
+                histories = histories.filter(room_id=options['room_id'])
+
+            rooms = histories.values('room_id').annotate(
+                dialogue_count=Count('id'),
+                last_activity_at=Max('created_at')
+            ).order_by('room_id')
+
+            seen_rooms = set()
+            for room in rooms.iterator():
+                room_id = room['room_id']
+                seen_rooms.add(room_id)
+                last_dialogue = histories.filter(room_id=room_id).order_by('-created_at').first()
+
+                with transaction.atomic(using=database):
+                    stats, created = RoomStats.objects.using(database).select_for_update().get_or_create(
+                        room_id=room_id
+                    )
+                    if created or stats.dialogue_count != room['dialogue_count']:
+                        changed += 1
+                    stats.dialogue_count = room['dialogue_count']
+                    stats.last_activity_at = room['last_activity_at']
+                    stats.last_speaker_id = last_dialogue.character_id
+                    stats.last_speaker_name = last_dialogue.character_name
+                    stats.save(using=database)
+
+                reconciled += 1
+
+            # Stats of rooms whose history no longer exists
+            stale_stats = RoomStats.objects.using(database).exclude(room_id__in=seen_rooms)
+            if options['room_id']:
+                stale_stats = stale_stats.filter(room_id=options['room_id'])
+            deleted, _ = stale_stats.delete()
+            removed += deleted
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled {reconciled} rooms ({changed} changed, {removed} stale stats removed)"
+        ))
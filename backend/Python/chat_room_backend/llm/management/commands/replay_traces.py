@@ -0,0 +1,189 @@
+"""
+Replay recorded request traces (``TRACE_ENABLED``) through the AI views.
+
+Requests are sent again with their recorded bodies and headers, spaced as
+they arrived divided by ``--speed`` (0: back to back, up to
+``--concurrency`` at a time). By default the replay runs in this process
+against throwaway databases, with model calls answered by
+``RecordedProvider`` from the recorded provider responses and latencies
+(also divided by ``--speed``). With ``--url`` it drives a running server,
+which should be pointed at ``run_fake_llm --traces`` with the same traces.
+
+In process, each request is served the core memory snapshots recorded with
+it instead of what the replay's databases hold, so its prompts, and the
+model calls matched by them, are the recorded ones.
+
+Reports per view the replayed latency percentiles next to the recorded
+ones, responses whose status differs from the recorded one, and how the
+model calls were matched to recorded responses.
+
+Usage:
+    python manage.py replay_traces traces/
+    python manage.py replay_traces traces/ --speed 4 --view actor --view admin
+    python manage.py replay_traces traces/trace-20250101-120000-4242-0000.ndjson.gz --speed 0 --limit 1000
+"""
+
+import asyncio
+import contextvars
+import importlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from llm.fake_provider import RecordedProvider
+from llm.views.utils import aload_core_memory, read_traces
+from .benchmark_load import HTTPTarget, InProcessTarget, isolate, summarize, teardown
+
+
+def _request_body(record: Dict[str, Any]) -> bytes:
+    if 'raw_body' in record:
+        return record['raw_body'].encode('utf-8')
+    return json.dumps(record['request'], ensure_ascii=False).encode('utf-8')
+
+
+# Views loading core memory, by module
+CORE_MEMORY_VIEWS = ('ai_admin', 'ai_actor', 'ai_actor_stream', 'ai_actor_batch', 'ai_turn')
+
+_recorded_core_memory: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    'recorded_core_memory', default=None
+)
+
+
+async def _aload_recorded_core_memory(room_id: str, query_text: Optional[str] = None):
+    """Serve the next core memory snapshot recorded for a room by the replayed request."""
+    snapshots = _recorded_core_memory.get() or []
+    for index, snapshot in enumerate(snapshots):
+        if snapshot['room_id'] == room_id:
+            del snapshots[index]
+            return list(snapshot['core_memory']), snapshot['total_dialogues']
+    return await aload_core_memory(room_id, query_text)
+
+
+@contextmanager
+def _seeded_core_memory():
+    """Make the views load core memory from the replayed request's snapshots."""
+    modules = [importlib.import_module(f'llm.views.{name}') for name in CORE_MEMORY_VIEWS]
+    for module in modules:
+        module.aload_core_memory = _aload_recorded_core_memory
+    try:
+        yield
+    finally:
+        for module in modules:
+            module.aload_core_memory = aload_core_memory
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    return {
+        f'p{percentile}_ms': round(float(np.percentile(samples, percentile)) * 1000, 1) if samples else 0.0
+        for percentile in (50, 95, 99)
+    }
+
+
+class Command(BaseCommand):
+    help = "Replay recorded request traces against the recorded model responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Trace files or directories")
+        parser.add_argument('--url', help="Base URL of a running server; default replays in this process")
+        parser.add_argument('--speed', type=float, default=1.0, help="Replay speed-up; 0: no pacing or model latency")
+        parser.add_argument('--concurrency', type=int, default=256, help="Requests in flight at most")
+        parser.add_argument('--view', action='append', help="Only replay these views (repeatable)")
+        parser.add_argument('--limit', type=int, help="Replay only the first N requests")
+
+    def handle(self, *args, **options):
+        if options['speed'] < 0:
+            raise CommandError("--speed不能为负数")
+        missing = [path for path in options['paths'] if not os.path.exists(path)]
+        if missing:
+            raise CommandError(f"路径不存在: {', '.join(missing)}")
+
+        records = [
+            record for record in read_traces(options['paths'])
+            if record.get('method') == 'POST' and (not options['view'] or record['view'] in options['view'])
+        ]
+        records.sort(key=lambda record: record['ts'])
+        if options['limit']:
+            records = records[:options['limit']]
+        if not records:
+            raise CommandError("没有可重放的请求")
+        self.stdout.write(f"Replaying {len(records)} requests at speed {options['speed']}")
+
+        provider = None
+        test_databases = []
+        temp_dir = None
+        if options['url']:
+            target = HTTPTarget(options['url'].rstrip('/'), options['concurrency'])
+        else:
+            provider = RecordedProvider(records, speed=options['speed'])
+            temp_dir = tempfile.TemporaryDirectory()
+            test_databases = isolate(provider.start(), temp_dir.name)
+            target = InProcessTarget()
+
+        try:
+            with _seeded_core_memory() if provider is not None else nullcontext():
+                results, elapsed = asyncio.run(self._replay(target, records, options))
+        finally:
+            if provider is not None:
+                teardown(test_databases)
+                provider.stop()
+                temp_dir.cleanup()
+
+        self._report(records, results, elapsed, provider)
+
+    async def _replay(self, target, records: List[Dict[str, Any]], options):
+        speed = options['speed']
+        slots = asyncio.Semaphore(options['concurrency'])
+        first_ts = records[0]['ts']
+        started = time.monotonic()
+
+        async def send(record):
+            # Each request runs in its own task, so sees only its own snapshots
+            _recorded_core_memory.set(list(record.get('core_memory') or []))
+            if speed:
+                delay = (record['ts'] - first_ts) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            async with slots:
+                request_started = time.monotonic()
+                try:
+                    status = await target.post(record['path'], _request_body(record), record.get('headers'))
+                except Exception:
+                    status = 599
+                return status, time.monotonic() - request_started
+
+        try:
+            results = await asyncio.gather(*[send(record) for record in records])
+        finally:
+            await target.close()
+        return results, time.monotonic() - started
+
+    def _report(self, records, results, elapsed: float, provider) -> None:
+        views: Dict[str, Dict[str, Any]] = {}
+        for record, (status, seconds) in zip(records, results):
+            view = views.setdefault(record['view'], {'samples': [], 'recorded': [], 'statuses': {}, 'changed': 0})
+            view['samples'].append(seconds)
+            view['recorded'].append(record['duration'])
+            view['statuses'][str(status)] = view['statuses'].get(str(status), 0) + 1
+            view['changed'] += status != record['status']
+
+        self.stdout.write(f"{len(records)} requests in {elapsed:.2f}s")
+        self.stdout.write(
+            f"{'view':<16}{'requests':>9}{'errors':>8}{'changed':>9}{'req/s':>9}"
+            f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  recorded p50/p95/p99 ms"
+        )
+        for name, view in sorted(views.items()):
+            summary = summarize(view['samples'], view['statuses'], elapsed)
+            recorded = _percentiles(view['recorded'])
+            self.stdout.write(
+                f"{name:<16}{summary['requests']:>9}{summary['errors']:>8}{view['changed']:>9}"
+                f"{summary['throughput']:>9}{summary['p50_ms']:>10}{summary['p95_ms']:>10}{summary['p99_ms']:>10}"
+                f"  {recorded['p50_ms']}/{recorded['p95_ms']}/{recorded['p99_ms']}"
+            )
+        if provider is not None:
+            self.stdout.write(f"model calls matched by: {provider.stats()['matches']}")
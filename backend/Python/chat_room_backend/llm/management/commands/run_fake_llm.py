@@ -0,0 +1,73 @@
+"""
+Serve a local stand-in for the Zhipu API, for load tests without an API key.
+
+Point the service at it with ``ZHIPU_BASE_URL`` (any ``ZHIPU_API_KEY``
+works) and ``EMBEDDING_PROVIDER=fake``.
+
+With ``--traces`` it answers with the provider responses recorded in
+request traces, for ``replay_traces --url``.
+
+Usage:
+    python manage.py run_fake_llm --port 8765 --latency lognormal:0.8,0.5
+    python manage.py run_fake_llm --latency fixed:0.2 --error-rate 0.01
+    python manage.py run_fake_llm --traces traces/ --speed 2
+"""
+
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from llm.fake_provider import FakeProvider, RecordedProvider
+from llm.views.utils import read_traces
+
+
+class Command(BaseCommand):
+    help = "Serve a fake Zhipu chat completions and embeddings API"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--latency',
+            default='lognormal:0.8,0.5',
+            help="Call latency: fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA (seconds)"
+        )
+        parser.add_argument('--chunk-delay', type=float, default=0.02, help="Seconds between stream chunks")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of calls answered with 503")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--traces',
+            action='append',
+            help="Trace file or directory whose recorded responses are served (repeatable)"
+        )
+        parser.add_argument('--speed', type=float, default=1.0, help="Recorded latencies are divided by this; 0: none")
+
+    def handle(self, *args, **options):
+        if options['traces']:
+            missing = [path for path in options['traces'] if not os.path.exists(path)]
+            if missing:
+                raise CommandError(f"路径不存在: {', '.join(missing)}")
+            provider = RecordedProvider(read_traces(options['traces']), speed=options['speed'])
+            source = f"responses of {', '.join(options['traces'])}"
+        else:
+            try:
+                provider = FakeProvider(
+                    latency=options['latency'],
+                    chunk_delay=options['chunk_delay'],
+                    error_rate=options['error_rate'],
+                    seed=options['seed']
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+            source = f"latency {options['latency']}"
+
+        base_url = provider.bind(options['host'], options['port'])
+        self.stdout.write(f"Fake LLM API at {base_url} ({source})")
+        self.stdout.write(f"Run the service with ZHIPU_BASE_URL={base_url} EMBEDDING_PROVIDER=fake")
+        try:
+            provider.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            provider.stop()
+            self.stdout.write(f"Served {provider.stats()}")
@@ -0,0 +1,22 @@
+"""
+Middleware of the llm application.
+"""
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+
+class LargeResponseGZipMiddleware(GZipMiddleware):
+    """
+    Gzip responses of at least ``GZIP_MIN_BYTES`` bytes.
+
+    Smaller bodies are not worth the CPU, and streamed (SSE) responses are
+    left alone so their events are not held back by the compressor.
+    """
+
+    def process_response(self, request, response):
+        if not settings.GZIP_MIN_BYTES or response.streaming:
+            return response
+        if len(response.content) < settings.GZIP_MIN_BYTES:
+            return response
+        return super().process_response(request, response)
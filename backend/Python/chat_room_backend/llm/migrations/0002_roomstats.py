@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomStats',
+            fields=[
+                ('room_id', models.CharField(max_length=36, primary_key=True, serialize=False)),
+                ('dialogue_count', models.IntegerField(default=0)),
+                ('last_activity_at', models.DateTimeField(blank=True, null=True)),
+                ('last_speaker_id', models.CharField(blank=True, max_length=36, null=True)),
+                ('last_speaker_name', models.CharField(blank=True, max_length=50, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'room_stats',
+            },
+        ),
+    ]
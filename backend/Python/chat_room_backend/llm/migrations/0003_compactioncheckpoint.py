@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm', '0002_roomstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompactionCheckpoint',
+            fields=[
+                ('room_id', models.CharField(max_length=36, primary_key=True, serialize=False)),
+                ('status', models.CharField(default='idle', max_length=20)),
+                ('boundary_created_at', models.DateTimeField(blank=True, null=True)),
+                ('boundary_id', models.CharField(blank=True, max_length=36, null=True)),
+                ('memory_id', models.CharField(blank=True, max_length=36, null=True)),
+                ('compacted_rows', models.IntegerField(default=0)),
+                ('lock_owner', models.CharField(blank=True, max_length=36, null=True)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'compaction_checkpoints',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm', '0004_embeddingcache'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='longtermmemory',
+            index=models.Index(fields=['room_id', 'updated_at'], name='long_term_room_updated_idx'),
+        ),
+    ]
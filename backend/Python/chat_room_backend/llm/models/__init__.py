@@ -2,7 +2,10 @@ from .schemas import (
     AdminRequest,
     AdminResponse,
     ActorRequest,
-    ActorResponse
+    ActorResponse,
+    BatchActorCharacter,
+    BatchActorRequest,
+    TurnRequest
 )
 
 from .db_models import (
@@ -10,6 +13,9 @@ from .db_models import (
     LongTermMemory,
     ConversationHistory,
     AdminAnalysisRecord,
+    RoomStats,
+    CompactionCheckpoint,
+    EmbeddingCache,
     generate_uuid
 )
 
@@ -18,9 +24,15 @@ __all__ = [
     'AdminResponse',
     'ActorRequest',
     'ActorResponse',
+    'BatchActorCharacter',
+    'BatchActorRequest',
+    'TurnRequest',
     'ShortTermMemory',
     'LongTermMemory',
     'ConversationHistory',
     'AdminAnalysisRecord',
+    'RoomStats',
+    'CompactionCheckpoint',
+    'EmbeddingCache',
     'generate_uuid'
 ]
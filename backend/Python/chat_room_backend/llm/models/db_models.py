@@ -33,6 +33,8 @@ class LongTermMemory(models.Model):
         db_table = 'long_term_memories'
         indexes = [
             models.Index(fields=['room_id']),
+            # Covers the version check of cached room embeddings
+            models.Index(fields=['room_id', 'updated_at'], name='long_term_room_updated_idx'),
         ]
 
 
@@ -69,3 +71,42 @@ class AdminAnalysisRecord(models.Model):
             models.Index(fields=['room_id', 'created_at']),
             models.Index(fields=['room_id', 'character_id']),
         ]
+
+
+class RoomStats(models.Model):
+    room_id = models.CharField(max_length=36, primary_key=True)
+    dialogue_count = models.IntegerField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+    last_speaker_id = models.CharField(max_length=36, null=True, blank=True)
+    last_speaker_name = models.CharField(max_length=50, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'room_stats'
+
+
+class CompactionCheckpoint(models.Model):
+    STATUS_IDLE = 'idle'
+    STATUS_SUMMARIZED = 'summarized'
+
+    room_id = models.CharField(max_length=36, primary_key=True)
+    status = models.CharField(max_length=20, default=STATUS_IDLE)
+    boundary_created_at = models.DateTimeField(null=True, blank=True)
+    boundary_id = models.CharField(max_length=36, null=True, blank=True)
+    memory_id = models.CharField(max_length=36, null=True, blank=True)
+    compacted_rows = models.IntegerField(default=0)
+    lock_owner = models.CharField(max_length=36, null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'compaction_checkpoints'
+
+
+class EmbeddingCache(models.Model):
+    content_hash = models.CharField(max_length=64, primary_key=True)
+    embedding = models.BinaryField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'embedding_cache'
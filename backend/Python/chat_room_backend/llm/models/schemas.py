@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -36,6 +36,39 @@ class ActorRequest(BaseModel):
     previous_speaker_status: str
 
 
+class BatchActorCharacter(BaseModel):
+    characterId: str
+    character_name: str
+    current_location: str
+    status: str
+
+
+class BatchActorRequest(BaseModel):
+    roomId: str
+    history_dialogues: str
+    character_settings: List[str]
+    worldview: str
+    characters: List[BatchActorCharacter]
+    previous_speaker_id: str
+    previous_speaker_name: str
+    previous_speaker_location: str
+    previous_speaker_status: str
+
+
+class TurnRequest(BaseModel):
+    roomId: str
+    characterId: str
+    history_dialogues: str
+    character_settings: List[str]
+    worldview: str
+    characters: List[BatchActorCharacter]
+    previous_speaker_id: str
+    previous_speaker_name: str
+    previous_speaker_location: str
+    previous_speaker_status: str
+    speculative: Optional[bool] = None
+
+
 class ActorResponse(BaseModel):
     roomId: str
     characterId: str
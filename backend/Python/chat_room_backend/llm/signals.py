@@ -0,0 +1,51 @@
+"""
+Signal handlers of the llm application.
+
+Writes new conversation history and short-term memory rows through to the
+per-room core memory cache once they are committed. When a long-term
+memory is saved, the cached embedding matrix of its room is dropped and
+the memory is appended to the room's ANN index, if it has one.
+Code that deletes rows of a room invalidates the room in the caches
+itself, so queryset deletes stay fast deletes.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models.db_models import ConversationHistory, ShortTermMemory, LongTermMemory
+from .views.utils.memory_cache import memory_cache
+from .views.utils.long_term_memory_utils import long_term_index, decode_embedding
+from .views.utils.ann_index import ann_store
+from .views.utils.memory_utils import dialogue_to_core_memory, memory_to_core_memory
+
+
+@receiver(post_save, sender=ConversationHistory)
+def cache_saved_dialogue(sender, instance, created, **kwargs):
+    if created:
+        item = dialogue_to_core_memory(instance)
+        transaction.on_commit(
+            lambda: memory_cache.append(instance.room_id, instance.id, item),
+            using=kwargs.get('using')
+        )
+
+
+@receiver(post_save, sender=ShortTermMemory)
+def cache_saved_memory(sender, instance, created, **kwargs):
+    if created:
+        item = memory_to_core_memory(instance)
+        transaction.on_commit(
+            lambda: memory_cache.append(instance.room_id, instance.id, item),
+            using=kwargs.get('using')
+        )
+
+
+@receiver(post_save, sender=LongTermMemory)
+def index_saved_long_term_memory(sender, instance, **kwargs):
+    def update_indexes():
+        long_term_index.invalidate(instance.room_id)
+        if instance.embedding:
+            vector = decode_embedding(bytes(instance.embedding))
+            ann_store.append(instance.room_id, [instance.id], vector.reshape(1, -1))
+
+    transaction.on_commit(update_indexes, using=kwargs.get('using'))
@@ -1,3 +1,859 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import types
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from .models import ConversationHistory, ShortTermMemory, RoomStats, CompactionCheckpoint
+from .views.utils import (
+    ToolArgumentsParser,
+    compact_room,
+    save_dialogues,
+    LLMGovernor,
+    LLMOverloadedError,
+    RoomANNIndex,
+    ANNIndexStore,
+    RoomScheduler,
+    write_index,
+    estimate_tokens,
+    truncate_to_tokens,
+    build_room_prompts
+)
+from .views.utils import (
+    ai_utils,
+    compaction_utils,
+    history_utils,
+    idempotency_utils,
+    llm_resilience,
+    long_term_memory_utils
+)
+from .views.utils.history_utils import GroupCommitWriter
+from .views.utils.llm_resilience import CircuitBreaker, LLMTarget, is_provider_failure
+from .views.utils.idempotency_utils import IdempotencyCache, idempotent, idempotent_step_done, mark_idempotent_step
+from .views.utils.long_term_memory_utils import LongTermMemoryIndex, RoomEmbeddings
+from .views.utils.ann_index import encode, train_quantizers
+from .views.utils.memory_cache import RoomMemoryCache
+from .views.utils.prompt_utils import _BudgetedPrompt, format_core_memory_item
+
+
+def _feed_all(parser, chunks):
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events
+
+
+class ToolArgumentsParserTests(SimpleTestCase):
+    arguments = {
+        "character_name": "张三",
+        "response_content": "你好，\"朋友\"\n再见",
+        "next_speaker": "李四",
+        "score": 3,
+        "tags": ["a", {"b": "]}"}]
+    }
+
+    def test_result_matches_json_whatever_the_chunking(self):
+        text = json.dumps(self.arguments, ensure_ascii=False)
+        for size in (1, 2, 7, len(text)):
+            parser = ToolArgumentsParser()
+            _feed_all(parser, [text[i:i + size] for i in range(0, len(text), size)])
+            self.assertTrue(parser.done)
+            self.assertEqual(parser.result(), self.arguments)
+
+    def test_string_values_are_streamed_as_deltas(self):
+        text = json.dumps(self.arguments, ensure_ascii=False)
+        parser = ToolArgumentsParser()
+        events = _feed_all(parser, list(text))
+
+        deltas = "".join(event[2] for event in events if event[:2] == ("delta", "response_content"))
+        self.assertEqual(deltas, self.arguments["response_content"])
+        fields = {event[1]: event[2] for event in events if event[0] == "field"}
+        self.assertEqual(fields, self.arguments)
+
+    def test_partial_returns_decoded_prefix(self):
+        parser = ToolArgumentsParser()
+        parser.feed('{"response_content": "你好\\n世')
+        self.assertEqual(parser.partial("response_content"), "你好\n世")
+        self.assertFalse(parser.done)
+        with self.assertRaises(ValueError):
+            parser.result()
+
+    def test_escapes_split_across_chunks(self):
+        text = '{"response_content": "\\u4f60\\ud83d\\ude00\\t"}'
+        parser = ToolArgumentsParser()
+        _feed_all(parser, [text[i:i + 3] for i in range(0, len(text), 3)])
+        self.assertEqual(parser.result(), {"response_content": "你\U0001F600\t"})
+
+    def test_rejects_malformed_arguments(self):
+        with self.assertRaises(ValueError):
+            ToolArgumentsParser().feed('["response_content"]')
+
+
+def _dialogue(content):
+    return {"type": "dialogue", "character_id": "c1", "character_name": "张三", "content": content}
+
+
+def _memory(content):
+    return {"type": "memory", "content": content}
+
+
+class RoomMemoryCacheTests(SimpleTestCase):
+    def test_rooms_are_misses_until_loaded(self):
+        cache = RoomMemoryCache(max_rooms=10, max_bytes=10 ** 6)
+        self.assertIsNone(cache.get("r1"))
+        cache.begin_load("r1")
+        self.assertIsNone(cache.get("r1"))
+        cache.finish_load("r1", [_dialogue("d1"), _memory("m1")], 1, {"d1"})
+        self.assertEqual(cache.get("r1"), ([_dialogue("d1"), _memory("m1")], 1))
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (1, 2))
+
+    def test_writes_during_load_are_merged_once(self):
+        cache = RoomMemoryCache(max_rooms=10, max_bytes=10 ** 6)
+        cache.begin_load("r1")
+        # d2 committed before the load read the table, d3 after
+        cache.append("r1", "d2", _dialogue("d2"))
+        cache.append("r1", "d3", _dialogue("d3"))
+        cache.append("r1", "m2", _memory("m2"))
+        cache.finish_load("r1", [_dialogue("d1"), _dialogue("d2")], 2, {"d1", "d2"})
+
+        core_memory, total_dialogues = cache.get("r1")
+        self.assertEqual(
+            [item["content"] for item in core_memory],
+            ["d1", "d2", "d3", "m2"]
+        )
+        self.assertEqual(total_dialogues, 3)
+
+    def test_writes_to_uncached_rooms_are_ignored(self):
+        cache = RoomMemoryCache(max_rooms=10, max_bytes=10 ** 6)
+        cache.append("r1", "d1", _dialogue("d1"))
+        cache.finish_load("r1", [_dialogue("d1")], 1, {"d1"})
+        self.assertIsNone(cache.get("r1"))
+
+    def test_invalidate_during_load_discards_it(self):
+        cache = RoomMemoryCache(max_rooms=10, max_bytes=10 ** 6)
+        cache.begin_load("r1")
+        cache.invalidate("r1")
+        cache.finish_load("r1", [_dialogue("d1")], 1, {"d1"})
+        self.assertIsNone(cache.get("r1"))
+
+    def test_evicts_least_recently_used_room(self):
+        cache = RoomMemoryCache(max_rooms=2, max_bytes=10 ** 6)
+        for room_id in ("r1", "r2"):
+            cache.begin_load(room_id)
+            cache.finish_load(room_id, [_dialogue(room_id)], 1, {room_id})
+        cache.get("r1")
+        cache.begin_load("r3")
+        cache.finish_load("r3", [_dialogue("r3")], 1, {"r3"})
+
+        self.assertIsNotNone(cache.get("r1"))
+        self.assertIsNone(cache.get("r2"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+def _unit_vectors(rows, dims, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(rows, dims)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class IVFPQIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_encode_assigns_nearest_list_and_codes(self):
+        vectors = _unit_vectors(300, 16)
+        centroids, codebooks = train_quantizers(vectors, nlist=8, subquantizers=4)
+        lists, codes = encode(vectors, centroids, codebooks)
+
+        self.assertEqual(codes.shape, (300, 4))
+        self.assertEqual(codes.dtype, np.uint8)
+        distances = ((vectors[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+        np.testing.assert_array_equal(lists, distances.argmin(axis=1))
+
+        # Decoded vectors are closer to the originals than their centroids alone
+        decoded = centroids[lists] + np.concatenate(
+            [codebooks[j][codes[:, j]] for j in range(4)], axis=1
+        )
+        self.assertLess(
+            np.linalg.norm(decoded - vectors, axis=1).mean(),
+            np.linalg.norm(centroids[lists] - vectors, axis=1).mean()
+        )
+
+    def test_search_finds_stored_vectors(self):
+        vectors = _unit_vectors(500, 64)
+        ids = [f"m{i}" for i in range(500)]
+        meta = write_index(self.directory.name, ids, vectors)
+        index = RoomANNIndex(self.directory.name)
+        self.assertEqual(index.rows, 500)
+
+        found = 0
+        for i in range(0, 500, 25):
+            result_ids, scores = index.search(vectors[i], candidates=10, nprobe=meta['nlist'])
+            self.assertEqual(len(result_ids), 10)
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+            found += ids[i] in result_ids
+        self.assertGreaterEqual(found, 18)
+
+    def test_appended_vectors_are_searchable(self):
+        vectors = _unit_vectors(300, 64)
+        meta = write_index(self.directory.name, [f"m{i}" for i in range(300)], vectors)
+        index = RoomANNIndex(self.directory.name)
+
+        fresh = _unit_vectors(1, 64, seed=1)
+        self.assertEqual(index.append(["fresh"], fresh), 1)
+        result_ids, _ = index.search(fresh[0], candidates=5, nprobe=meta['nlist'])
+        self.assertIn("fresh", result_ids)
+
+    def test_room_directories_stay_under_root(self):
+        store = ANNIndexStore(self.directory.name)
+        for room_id in ("../../etc", "/tmp/x", "r1"):
+            room_dir = store.room_dir(room_id)
+            self.assertEqual(os.path.dirname(room_dir), self.directory.name)
+        self.assertNotEqual(store.room_dir("a"), store.room_dir("b"))
+
+
+class RoomSchedulerTests(SimpleTestCase):
+    async def _queue(self, scheduler, room_id, name, order):
+        await scheduler.acquire(room_id)
+        order.append(name)
+
+    async def test_turns_of_a_room_run_in_arrival_order(self):
+        scheduler = RoomScheduler(max_tracked_rooms=10)
+        order = []
+        await scheduler.acquire("r1")
+        waiters = [asyncio.create_task(self._queue(scheduler, "r1", name, order)) for name in "abc"]
+        await asyncio.sleep(0)
+        # Other rooms are not held up
+        await asyncio.wait_for(scheduler.acquire("r2"), 1)
+
+        for expected in ("a", "b", "c"):
+            scheduler.release("r1")
+            await asyncio.wait_for(waiters["abc".index(expected)], 1)
+            self.assertEqual(order[-1], expected)
+        scheduler.release("r1")
+        scheduler.release("r2")
+        self.assertEqual(scheduler.stats()["active_rooms"], 0)
+
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        scheduler = RoomScheduler(max_tracked_rooms=10)
+        order = []
+        await scheduler.acquire("r1")
+        cancelled = asyncio.create_task(self._queue(scheduler, "r1", "cancelled", order))
+        waiter = asyncio.create_task(self._queue(scheduler, "r1", "next", order))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await cancelled
+        scheduler.release("r1")
+        await asyncio.wait_for(waiter, 1)
+        self.assertEqual(order, ["next"])
+        scheduler.release("r1")
+
+    async def test_turn_handed_to_cancelled_waiter_passes_on(self):
+        scheduler = RoomScheduler(max_tracked_rooms=10)
+        order = []
+        await scheduler.acquire("r1")
+        cancelled = asyncio.create_task(self._queue(scheduler, "r1", "cancelled", order))
+        waiter = asyncio.create_task(self._queue(scheduler, "r1", "next", order))
+        await asyncio.sleep(0)
+
+        # The turn is handed over before the cancellation is delivered
+        scheduler.release("r1")
+        cancelled.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await cancelled
+        await asyncio.wait_for(waiter, 1)
+        self.assertEqual(order, ["next"])
+        scheduler.release("r1")
+        self.assertEqual(scheduler.stats()["active_rooms"], 0)
+
+
+class LLMGovernorTests(SimpleTestCase):
+    def _governor(self, max_queue=10, queue_timeout=5.0):
+        return LLMGovernor(
+            max_concurrency=1,
+            requests_per_minute=0,
+            tokens_per_minute=0,
+            max_queue=max_queue,
+            queue_timeout=queue_timeout
+        )
+
+    async def _run(self, governor, priority, order):
+        ticket = await governor.aadmit(priority, 100)
+        order.append(priority)
+        governor.release(ticket)
+
+    async def test_queued_calls_run_by_priority(self):
+        governor = self._governor()
+        running = await governor.aadmit('admin', 100)
+        order = []
+        tasks = [
+            asyncio.create_task(self._run(governor, priority, order))
+            for priority in ('compaction', 'admin', 'actor', 'actor')
+        ]
+        await asyncio.sleep(0)
+        self.assertEqual(governor.queued, 4)
+
+        governor.release(running)
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        self.assertEqual(order, ['actor', 'actor', 'admin', 'compaction'])
+        self.assertEqual(governor.in_flight, 0)
+
+    async def test_full_queue_sheds_lowest_priority_call(self):
+        governor = self._governor(max_queue=2)
+        running = await governor.aadmit('admin', 100)
+        compaction = asyncio.create_task(governor.aadmit('compaction', 100))
+        admin = asyncio.create_task(governor.aadmit('admin', 100))
+        await asyncio.sleep(0)
+
+        # An actor call takes the place of the queued compaction
+        actor = asyncio.create_task(governor.aadmit('actor', 100))
+        with self.assertRaises(LLMOverloadedError) as raised:
+            await asyncio.wait_for(compaction, 1)
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+
+        # Nothing queued has a lower priority than another admin call
+        with self.assertRaises(LLMOverloadedError):
+            await governor.aadmit('admin', 100)
+        self.assertEqual(governor.stats()['shed'], {'actor': 0, 'admin': 1, 'compaction': 1, 'speculative': 0})
+
+        governor.release(running)
+        governor.release(await asyncio.wait_for(actor, 1))
+        governor.release(await asyncio.wait_for(admin, 1))
+
+    async def test_queue_timeout_rejects_waiting_call(self):
+        governor = self._governor(queue_timeout=0.05)
+        running = await governor.aadmit('actor', 100)
+        with self.assertRaises(LLMOverloadedError):
+            await governor.aadmit('actor', 100)
+        self.assertEqual(governor.queued, 0)
+        self.assertEqual(governor.timed_out, 1)
+
+        governor.release(running)
+        governor.release(await governor.aadmit('actor', 100))
+
+    def test_try_admit_never_queues(self):
+        governor = self._governor()
+        ticket = governor.try_admit('admin', 100)
+        self.assertIsNotNone(ticket)
+        self.assertIsNone(governor.try_admit('actor', 100))
+        governor.release(ticket)
+        self.assertIsNotNone(governor.try_admit('actor', 100))
+
+
+def _summary_result(summary):
+    return {"type": "tool_call", "tool_name": "summarize_memory", "tool_arguments": {"summary": summary}}
+
+
+@mock.patch.object(compaction_utils, 'call_ai_model', return_value=_summary_result("整理后的记忆"))
+class CompactionTests(TestCase):
+    room_id = "compaction-room"
+
+    def setUp(self):
+        save_dialogues([
+            ConversationHistory(room_id=self.room_id, character_id="c1", character_name="张三", content=f"第{i}句")
+            for i in range(100)
+        ])
+
+    def _remaining(self):
+        return ConversationHistory.objects.filter(room_id=self.room_id).count()
+
+    def _assert_stats_match(self):
+        self.assertEqual(RoomStats.objects.get(room_id=self.room_id).dialogue_count, self._remaining())
+
+    def test_compacts_all_but_recent_rows(self, call_ai_model):
+        report = compact_room(self.room_id)
+
+        self.assertEqual(report['status'], 'success')
+        self.assertEqual(report['batches'], 4)
+        self.assertEqual(report['rows_deleted'], 80)
+        self.assertEqual(self._remaining(), 20)
+        self.assertEqual(ShortTermMemory.objects.filter(room_id=self.room_id).count(), 4)
+        self._assert_stats_match()
+        checkpoint = CompactionCheckpoint.objects.get(room_id=self.room_id)
+        self.assertEqual((checkpoint.status, checkpoint.lock_owner), (CompactionCheckpoint.STATUS_IDLE, None))
+
+    def test_max_batches_is_respected(self, call_ai_model):
+        report = compact_room(self.room_id, max_batches=2)
+
+        self.assertEqual(report['batches'], 2)
+        self.assertEqual(call_ai_model.call_count, 2)
+        self.assertEqual(self._remaining(), 60)
+        self._assert_stats_match()
+
+    def test_lease_blocks_concurrent_run(self, call_ai_model):
+        self.assertTrue(compaction_utils._acquire_lease(self.room_id, "other-run"))
+
+        report = compact_room(self.room_id)
+
+        self.assertEqual(report['status'], 'busy')
+        self.assertEqual(self._remaining(), 100)
+        call_ai_model.assert_not_called()
+        # The other run's lease is left alone
+        self.assertEqual(CompactionCheckpoint.objects.get(room_id=self.room_id).lock_owner, "other-run")
+
+    def test_crash_after_summary_resumes_delete(self, call_ai_model):
+        with mock.patch.object(compaction_utils, '_delete_compacted', side_effect=RuntimeError("crash")):
+            with self.assertRaises(RuntimeError):
+                compact_room(self.room_id, max_batches=1)
+        self.assertEqual(CompactionCheckpoint.objects.get(room_id=self.room_id).status,
+                         CompactionCheckpoint.STATUS_SUMMARIZED)
+        self.assertEqual(self._remaining(), 100)
+
+        report = compact_room(self.room_id, max_batches=0)
+
+        # The summarized batch is deleted without being summarized again
+        self.assertEqual(report['rows_deleted'], 20)
+        self.assertEqual(report['memories_created'], 0)
+        self.assertEqual(call_ai_model.call_count, 1)
+        self.assertEqual(ShortTermMemory.objects.filter(room_id=self.room_id).count(), 1)
+        self.assertEqual(self._remaining(), 80)
+        self._assert_stats_match()
+        self.assertEqual(CompactionCheckpoint.objects.get(room_id=self.room_id).status,
+                         CompactionCheckpoint.STATUS_IDLE)
+
+    def test_empty_summary_keeps_dialogues(self, call_ai_model):
+        for empty in (_summary_result(" \n"), _summary_result(None), {"type": "text", "content": ""}):
+            call_ai_model.return_value = empty
+            with self.assertRaises(RuntimeError):
+                compact_room(self.room_id)
+
+            self.assertEqual(self._remaining(), 100)
+            self.assertFalse(ShortTermMemory.objects.filter(room_id=self.room_id).exists())
+            checkpoint = CompactionCheckpoint.objects.get(room_id=self.room_id)
+            self.assertEqual((checkpoint.status, checkpoint.lock_owner), (CompactionCheckpoint.STATUS_IDLE, None))
+            self._assert_stats_match()
+
+
+class IdempotencyCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        clock = types.SimpleNamespace(monotonic=lambda: self.now)
+        patcher = mock.patch.object(idempotency_utils, 'time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_waiters_get_the_result_of_the_running_call(self):
+        cache = IdempotencyCache(ttl=60, max_items=10)
+        entry, future, owner = cache.begin("k")
+        self.assertTrue(owner)
+        _, waiter_future, waiter_owner = cache.begin("k")
+        self.assertFalse(waiter_owner)
+        self.assertIs(waiter_future, future)
+        self.assertFalse(future.done())
+
+        cache.finish("k", entry, future, JsonResponse({"ok": 1}))
+        self.assertEqual(future.result().status, 200)
+        _, replay_future, replay_owner = cache.begin("k")
+        self.assertFalse(replay_owner)
+        self.assertEqual(replay_future.result().content, b'{"ok": 1}')
+        self.assertEqual((cache.stats()['misses'], cache.stats()['waits'], cache.stats()['hits']), (1, 1, 1))
+
+    def test_failed_call_stores_nothing_but_keeps_steps(self):
+        cache = IdempotencyCache(ttl=60, max_items=10)
+        entry, future, _ = cache.begin("k")
+        cache.mark_step("k", "history")
+        cache.finish("k", entry, future, JsonResponse({"error": "x"}, status=500))
+        self.assertIsNone(future.result())
+
+        retry_entry, retry_future, owner = cache.begin("k")
+        self.assertTrue(owner)
+        self.assertIs(retry_entry, entry)
+        self.assertTrue(cache.step_done("k", "history"))
+        self.assertFalse(cache.step_done("k", "save"))
+        cache.finish("k", retry_entry, retry_future, None)
+        self.assertEqual(cache.stats()['stored'], 0)
+
+    def test_entries_expire_after_ttl(self):
+        cache = IdempotencyCache(ttl=60, max_items=10)
+        entry, future, _ = cache.begin("k")
+        # Running calls never expire
+        self.now += 3600
+        self.assertFalse(cache.begin("k")[2])
+        cache.finish("k", entry, future, JsonResponse({}))
+
+        self.now += 59
+        self.assertFalse(cache.begin("k")[2])
+        self.now += 2
+        self.assertTrue(cache.begin("k")[2])
+
+    def test_evicted_running_call_still_answers_its_waiters(self):
+        cache = IdempotencyCache(ttl=60, max_items=1)
+        entry, future, _ = cache.begin("a")
+        _, waiter_future, _ = cache.begin("a")
+        # Entries over max_items are evicted oldest first when the next call begins
+        cache.begin("b")
+        cache.begin("c")
+        self.assertEqual(cache.stats()['in_flight'], 2)
+
+        cache.finish("a", entry, future, JsonResponse({"ok": 1}))
+        self.assertEqual(waiter_future.result().status, 200)
+        # The evicted key runs again
+        self.assertTrue(cache.begin("a")[2])
+
+
+@override_settings(IDEMPOTENCY_ENABLED=True, IDEMPOTENCY_HASH_BODY=False)
+class IdempotentViewTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(idempotency_utils, 'idempotency_cache', IdempotencyCache(ttl=60, max_items=10))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+        self.calls = []
+
+    def _request(self, key=None):
+        headers = {'Idempotency-Key': key} if key else {}
+        return self.factory.post('/api/ai/actor', b'{}', content_type='application/json', headers=headers)
+
+    async def test_concurrent_retries_share_one_call(self):
+        release = asyncio.Event()
+
+        @idempotent
+        async def view(request):
+            self.calls.append(request)
+            await release.wait()
+            return JsonResponse({"n": len(self.calls)})
+
+        first = asyncio.create_task(view(self._request("k")))
+        retry = asyncio.create_task(view(self._request("k")))
+        await asyncio.sleep(0.01)
+        release.set()
+        responses = await asyncio.wait_for(asyncio.gather(first, retry), 1)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual([response.content for response in responses], [b'{"n": 1}'] * 2)
+        self.assertEqual(responses[1][idempotency_utils.REPLAYED_HEADER], 'true')
+
+    async def test_retry_after_failure_skips_completed_steps(self):
+        @idempotent
+        async def view(request):
+            self.calls.append(idempotent_step_done(request, 'history'))
+            mark_idempotent_step(request, 'history')
+            return JsonResponse({}, status=500 if len(self.calls) == 1 else 200)
+
+        self.assertEqual((await view(self._request("k"))).status_code, 500)
+        self.assertEqual((await view(self._request("k"))).status_code, 200)
+        self.assertEqual(self.calls, [False, True])
+
+    async def test_requests_without_key_always_run(self):
+        @idempotent
+        async def view(request):
+            self.calls.append(request)
+            return JsonResponse({})
+
+        await view(self._request())
+        await view(self._request())
+        self.assertEqual(len(self.calls), 2)
+
+
+def _status_error(status):
+    request = httpx.Request('POST', 'http://llm.test/chat/completions')
+    return httpx.HTTPStatusError('error', request=request, response=httpx.Response(status, request=request))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        clock = types.SimpleNamespace(monotonic=lambda: self.now)
+        patcher = mock.patch.object(llm_resilience, 'time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_classifies_provider_failures(self):
+        request = httpx.Request('POST', 'http://llm.test/chat/completions')
+        for status in (429, 500, 503):
+            self.assertTrue(is_provider_failure(_status_error(status)))
+        for status in (400, 401, 404, 422):
+            self.assertFalse(is_provider_failure(_status_error(status)))
+        self.assertTrue(is_provider_failure(httpx.ConnectTimeout('timeout', request=request)))
+        self.assertTrue(is_provider_failure(httpx.ReadError('reset', request=request)))
+        self.assertFalse(is_provider_failure(ValueError('bad arguments')))
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3, cooldown=30)
+        for _ in range(2):
+            breaker.record_failure(_status_error(503))
+        # Request errors neither count nor reset the streak
+        breaker.record_failure(_status_error(400))
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.stats()['state'], 'closed')
+
+        breaker.record_failure(_status_error(429))
+        self.assertEqual(breaker.stats()['state'], 'open')
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.retry_after(), 30)
+        self.assertEqual(breaker.stats()['rejected'], 1)
+
+    def test_success_resets_the_streak(self):
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=30)
+        breaker.record_failure(_status_error(500))
+        breaker.record_success()
+        breaker.record_failure(_status_error(500))
+        self.assertEqual(breaker.stats()['state'], 'closed')
+
+    def test_half_open_lets_one_probe_per_cooldown(self):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+        breaker.record_failure(_status_error(502))
+        self.now += 30
+        self.assertEqual(breaker.stats()['state'], 'half_open')
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        # A failed probe keeps it open for another cooldown
+        breaker.record_failure(_status_error(502))
+        self.now += 29
+        self.assertFalse(breaker.allow())
+        self.now += 1
+        self.assertTrue(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.stats()['state'], 'closed')
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.stats()['opened'], 1)
+
+
+class HedgedCompletionTests(SimpleTestCase):
+    request_params = {"messages": [{"role": "user", "content": "你好"}], "tools": []}
+
+    def setUp(self):
+        self.primary = LLMTarget('primary', None, 'model', CircuitBreaker(5, 30))
+        self.backup = LLMTarget('hedge', 'backup-key', 'model', CircuitBreaker(5, 30))
+        self.calls = []
+        self.cancelled = []
+        self.latency = {}
+        patcher = mock.patch.object(ai_utils, '_apost_completion', self._post)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(ai_utils.llm_monitor, 'hedge_delay', return_value=0.02)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def _post(self, target, request_params, timeout):
+        self.calls.append(target.name)
+        try:
+            await asyncio.sleep(self.latency[target.name])
+        except asyncio.CancelledError:
+            self.cancelled.append(target.name)
+            raise
+        return {"choices": [{"message": {"content": target.name}}], "usage": {"total_tokens": 10}}
+
+    def _hedged(self, targets):
+        with mock.patch.object(ai_utils, 'llm_targets', return_value=targets):
+            return asyncio.run(ai_utils._ahedged_completion(dict(self.request_params), None, 'actor'))
+
+    def test_first_success_wins_and_loser_is_cancelled(self):
+        self.latency = {'primary': 5.0, 'hedge': 0.01}
+        result = self._hedged([self.primary, self.backup])
+
+        self.assertEqual(result["choices"][0]["message"]["content"], 'hedge')
+        self.assertEqual(self.calls, ['primary', 'hedge'])
+        self.assertEqual(self.cancelled, ['primary'])
+
+    def test_fast_call_is_not_hedged(self):
+        self.latency = {'primary': 0.0, 'hedge': 0.0}
+        result = self._hedged([self.primary, self.backup])
+
+        self.assertEqual(result["choices"][0]["message"]["content"], 'primary')
+        self.assertEqual(self.calls, ['primary'])
+
+    def test_no_hedge_without_a_second_target(self):
+        self.latency = {'primary': 0.05}
+        result = self._hedged([self.primary])
+
+        self.assertEqual(result["choices"][0]["message"]["content"], 'primary')
+        self.assertEqual(self.calls, ['primary'])
+
+    def test_no_hedge_to_an_open_target(self):
+        self.latency = {'primary': 0.05, 'hedge': 0.0}
+        for _ in range(5):
+            self.backup.breaker.record_failure(_status_error(503))
+        self._hedged([self.primary, self.backup])
+
+        self.assertEqual(self.calls, ['primary'])
+
+
+class GroupCommitWriterTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+        patcher = mock.patch.object(history_utils, '_write', self._write)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.writer = GroupCommitWriter(window=0.05, max_rows=100)
+        self.addCleanup(self.writer.close, 1)
+
+    def _write(self, dialogues, analyses):
+        self.batches.append([dialogue.content for dialogue in dialogues])
+        if any(dialogue.content == 'bad' for dialogue in dialogues):
+            raise ValueError('bad row')
+
+    def _submit(self, content):
+        return self.writer.submit([ConversationHistory(room_id="r1", character_id="c1", content=content)])
+
+    def test_concurrent_writes_are_committed_together(self):
+        futures = [self._submit(content) for content in ("a", "b", "c")]
+        for future in futures:
+            self.assertIsNone(future.result(timeout=1))
+
+        self.assertEqual(self.batches, [["a", "b", "c"]])
+        stats = self.writer.stats()
+        self.assertEqual((stats['batches'], stats['jobs'], stats['max_batch_jobs']), (1, 3, 3))
+
+    def test_failed_batch_is_retried_job_by_job(self):
+        futures = [self._submit(content) for content in ("a", "bad", "c")]
+
+        self.assertIsNone(futures[0].result(timeout=1))
+        with self.assertRaises(ValueError):
+            futures[1].result(timeout=1)
+        self.assertIsNone(futures[2].result(timeout=1))
+        self.assertEqual(self.batches, [["a", "bad", "c"], ["a"], ["bad"], ["c"]])
+        stats = self.writer.stats()
+        self.assertEqual((stats['split_batches'], stats['failed_jobs']), (1, 1))
+
+    def test_nothing_to_write_is_not_submitted(self):
+        with mock.patch.object(history_utils, 'write_buffer', self.writer):
+            asyncio.run(history_utils.asave_dialogues([]))
+        self.assertEqual(self.writer.stats()['jobs'], 0)
+        self.assertEqual(self.batches, [])
+
+
+class LongTermMemoryIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.version = (1, 'v1')
+        self.checks = 0
+        self.loads = 0
+        clock = types.SimpleNamespace(monotonic=lambda: self.now)
+        for name, value in (
+            ('time', clock),
+            ('room_embeddings_version', self._version),
+            ('load_room_embeddings', self._load)
+        ):
+            patcher = mock.patch.object(long_term_memory_utils, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.index = LongTermMemoryIndex(max_bytes=1 << 20, check_seconds=30)
+
+    def _version(self, room_id):
+        self.checks += 1
+        return self.version
+
+    def _load(self, room_id):
+        self.loads += 1
+        return RoomEmbeddings(['m1'], ['memory'], ['t'], np.ones((1, 4), dtype=np.float32), self.version)
+
+    def test_cached_room_is_checked_at_most_every_check_seconds(self):
+        room = self.index.load('r1')
+        self.now += 10
+        self.assertIs(self.index.load('r1'), room)
+        self.assertEqual((self.loads, self.checks), (1, 0))
+
+        self.now += 25
+        self.assertIs(self.index.load('r1'), room)
+        self.now += 10
+        self.assertIs(self.index.load('r1'), room)
+        self.assertEqual((self.loads, self.checks), (1, 1))
+
+    def test_room_written_by_another_process_is_reloaded_after_check(self):
+        room = self.index.load('r1')
+        self.version = (2, 'v2')
+        self.assertIs(self.index.load('r1'), room)
+
+        self.now += 30
+        reloaded = self.index.load('r1')
+        self.assertIsNot(reloaded, room)
+        self.assertEqual(reloaded.version, (2, 'v2'))
+        stats = self.index.stats()
+        self.assertEqual((stats['loads'], stats['checks'], stats['stale']), (2, 1, 1))
+
+    def test_invalidated_room_is_reloaded_without_check(self):
+        self.index.load('r1')
+        self.index.invalidate('r1')
+        self.index.load('r1')
+        self.assertEqual((self.loads, self.checks), (2, 0))
+
+
+def _core_memory_item(kind, content):
+    item = {'type': kind, 'content': content, 'timestamp': '2025-01-01T00:00:00'}
+    if kind == 'dialogue':
+        item.update(character_name='张三', character_id='c1', location='大厅', status='在线')
+    return item
+
+
+class PromptBudgetTests(SimpleTestCase):
+    def setUp(self):
+        self.core_memory = [_core_memory_item('memory', '记忆' * 5)]
+        self.core_memory.extend(_core_memory_item('dialogue', f'对话{i}' * 10) for i in range(4))
+        self.core_memory.append(_core_memory_item('long_term_memory', '长期' * 5))
+
+    def _build(self, budget):
+        return build_room_prompts('世界观' * 10, ['设定一', '设定二'], self.core_memory, [None], budget)
+
+    def _tokens(self, index):
+        # +1 for the joining newline, as the budget counts it
+        return estimate_tokens(format_core_memory_item(self.core_memory[index])) + 1
+
+    def test_truncate_to_tokens(self):
+        self.assertEqual(estimate_tokens('字' * 4 + 'abcdefgh'), 6)
+        self.assertEqual(truncate_to_tokens('字' * 10, 10), '字' * 10)
+        truncated = truncate_to_tokens('字' * 100, 10)
+        self.assertEqual(truncated, '字' * 9 + '…')
+        self.assertEqual(estimate_tokens(truncated), 10)
+
+    def test_entries_are_truncated_at_max_entry_share(self):
+        prompt = _BudgetedPrompt(100)
+        self.assertEqual(prompt.entry_limit, 25)
+        line = prompt.add('dialogues', '字' * 50)
+        self.assertEqual(line, '字' * 24 + '…')
+        # Lines that are not entries are neither truncated nor dropped
+        self.assertEqual(prompt.add('instructions', '字' * 90, entry=False), '字' * 90)
+        self.assertIsNone(prompt.add('memories', '字'))
+        self.assertEqual(prompt.usage(), {
+            'budget': 100,
+            'used': 117,
+            'sections': {'dialogues': 26, 'instructions': 91},
+            'included': {'dialogues': 1},
+            'dropped': {'memories': 1},
+            'truncated': 1
+        })
+
+    def test_unbounded_prompt_reports_usage_per_section(self):
+        _, prompts, usage = self._build(0)
+        self.assertIsNone(usage['budget'])
+        self.assertEqual(usage['used'], sum(usage['sections'].values()))
+        self.assertEqual(usage['sections']['dialogues'], sum(self._tokens(i) for i in range(1, 5)))
+        self.assertEqual(usage['sections']['memories'], self._tokens(0))
+        self.assertEqual(usage['sections']['long_term_memories'], self._tokens(5))
+        self.assertEqual(usage['included'], {
+            'worldview': 1, 'character_settings': 2, 'dialogues': 4, 'memories': 1, 'long_term_memories': 1
+        })
+        self.assertEqual((usage['dropped'], usage['truncated']), ({}, 0))
+        # Short-term memories, dialogues, then long-term memories
+        lines = prompts[0].split('\n')
+        self.assertEqual(lines[1:7], [format_core_memory_item(item) for item in self.core_memory])
+
+    def test_budget_fills_settings_then_recent_dialogues_then_memories(self):
+        full = self._build(0)[2]['used']
+
+        # Room for everything but two dialogues and the memories
+        budget = full - self._tokens(0) - self._tokens(1) - self._tokens(2) - self._tokens(5)
+        _, prompts, usage = self._build(budget)
+        self.assertEqual(usage['used'], budget)
+        self.assertEqual(usage['included'], {'worldview': 1, 'character_settings': 2, 'dialogues': 2})
+        self.assertEqual(usage['dropped'], {'dialogues': 2, 'memories': 1, 'long_term_memories': 1})
+        self.assertEqual(
+            prompts[0].split('\n')[1:3],
+            [format_core_memory_item(self.core_memory[3]), format_core_memory_item(self.core_memory[4])]
+        )
+
+        # Memories follow once every dialogue fits
+        _, _, usage = self._build(full - self._tokens(5))
+        self.assertEqual(usage['included']['dialogues'], 4)
+        self.assertEqual(usage['included']['memories'], 1)
+        self.assertEqual(usage['dropped'], {'long_term_memories': 1})
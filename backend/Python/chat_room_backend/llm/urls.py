@@ -1,8 +1,13 @@
 from django.urls import path
-from .views import ai_admin, ai_actor, memory_cleanup
+from .views import ai_admin, ai_actor, ai_actor_stream, ai_actor_batch, ai_turn, memory_cleanup, ai_stats, ai_metrics
 
 urlpatterns = [
     path('api/ai/admin', ai_admin, name='ai_admin'),
     path('api/ai/actor', ai_actor, name='ai_actor'),
+    path('api/ai/actor/stream', ai_actor_stream, name='ai_actor_stream'),
+    path('api/ai/actor/batch', ai_actor_batch, name='ai_actor_batch'),
+    path('api/ai/turn', ai_turn, name='ai_turn'),
     path('api/memory/cleanup', memory_cleanup, name='memory_cleanup'),
+    path('api/ai/stats', ai_stats, name='ai_stats'),
+    path('metrics', ai_metrics, name='ai_metrics'),
 ]
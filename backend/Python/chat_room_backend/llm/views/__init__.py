@@ -6,6 +6,10 @@ This package contains all view functions for the LLM application.
 
 from .ai_admin import ai_admin
 from .ai_actor import ai_actor
+from .ai_actor_stream import ai_actor_stream
+from .ai_actor_batch import ai_actor_batch
+from .ai_turn import ai_turn
 from .memory_cleanup import memory_cleanup
+from .stats import ai_stats, ai_metrics
 
-__all__ = ['ai_admin', 'ai_actor', 'memory_cleanup']
\ No newline at end of file
+__all__ = ['ai_admin', 'ai_actor', 'ai_actor_stream', 'ai_actor_batch', 'ai_turn', 'memory_cleanup', 'ai_stats', 'ai_metrics']
\ No newline at end of file
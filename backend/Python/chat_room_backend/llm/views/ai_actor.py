@@ -4,34 +4,50 @@ AI Actor view module.
 Handles character-based AI responses.
 """
 
-from django.http import JsonResponse
+import time
+
 from django.views.decorators.csrf import csrf_exempt
 
 from ..models.schemas import ActorRequest
 from ..models.db_models import ConversationHistory
 from .utils import (
-    parse_json_request,
-    get_recent_dialogues,
-    get_recent_memories,
-    build_core_memory,
-    build_prompt,
-    call_ai_model,
-    ACTOR_SYSTEM_PROMPT_TEMPLATE,
+    parse_request,
+    aload_core_memory,
+    asave_dialogues,
+    build_room_prompt,
+    acall_ai_model,
     ACTOR_TOOL,
+    ai_json_response,
     json_error_response,
-    method_not_allowed_response
+    method_not_allowed_response,
+    too_many_requests_response,
+    gateway_timeout_response,
+    LLMOverloadedError,
+    LLMDeadlineExceeded,
+    with_llm_deadline,
+    idempotent,
+    idempotent_step_done,
+    mark_idempotent_step,
+    room_scheduler,
+    timed_view,
+    traced_view,
+    record_stage
 )
 
 
 @csrf_exempt
-def ai_actor(request):
+@timed_view('actor')
+@traced_view('actor')
+@with_llm_deadline
+@idempotent
+async def ai_actor(request):
     """
     AI Actor endpoint.
 
     Handles character-based AI responses based on:
     - Worldview
     - Character settings
-    - Core memory (dialogues + short-term memories)
+    - Core memory (dialogues + short-term memories + long-term memories)
 
     POST /llm/ai-actor/
     """
@@ -40,74 +56,85 @@ def ai_actor(request):
 
     try:
         # Parse and validate request
-        request_data = parse_json_request(request.body)
-        actor_request = ActorRequest(**request_data)
-
-        # Save current conversation to history
-        conversation = ConversationHistory(
-            room_id=actor_request.roomId,
-            character_id=actor_request.previous_speaker_id,
-            character_name=actor_request.previous_speaker_name,
-            content=actor_request.history_dialogues,
-            current_location=actor_request.previous_speaker_location,
-            status=actor_request.previous_speaker_status
-        )
-        conversation.save()
-
-        # Get recent dialogues and memories
-        recent_dialogues, total_dialogues = get_recent_dialogues(actor_request.roomId)
-        recent_memories = get_recent_memories(actor_request.roomId)
-
-        # Build core memory
-        core_memory = build_core_memory(recent_dialogues, recent_memories)
-
-        # Build prompt for AI model
-        prompt = build_prompt(
-            actor_request.worldview,
-            actor_request.character_settings,
-            core_memory,
-            actor_request.character_name
-        )
-
-        # Build system prompt for role-playing
-        system_prompt = ACTOR_SYSTEM_PROMPT_TEMPLATE.format(
-            character_name=actor_request.character_name
-        )
-
-        # Call AI model with role-playing system prompt and function call tool
-        ai_result = call_ai_model(
-            prompt,
-            system_prompt,
-            tools=[ACTOR_TOOL],
-            tool_choice="required"
-        )
-
-        # Extract tool call result
-        if ai_result["type"] == "tool_call":
-            tool_args = ai_result["tool_arguments"]
-            ai_response_content = tool_args.get("response_content", "")
-            actor_character_name = tool_args.get("character_name", actor_request.character_name)
-            actor_current_location = tool_args.get("current_location", actor_request.current_location)
-            actor_status = tool_args.get("status", actor_request.status)
-        else:
-            ai_response_content = ai_result.get("content", "")
-            actor_character_name = actor_request.character_name
-            actor_current_location = actor_request.current_location
-            actor_status = actor_request.status
-
-        # Save AI actor response to conversation history
-        actor_conversation = ConversationHistory(
-            room_id=actor_request.roomId,
-            character_id=actor_request.characterId,
-            character_name=actor_character_name,
-            content=ai_response_content,
-            current_location=actor_current_location,
-            status=actor_status
-        )
-        actor_conversation.save()
+        step_started = time.monotonic()
+        actor_request = parse_request(ActorRequest, request.body)
+        record_stage("parse", time.monotonic() - step_started)
+
+        # Run the turn after earlier turns of the room have saved their replies
+        async with room_scheduler.turn(actor_request.roomId):
+            # Save current conversation to history, unless a failed earlier
+            # attempt of this request already did
+            conversation = ConversationHistory(
+                room_id=actor_request.roomId,
+                character_id=actor_request.previous_speaker_id,
+                character_name=actor_request.previous_speaker_name,
+                content=actor_request.history_dialogues,
+                current_location=actor_request.previous_speaker_location,
+                status=actor_request.previous_speaker_status
+            )
+            if not idempotent_step_done(request, 'history'):
+                step_started = time.monotonic()
+                await asave_dialogues([conversation])
+                record_stage("history", time.monotonic() - step_started)
+                mark_idempotent_step(request, 'history')
+
+            # Get core memory (recent dialogues, memories and relevant long-term memories)
+            step_started = time.monotonic()
+            core_memory, total_dialogues = await aload_core_memory(
+                actor_request.roomId,
+                actor_request.history_dialogues
+            )
+            record_stage("core_memory", time.monotonic() - step_started)
+
+            # Build the room's shared system prompt and the role-playing prompt
+            step_started = time.monotonic()
+            system_prompt, prompt, prompt_usage = build_room_prompt(
+                actor_request.worldview,
+                actor_request.character_settings,
+                core_memory,
+                actor_request.character_name
+            )
+            record_stage("prompt", time.monotonic() - step_started)
+
+            # Call AI model with role-playing prompt and function call tool
+            step_started = time.monotonic()
+            ai_result = await acall_ai_model(
+                prompt,
+                system_prompt,
+                tools=[ACTOR_TOOL],
+                tool_choice="required",
+                priority="actor"
+            )
+            record_stage("model", time.monotonic() - step_started)
+
+            # Extract tool call result
+            if ai_result["type"] == "tool_call":
+                tool_args = ai_result["tool_arguments"]
+                ai_response_content = tool_args.get("response_content", "")
+                actor_character_name = tool_args.get("character_name", actor_request.character_name)
+                actor_current_location = tool_args.get("current_location", actor_request.current_location)
+                actor_status = tool_args.get("status", actor_request.status)
+            else:
+                ai_response_content = ai_result.get("content", "")
+                actor_character_name = actor_request.character_name
+                actor_current_location = actor_request.current_location
+                actor_status = actor_request.status
+
+            # Save AI actor response to conversation history
+            actor_conversation = ConversationHistory(
+                room_id=actor_request.roomId,
+                character_id=actor_request.characterId,
+                character_name=actor_character_name,
+                content=ai_response_content,
+                current_location=actor_current_location,
+                status=actor_status
+            )
+            step_started = time.monotonic()
+            await asave_dialogues([actor_conversation])
+            record_stage("save", time.monotonic() - step_started)
 
         # Return response
-        return JsonResponse({
+        return ai_json_response(request, {
             "message": "AI扮演者接口已处理请求",
             "roomId": actor_request.roomId,
             "characterId": actor_request.characterId,
@@ -116,11 +143,16 @@ def ai_actor(request):
             "status": actor_status,
             "core_memory": core_memory,
             "prompt": prompt,
+            "prompt_usage": prompt_usage,
             "ai_response": ai_response_content,
             "ai_result": ai_result,
             "total_dialogues": total_dialogues
         })
 
+    except LLMOverloadedError as e:
+        return too_many_requests_response(str(e), e.retry_after)
+    except LLMDeadlineExceeded as e:
+        return gateway_timeout_response(str(e))
     except ValueError as e:
         return json_error_response(str(e), 400)
     except Exception as e:
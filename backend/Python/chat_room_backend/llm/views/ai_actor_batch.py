@@ -0,0 +1,174 @@
+"""
+AI Actor batch view module.
+
+Plays several characters of one room in a single request.
+"""
+
+import asyncio
+import time
+from typing import Dict, Any
+
+from django.views.decorators.csrf import csrf_exempt
+
+from ..models.schemas import BatchActorRequest, BatchActorCharacter
+from ..models.db_models import ConversationHistory
+from .utils import (
+    parse_request,
+    aload_core_memory,
+    asave_dialogues,
+    build_room_prompts,
+    aplay_character,
+    BATCH_ACTOR_MAX_CHARACTERS,
+    ai_json_response,
+    json_error_response,
+    method_not_allowed_response,
+    too_many_requests_response,
+    gateway_timeout_response,
+    LLMOverloadedError,
+    LLMDeadlineExceeded,
+    with_llm_deadline,
+    idempotent,
+    idempotent_step_done,
+    mark_idempotent_step,
+    room_scheduler,
+    timed_view,
+    traced_view,
+    record_stage
+)
+
+
+@csrf_exempt
+@timed_view('actor_batch')
+@traced_view('actor_batch')
+@with_llm_deadline
+@idempotent
+async def ai_actor_batch(request):
+    """
+    AI Actor batch endpoint.
+
+    Plays every character in ``characters`` against the same room context:
+    the dialogue is saved and core memory loaded and rendered once, the
+    model calls run concurrently, and all replies are saved together in
+    request order. The characters do not see each other's replies of the
+    same batch.
+
+    A character whose model call fails gets an ``error`` instead of a
+    reply; the other replies are still saved.
+
+    POST /api/ai/actor/batch
+    """
+    if request.method != 'POST':
+        return method_not_allowed_response()
+
+    try:
+        started = time.monotonic()
+        timings = {}
+
+        # Parse and validate request
+        batch_request = parse_request(BatchActorRequest, request.body)
+        if not batch_request.characters:
+            raise ValueError("characters不能为空")
+        if len(batch_request.characters) > BATCH_ACTOR_MAX_CHARACTERS:
+            raise ValueError(f"characters最多包含{BATCH_ACTOR_MAX_CHARACTERS}个角色")
+
+        async with room_scheduler.turn(batch_request.roomId):
+            # Save current conversation to history, unless a failed earlier
+            # attempt of this request already did
+            step_started = time.monotonic()
+            conversation = ConversationHistory(
+                room_id=batch_request.roomId,
+                character_id=batch_request.previous_speaker_id,
+                character_name=batch_request.previous_speaker_name,
+                content=batch_request.history_dialogues,
+                current_location=batch_request.previous_speaker_location,
+                status=batch_request.previous_speaker_status
+            )
+            if not idempotent_step_done(request, 'history'):
+                await asave_dialogues([conversation])
+                mark_idempotent_step(request, 'history')
+            timings["history"] = record_stage("history", time.monotonic() - step_started)
+
+            # Get core memory once for all characters
+            step_started = time.monotonic()
+            core_memory, total_dialogues = await aload_core_memory(
+                batch_request.roomId,
+                batch_request.history_dialogues
+            )
+            timings["core_memory"] = record_stage("core_memory", time.monotonic() - step_started)
+
+            # Render the shared system prompt and core memory once
+            step_started = time.monotonic()
+            system_prompt, prompts, prompt_usage = build_room_prompts(
+                batch_request.worldview,
+                batch_request.character_settings,
+                core_memory,
+                [character.character_name for character in batch_request.characters]
+            )
+            timings["prompt"] = record_stage("prompt", time.monotonic() - step_started)
+
+            # Call AI model for every character concurrently
+            step_started = time.monotonic()
+            outcomes = await asyncio.gather(
+                *[
+                    aplay_character(character, prompt, system_prompt)
+                    for character, prompt in zip(batch_request.characters, prompts)
+                ],
+                return_exceptions=True
+            )
+            timings["model"] = record_stage("model", time.monotonic() - step_started)
+
+            results = []
+            replies = []
+            for character, outcome in zip(batch_request.characters, outcomes):
+                if isinstance(outcome, BaseException):
+                    if not isinstance(outcome, Exception):
+                        raise outcome
+                    results.append({
+                        "characterId": character.characterId,
+                        "character_name": character.character_name,
+                        "error": str(outcome)
+                    })
+                    continue
+                results.append(outcome)
+                replies.append(ConversationHistory(
+                    room_id=batch_request.roomId,
+                    character_id=outcome["characterId"],
+                    character_name=outcome["character_name"],
+                    content=outcome["ai_response"],
+                    current_location=outcome["current_location"],
+                    status=outcome["status"]
+                ))
+
+            if not replies:
+                for error_type in (LLMOverloadedError, LLMDeadlineExceeded):
+                    errors = [outcome for outcome in outcomes if isinstance(outcome, error_type)]
+                    if errors:
+                        raise errors[0]
+                raise outcomes[0]
+
+            # Save all replies in one insert
+            step_started = time.monotonic()
+            await asave_dialogues(replies)
+            timings["save"] = record_stage("save", time.monotonic() - step_started)
+
+        timings["total"] = round(time.monotonic() - started, 4)
+
+        # Return response
+        return ai_json_response(request, {
+            "message": "AI批量扮演接口已处理请求",
+            "roomId": batch_request.roomId,
+            "core_memory": core_memory,
+            "prompt_usage": prompt_usage,
+            "results": results,
+            "total_dialogues": total_dialogues,
+            "timings": timings
+        })
+
+    except LLMOverloadedError as e:
+        return too_many_requests_response(str(e), e.retry_after)
+    except LLMDeadlineExceeded as e:
+        return gateway_timeout_response(str(e))
+    except ValueError as e:
+        return json_error_response(str(e), 400)
+    except Exception as e:
+        return json_error_response(str(e), 500)
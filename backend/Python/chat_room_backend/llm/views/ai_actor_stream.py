@@ -0,0 +1,178 @@
+"""
+AI Actor streaming view module.
+
+Streams character-based AI responses as Server-Sent Events.
+"""
+
+import time
+
+from django.http import StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from ..models.schemas import ActorRequest
+from ..models.db_models import ConversationHistory
+from .utils import (
+    parse_request,
+    aload_core_memory,
+    asave_dialogues,
+    build_room_prompt,
+    astream_tool_call,
+    ACTOR_TOOL,
+    json_error_response,
+    method_not_allowed_response,
+    sse_event,
+    profile_payload,
+    room_scheduler,
+    with_llm_deadline,
+    LLMOverloadedError,
+    LLMDeadlineExceeded,
+    timed_view,
+    traced_view,
+    record_stage
+)
+
+
+# Tool call arguments announced as soon as the model has finished them
+STREAMED_STATE_FIELDS = ("character_name", "current_location", "status", "next_speaker")
+
+
+@csrf_exempt
+@timed_view('actor_stream')
+@traced_view('actor_stream')
+@with_llm_deadline
+async def ai_actor_stream(request):
+    """
+    AI Actor streaming endpoint.
+
+    Same input as the AI Actor endpoint, but the reply is streamed as
+    Server-Sent Events while the model generates it:
+    - ``delta``: a new piece of ``response_content``
+    - ``field``: a state argument (``next_speaker``, ``current_location``,
+      ``status``, ``character_name``) as soon as the model has finished it
+    - ``done``: the final reply and character state, sent after the reply
+      has been saved to conversation history
+    - ``error``: the turn failed, the reply was not saved; ``retry_after``
+      is set when the model calls are overloaded
+
+    The turn starts once earlier turns of the room have finished, so the
+    stream may open before its first event.
+
+    POST /api/ai/actor/stream
+    """
+    if request.method != 'POST':
+        return method_not_allowed_response()
+
+    try:
+        # Parse and validate request
+        step_started = time.monotonic()
+        actor_request = parse_request(ActorRequest, request.body)
+        record_stage("parse", time.monotonic() - step_started)
+    except ValueError as e:
+        return json_error_response(str(e), 400)
+    except Exception as e:
+        return json_error_response(str(e), 500)
+
+    async def event_stream():
+        ai_result = None
+
+        try:
+            # The whole turn, streaming included, runs in the room's turn order
+            async with room_scheduler.turn(actor_request.roomId):
+                # Save current conversation to history
+                conversation = ConversationHistory(
+                    room_id=actor_request.roomId,
+                    character_id=actor_request.previous_speaker_id,
+                    character_name=actor_request.previous_speaker_name,
+                    content=actor_request.history_dialogues,
+                    current_location=actor_request.previous_speaker_location,
+                    status=actor_request.previous_speaker_status
+                )
+                step_started = time.monotonic()
+                await asave_dialogues([conversation])
+                record_stage("history", time.monotonic() - step_started)
+
+                # Get core memory (recent dialogues, memories and relevant long-term memories)
+                step_started = time.monotonic()
+                core_memory, total_dialogues = await aload_core_memory(
+                    actor_request.roomId,
+                    actor_request.history_dialogues
+                )
+                record_stage("core_memory", time.monotonic() - step_started)
+
+                # Build the room's shared system prompt and the role-playing prompt
+                step_started = time.monotonic()
+                system_prompt, prompt, prompt_usage = build_room_prompt(
+                    actor_request.worldview,
+                    actor_request.character_settings,
+                    core_memory,
+                    actor_request.character_name
+                )
+                record_stage("prompt", time.monotonic() - step_started)
+
+                step_started = time.monotonic()
+                async for event in astream_tool_call(
+                    prompt,
+                    system_prompt,
+                    tools=[ACTOR_TOOL],
+                    tool_choice="required",
+                    priority="actor"
+                ):
+                    if event["type"] == "delta" and event["field"] in ("response_content", "content"):
+                        yield sse_event("delta", {"content": event["delta"]})
+                    elif event["type"] == "field" and event["field"] in STREAMED_STATE_FIELDS:
+                        yield sse_event("field", {"name": event["field"], "value": event["value"]})
+                    elif event["type"] == "result":
+                        ai_result = event["result"]
+                record_stage("model", time.monotonic() - step_started)
+
+                # Extract tool call result
+                if ai_result["type"] == "tool_call":
+                    tool_args = ai_result["tool_arguments"]
+                    ai_response_content = tool_args.get("response_content", "")
+                    actor_character_name = tool_args.get("character_name", actor_request.character_name)
+                    actor_current_location = tool_args.get("current_location", actor_request.current_location)
+                    actor_status = tool_args.get("status", actor_request.status)
+                    next_speaker = tool_args.get("next_speaker", "")
+                else:
+                    ai_response_content = ai_result.get("content", "")
+                    actor_character_name = actor_request.character_name
+                    actor_current_location = actor_request.current_location
+                    actor_status = actor_request.status
+                    next_speaker = ""
+
+                # Save AI actor response once the stream has finished
+                actor_conversation = ConversationHistory(
+                    room_id=actor_request.roomId,
+                    character_id=actor_request.characterId,
+                    character_name=actor_character_name,
+                    content=ai_response_content,
+                    current_location=actor_current_location,
+                    status=actor_status
+                )
+                step_started = time.monotonic()
+                await asave_dialogues([actor_conversation])
+                record_stage("save", time.monotonic() - step_started)
+
+                yield sse_event("done", profile_payload(request, {
+                    "roomId": actor_request.roomId,
+                    "characterId": actor_request.characterId,
+                    "character_name": actor_character_name,
+                    "current_location": actor_current_location,
+                    "status": actor_status,
+                    "next_speaker": next_speaker,
+                    "ai_response": ai_response_content,
+                    "total_dialogues": total_dialogues,
+                    "prompt_usage": prompt_usage
+                }))
+
+        except LLMOverloadedError as e:
+            yield sse_event("error", {"error": str(e), "retry_after": e.retry_after})
+        except LLMDeadlineExceeded as e:
+            yield sse_event("error", {"error": str(e), "timeout": True})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -4,33 +4,136 @@ AI Admin view module.
 Handles AI admin responses based on worldview, character settings, and memory.
 """
 
-from django.http import JsonResponse
+import hashlib
+import time
+from typing import Dict, Any
+
 from django.views.decorators.csrf import csrf_exempt
 
 from ..models.schemas import AdminRequest
 from ..models.db_models import ConversationHistory, AdminAnalysisRecord
 from .utils import (
-    parse_json_request,
-    get_recent_dialogues,
-    get_recent_memories,
-    build_core_memory,
-    build_prompt,
-    call_ai_model,
+    parse_request,
+    aload_core_memory,
+    asave_dialogues,
+    asave_admin_analysis,
+    build_room_prompt,
+    acall_ai_model,
     ADMIN_TOOL,
+    ai_json_response,
     json_error_response,
-    method_not_allowed_response
+    method_not_allowed_response,
+    too_many_requests_response,
+    gateway_timeout_response,
+    LLMOverloadedError,
+    LLMDeadlineExceeded,
+    with_llm_deadline,
+    idempotent,
+    idempotent_step_done,
+    mark_idempotent_step,
+    room_scheduler,
+    admin_flight,
+    timed_view,
+    traced_view,
+    record_stage
 )
 
 
+async def _analyze(request, admin_request: AdminRequest) -> Dict[str, Any]:
+    """Run one admin analysis and return the response data."""
+    async with room_scheduler.turn(admin_request.roomId):
+        # Save current conversation to history, unless a failed earlier
+        # attempt of this request already did
+        conversation = ConversationHistory(
+            room_id=admin_request.roomId,
+            character_id=admin_request.previous_speaker_id,
+            character_name=admin_request.previous_speaker_name,
+            content=admin_request.history_dialogues,
+            current_location=admin_request.previous_speaker_location,
+            status=admin_request.previous_speaker_status
+        )
+        if not idempotent_step_done(request, 'history'):
+            step_started = time.monotonic()
+            await asave_dialogues([conversation])
+            record_stage("history", time.monotonic() - step_started)
+            mark_idempotent_step(request, 'history')
+
+        # Get core memory (recent dialogues, memories and relevant long-term memories)
+        step_started = time.monotonic()
+        core_memory, total_dialogues = await aload_core_memory(
+            admin_request.roomId,
+            admin_request.history_dialogues
+        )
+        record_stage("core_memory", time.monotonic() - step_started)
+
+    # The analysis adds no dialogue, so the room's next turn need not wait for it
+
+    # Build the room's shared system prompt and the admin prompt
+    step_started = time.monotonic()
+    system_prompt, prompt, prompt_usage = build_room_prompt(
+        admin_request.worldview,
+        admin_request.character_settings,
+        core_memory
+    )
+    record_stage("prompt", time.monotonic() - step_started)
+
+    # Call AI model with function call tool
+    step_started = time.monotonic()
+    ai_result = await acall_ai_model(
+        prompt,
+        system_prompt,
+        tools=[ADMIN_TOOL],
+        tool_choice="required",
+        priority="admin"
+    )
+    record_stage("model", time.monotonic() - step_started)
+
+    # Extract tool call result
+    if ai_result["type"] == "tool_call":
+        tool_args = ai_result["tool_arguments"]
+        ai_response_content = tool_args.get("analysis_content", "")
+    else:
+        ai_response_content = ai_result.get("content", "")
+
+    # Save AI admin analysis to admin analysis record, behind the response
+    admin_analysis = AdminAnalysisRecord(
+        room_id=admin_request.roomId,
+        character_id=admin_request.characterId,
+        analysis_content=ai_response_content
+    )
+    step_started = time.monotonic()
+    await asave_admin_analysis(admin_analysis)
+    record_stage("save", time.monotonic() - step_started)
+
+    return {
+        "message": "AI管理员接口已处理请求",
+        "roomId": admin_request.roomId,
+        "characterId": admin_request.characterId,
+        "core_memory": core_memory,
+        "prompt": prompt,
+        "prompt_usage": prompt_usage,
+        "ai_response": ai_response_content,
+        "ai_result": ai_result,
+        "total_dialogues": total_dialogues
+    }
+
+
 @csrf_exempt
-def ai_admin(request):
+@timed_view('admin')
+@traced_view('admin')
+@with_llm_deadline
+@idempotent
+async def ai_admin(request):
     """
     AI Admin endpoint.
 
     Processes requests to generate AI admin responses based on:
     - Worldview
     - Character settings
-    - Core memory (dialogues + short-term memories)
+    - Core memory (dialogues + short-term memories + long-term memories)
+
+    The dialogue is saved and core memory read in the room's turn order.
+    Identical requests running at the same time share one analysis.
 
     POST /llm/ai-admin/
     """
@@ -39,69 +142,26 @@ def ai_admin(request):
 
     try:
         # Parse and validate request
-        request_data = parse_json_request(request.body)
-        admin_request = AdminRequest(**request_data)
-
-        # Save current conversation to history
-        conversation = ConversationHistory(
-            room_id=admin_request.roomId,
-            character_id=admin_request.previous_speaker_id,
-            character_name=admin_request.previous_speaker_name,
-            content=admin_request.history_dialogues,
-            current_location=admin_request.previous_speaker_location,
-            status=admin_request.previous_speaker_status
-        )
-        conversation.save()
-
-        # Get recent dialogues and memories
-        recent_dialogues, total_dialogues = get_recent_dialogues(admin_request.roomId)
-        recent_memories = get_recent_memories(admin_request.roomId)
-
-        # Build core memory
-        core_memory = build_core_memory(recent_dialogues, recent_memories)
-
-        # Build prompt for AI model
-        prompt = build_prompt(
-            admin_request.worldview,
-            admin_request.character_settings,
-            core_memory
-        )
-
-        # Call AI model with function call tool
-        ai_result = call_ai_model(
-            prompt,
-            tools=[ADMIN_TOOL],
-            tool_choice="required"
-        )
-
-        # Extract tool call result
-        if ai_result["type"] == "tool_call":
-            tool_args = ai_result["tool_arguments"]
-            ai_response_content = tool_args.get("analysis_content", "")
-        else:
-            ai_response_content = ai_result.get("content", "")
-
-        # Save AI admin analysis to admin analysis record
-        admin_analysis = AdminAnalysisRecord(
-            room_id=admin_request.roomId,
-            character_id=admin_request.characterId,
-            analysis_content=ai_response_content
+        step_started = time.monotonic()
+        admin_request = parse_request(AdminRequest, request.body)
+        record_stage("parse", time.monotonic() - step_started)
+
+        flight_key = hashlib.sha256(admin_request.model_dump_json().encode('utf-8')).hexdigest()
+        response_data, shared = await admin_flight.run(
+            flight_key,
+            lambda: _analyze(request, admin_request)
         )
-        admin_analysis.save()
+        if shared:
+            room_scheduler.record_coalesced(admin_request.roomId)
 
         # Return response
-        return JsonResponse({
-            "message": "AI管理员接口已处理请求",
-            "roomId": admin_request.roomId,
-            "characterId": admin_request.characterId,
-            "core_memory": core_memory,
-            "prompt": prompt,
-            "ai_response": ai_response_content,
-            "ai_result": ai_result,
-            "total_dialogues": total_dialogues
-        })
+        return ai_json_response(request, response_data)
 
+    except LLMOverloadedError as e:
+        return too_many_requests_response(str(e), e.retry_after)
+    except LLMDeadlineExceeded as e:
+        return gateway_timeout_response(str(e))
     except ValueError as e:
         return json_error_response(str(e), 400)
     except Exception as e:
-        return json_error_response(str(e), 500)
\ No newline at end of file
+        return json_error_response(str(e), 500)
@@ -0,0 +1,253 @@
+"""
+AI Turn view module.
+
+Runs a whole turn, admin analysis and the next speaker's reply, in one
+request.
+"""
+
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+
+from ..models.schemas import TurnRequest, BatchActorCharacter
+from ..models.db_models import ConversationHistory, AdminAnalysisRecord
+from .utils import (
+    parse_request,
+    aload_core_memory,
+    add_pending_dialogues,
+    asave_dialogues,
+    build_room_prompts,
+    acall_ai_model,
+    aplay_character,
+    ADMIN_TOOL,
+    ai_json_response,
+    json_error_response,
+    method_not_allowed_response,
+    too_many_requests_response,
+    gateway_timeout_response,
+    LLMOverloadedError,
+    LLMDeadlineExceeded,
+    with_llm_deadline,
+    idempotent,
+    room_scheduler,
+    aget_recent_speakers,
+    predict_next_speakers,
+    speculation_budget,
+    timed_view,
+    traced_view,
+    record_stage
+)
+
+
+def _resolve_next_speaker(
+    next_speaker: str,
+    characters: List[BatchActorCharacter]
+) -> Optional[int]:
+    """Find the AI character the admin picked, by name or ID."""
+    next_speaker = next_speaker.strip()
+    for attribute in ('character_name', 'characterId'):
+        for index, character in enumerate(characters):
+            if getattr(character, attribute) == next_speaker:
+                return index
+    return None
+
+
+@csrf_exempt
+@timed_view('turn')
+@traced_view('turn')
+@with_llm_deadline
+@idempotent
+async def ai_turn(request):
+    """
+    AI Turn endpoint.
+
+    Runs the AI admin on the room, resolves its ``next_speaker`` to one of
+    ``characters`` and has that character reply, reusing the core memory
+    and prompt prefix of the admin step. If the next speaker is not one of
+    ``characters`` (e.g. a player), only the admin step runs.
+
+    In speculative mode (``speculative``, defaulting to
+    ``SPECULATIVE_ACTOR_ENABLED``) the most likely next speakers start
+    replying while the admin call runs; the reply of the picked speaker is
+    kept and the others are cancelled.
+
+    Nothing is written until both steps have finished; the incoming
+    dialogue, the admin analysis and the reply are then saved in one
+    transaction, so a failed turn can simply be retried.
+
+    POST /api/ai/turn
+    """
+    if request.method != 'POST':
+        return method_not_allowed_response()
+
+    try:
+        started = time.monotonic()
+        timings = {}
+
+        # Parse and validate request
+        turn_request = parse_request(TurnRequest, request.body)
+        speculative = turn_request.speculative
+        if speculative is None:
+            speculative = settings.SPECULATIVE_ACTOR_ENABLED
+        speculative = speculative and bool(turn_request.characters)
+
+        async with room_scheduler.turn(turn_request.roomId):
+            conversation = ConversationHistory(
+                room_id=turn_request.roomId,
+                character_id=turn_request.previous_speaker_id,
+                character_name=turn_request.previous_speaker_name,
+                content=turn_request.history_dialogues,
+                current_location=turn_request.previous_speaker_location,
+                status=turn_request.previous_speaker_status
+            )
+
+            # Get core memory, with the incoming dialogue that is saved at the end
+            step_started = time.monotonic()
+            if speculative:
+                (core_memory, total_dialogues), recent_speakers = await asyncio.gather(
+                    aload_core_memory(turn_request.roomId, turn_request.history_dialogues),
+                    aget_recent_speakers(turn_request.roomId)
+                )
+            else:
+                core_memory, total_dialogues = await aload_core_memory(
+                    turn_request.roomId,
+                    turn_request.history_dialogues
+                )
+            core_memory, total_dialogues = add_pending_dialogues(core_memory, total_dialogues, [conversation])
+            timings["core_memory"] = record_stage("core_memory", time.monotonic() - step_started)
+
+            # Render the admin prompt and every possible actor prompt at once
+            step_started = time.monotonic()
+            system_prompt, prompts, prompt_usage = build_room_prompts(
+                turn_request.worldview,
+                turn_request.character_settings,
+                core_memory,
+                [None] + [character.character_name for character in turn_request.characters]
+            )
+            timings["prompt"] = record_stage("prompt", time.monotonic() - step_started)
+
+            # Start the likely next speakers, within the speculation budget
+            speculations: Dict[int, Tuple[asyncio.Future, float]] = {}
+            if speculative:
+                character_ids = [character.characterId for character in turn_request.characters]
+                predicted = predict_next_speakers(
+                    [turn_request.previous_speaker_id] + recent_speakers,
+                    character_ids,
+                    settings.SPECULATIVE_ACTOR_CANDIDATES
+                )
+                for character_id in predicted[:speculation_budget.acquire(len(predicted))]:
+                    index = character_ids.index(character_id)
+                    task = asyncio.ensure_future(aplay_character(
+                        turn_request.characters[index], prompts[index + 1], system_prompt, "speculative"
+                    ))
+                    # Failures of discarded guesses are not reported
+                    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+                    speculations[index] = (task, time.monotonic())
+
+            try:
+                # Admin step; the turn's reply waits on it, so it runs as an actor call
+                step_started = time.monotonic()
+                admin_result = await acall_ai_model(
+                    prompts[0],
+                    system_prompt,
+                    tools=[ADMIN_TOOL],
+                    tool_choice="required",
+                    priority="actor"
+                )
+                if admin_result["type"] == "tool_call":
+                    admin_args = admin_result["tool_arguments"]
+                    analysis_content = admin_args.get("analysis_content", "")
+                    next_speaker = admin_args.get("next_speaker", "")
+                else:
+                    analysis_content = admin_result.get("content", "")
+                    next_speaker = ""
+                admin_done = time.monotonic()
+                timings["admin"] = record_stage("admin", admin_done - step_started)
+
+                admin_analysis = AdminAnalysisRecord(
+                    room_id=turn_request.roomId,
+                    character_id=turn_request.characterId,
+                    analysis_content=analysis_content
+                )
+                dialogues = [conversation]
+
+                index = _resolve_next_speaker(next_speaker, turn_request.characters)
+                for other, (task, _) in speculations.items():
+                    if other != index:
+                        task.cancel()
+
+                # Actor step for the next speaker, if it is an AI character
+                actor = None
+                if index is not None:
+                    step_started = time.monotonic()
+                    speculation = speculations.get(index)
+                    if speculation is not None:
+                        task, speculation_started = speculation
+                        try:
+                            actor = await task
+                        except Exception:
+                            speculation_budget.record(hit=False, failed=True)
+                        else:
+                            actor["speculative"] = True
+                            speculation_budget.record(
+                                hit=True,
+                                seconds_saved=min(actor["seconds"], admin_done - speculation_started)
+                            )
+                    elif speculations:
+                        speculation_budget.record(hit=False)
+
+                    if actor is None:
+                        actor = await aplay_character(
+                            turn_request.characters[index], prompts[index + 1], system_prompt, "actor"
+                        )
+                    timings["actor"] = record_stage("actor", time.monotonic() - step_started)
+
+                    dialogues.append(ConversationHistory(
+                        room_id=turn_request.roomId,
+                        character_id=actor["characterId"],
+                        character_name=actor["character_name"],
+                        content=actor["ai_response"],
+                        current_location=actor["current_location"],
+                        status=actor["status"]
+                    ))
+                elif speculations:
+                    speculation_budget.record(hit=False)
+            finally:
+                for task, _ in speculations.values():
+                    task.cancel()
+
+            # Save the whole turn at once
+            step_started = time.monotonic()
+            await asave_dialogues(dialogues, [admin_analysis])
+            timings["save"] = record_stage("save", time.monotonic() - step_started)
+
+        timings["total"] = round(time.monotonic() - started, 4)
+
+        # Return response
+        return ai_json_response(request, {
+            "message": "AI回合接口已处理请求",
+            "roomId": turn_request.roomId,
+            "core_memory": core_memory,
+            "prompt_usage": prompt_usage,
+            "admin": {
+                "characterId": turn_request.characterId,
+                "ai_response": analysis_content,
+                "next_speaker": next_speaker,
+                "ai_result": admin_result
+            },
+            "actor": actor,
+            "total_dialogues": total_dialogues,
+            "timings": timings
+        })
+
+    except LLMOverloadedError as e:
+        return too_many_requests_response(str(e), e.retry_after)
+    except LLMDeadlineExceeded as e:
+        return gateway_timeout_response(str(e))
+    except ValueError as e:
+        return json_error_response(str(e), 400)
+    except Exception as e:
+        return json_error_response(str(e), 500)
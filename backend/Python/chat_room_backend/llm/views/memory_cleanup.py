@@ -7,20 +7,36 @@ Manages conversation history and short-term memory cleanup.
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
-from .utils import parse_json_request, json_error_response, method_not_allowed_response
+from .utils import (
+    parse_json_request,
+    json_error_response,
+    method_not_allowed_response,
+    too_many_requests_response,
+    compact_room,
+    COMPACTION_MAX_BATCHES_PER_REQUEST,
+    LLMOverloadedError,
+    timed_view,
+    traced_view
+)
 
 
 @csrf_exempt
+@timed_view('memory_cleanup')
+@traced_view('memory_cleanup')
 def memory_cleanup(request):
     """
     Memory Cleanup endpoint.
 
-    Manages conversation history and short-term memory cleanup.
-    TODO: Implement actual cleanup logic.
+    Compacts the conversation history of a room: once the room passes the
+    compaction threshold, older dialogues are summarized into short-term
+    memories and the summarized dialogues are deleted.
 
-    POST /llm/memory-cleanup/
+    POST /api/memory/cleanup
     Body:
         room_id (str): The room ID to cleanup memories for
+        force (bool, optional): Compact even below the threshold
+        max_batches (int, optional): Maximum number of batches in this run,
+            at most and by default COMPACTION_MAX_BATCHES_PER_REQUEST
     """
     if request.method != 'POST':
         return method_not_allowed_response()
@@ -32,14 +48,28 @@ def memory_cleanup(request):
         if not room_id:
             return json_error_response("room_id参数是必需的", 400)
 
-        # TODO: Implement memory cleanup logic
+        force = request_data.get('force', False)
+        if not isinstance(force, bool):
+            return json_error_response("force参数必须是布尔值", 400)
+
+        # bool is a subclass of int, so true would otherwise pass as 1
+        max_batches = request_data.get('max_batches', COMPACTION_MAX_BATCHES_PER_REQUEST)
+        if isinstance(max_batches, bool) or not isinstance(max_batches, int) or max_batches < 1:
+            return json_error_response("max_batches参数必须是正整数", 400)
+        if max_batches > COMPACTION_MAX_BATCHES_PER_REQUEST:
+            return json_error_response(f"max_batches参数不能超过{COMPACTION_MAX_BATCHES_PER_REQUEST}", 400)
+
+        report = compact_room(room_id, force=force, max_batches=max_batches)
+
         return JsonResponse({
             "message": "记忆整理接口已处理请求",
-            "room_id": room_id,
-            "status": "success"
-        })
+            **report
+        }, status=409 if report['status'] == 'busy' else 200)
 
+    except LLMOverloadedError as e:
+        # Batches summarized before the model calls got overloaded are kept
+        return too_many_requests_response(str(e), e.retry_after)
     except ValueError as e:
         return json_error_response(str(e), 400)
     except Exception as e:
-        return json_error_response(str(e), 500)
\ No newline at end of file
+        return json_error_response(str(e), 500)
@@ -0,0 +1,91 @@
+"""
+Stats view module.
+
+Reports process-level runtime statistics of the LLM service.
+"""
+
+from django.http import HttpResponse, JsonResponse
+
+from .utils import (
+    get_pool_stats,
+    get_llm_governor_stats,
+    get_llm_latency_stats,
+    get_memory_cache_stats,
+    get_long_term_index_stats,
+    get_ann_index_stats,
+    get_embedding_stats,
+    get_prompt_prefix_stats,
+    get_idempotency_stats,
+    get_room_scheduler_stats,
+    get_write_buffer_stats,
+    get_speculation_stats,
+    get_trace_stats,
+    render_metrics,
+    json_error_response
+)
+
+
+def ai_stats(request):
+    """
+    Runtime stats endpoint.
+
+    Reports in-process counters for capacity planning, by section:
+
+        llm_pool           LLM client connections and calls in flight
+        llm_governor       admission queues, rate limits and shed calls
+        llm_latency        model call latency, hedging and circuit breakers
+        core_memory_cache  cached rooms, bytes and hit/miss counts
+        long_term_memory   embedding matrix cache, loads and searches
+        ann_index          ANN index builds, appends and searches
+        embeddings         embedding cache hits and provider calls
+        prompt_prefix      prompt prefix reuse and provider cache hits
+        idempotency        replayed retries of AI calls
+        room_scheduler     per-room turn queues and wait times
+        speculation        speculative actor calls and latency saved
+        write_buffer       group commit batches and commit latency
+        traces             recorded and dropped request traces
+
+    GET /api/ai/stats
+    """
+    if request.method != 'GET':
+        return json_error_response("只支持GET请求", 405)
+
+    return JsonResponse({
+        "llm_pool": get_pool_stats(),
+        "llm_governor": get_llm_governor_stats(),
+        "llm_latency": get_llm_latency_stats(),
+        "core_memory_cache": get_memory_cache_stats(),
+        "long_term_memory": get_long_term_index_stats(),
+        "ann_index": get_ann_index_stats(),
+        "embeddings": get_embedding_stats(),
+        "prompt_prefix": get_prompt_prefix_stats(),
+        "idempotency": get_idempotency_stats(),
+        "room_scheduler": get_room_scheduler_stats(),
+        "speculation": get_speculation_stats(),
+        "write_buffer": get_write_buffer_stats(),
+        "traces": get_trace_stats()
+    })
+
+
+def ai_metrics(request):
+    """
+    Prometheus metrics endpoint.
+
+    Reports request, stage and model call latency histograms, requests and
+    model calls in flight, error counters and provider token counts in the
+    Prometheus text format.
+
+    GET /metrics
+    """
+    if request.method != 'GET':
+        return json_error_response("只支持GET请求", 405)
+
+    governor = get_llm_governor_stats()
+    gauges = [
+        ("llm_model_calls_in_flight", "Model calls admitted by the LLM governor and running", governor['in_flight']),
+        ("llm_model_calls_queued", "Model calls waiting for admission", {
+            (('priority', priority),): count for priority, count in governor['queued'].items()
+        }),
+        ("llm_write_buffer_pending_jobs", "Writes waiting for a group commit", get_write_buffer_stats()['pending_jobs'])
+    ]
+    return HttpResponse(render_metrics(gauges), content_type="text/plain; version=0.0.4; charset=utf-8")
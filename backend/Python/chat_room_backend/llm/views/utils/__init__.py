@@ -4,27 +4,185 @@ from .constants import (
     AI_MODEL,
     MAX_DIALOGUES_THRESHOLD,
     RECENT_MEMORIES_COUNT,
+    LONG_TERM_MEMORY_TOP_K,
+    EMBEDDING_MODEL,
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_BATCH_SIZE,
+    COMPACTION_THRESHOLD,
+    COMPACTION_KEEP_RECENT,
+    COMPACTION_BATCH_SIZE,
+    COMPACTION_MAX_BATCHES_PER_REQUEST,
+    LLM_PRIORITIES,
+    BATCH_ACTOR_MAX_CHARACTERS,
     SYSTEM_PROMPT,
-    ACTOR_SYSTEM_PROMPT_TEMPLATE,
+    ROOM_SYSTEM_PROMPT,
+    ADMIN_INSTRUCTION,
+    ACTOR_INSTRUCTION_TEMPLATE,
+    MEMORY_SUMMARY_SYSTEM_PROMPT,
     ADMIN_TOOL,
-    ACTOR_TOOL
+    ACTOR_TOOL,
+    MEMORY_SUMMARY_TOOL
 )
 
 from .request_utils import (
     parse_json_request,
+    parse_request,
+    dump_json,
+    response_profile,
+    profile_payload,
+    ai_json_response,
     json_error_response,
-    method_not_allowed_response
+    method_not_allowed_response,
+    too_many_requests_response,
+    gateway_timeout_response,
+    sse_event
+)
+
+from .idempotency_utils import (
+    idempotency_cache,
+    idempotent,
+    idempotent_step_done,
+    mark_idempotent_step,
+    get_idempotency_stats
 )
 
 from .memory_utils import (
     get_recent_dialogues,
+    aget_recent_dialogues,
     get_recent_memories,
-    build_core_memory
+    aget_recent_memories,
+    dialogue_to_core_memory,
+    memory_to_core_memory,
+    build_core_memory,
+    add_pending_dialogues,
+    load_core_memory,
+    aload_core_memory
+)
+
+from .memory_cache import memory_cache, get_memory_cache_stats
+
+from .history_utils import (
+    save_dialogues,
+    asave_dialogues,
+    asave_admin_analysis,
+    GroupCommitWriter,
+    write_buffer,
+    get_write_buffer_stats,
+    get_room_stats,
+    aget_room_stats
+)
+
+from .prompt_utils import (
+    estimate_tokens,
+    truncate_to_tokens,
+    format_core_memory_item,
+    prefix_cache,
+    render_room_prefix,
+    build_room_prompts,
+    build_room_prompt,
+    get_prompt_prefix_stats
 )
 
-from .prompt_utils import build_prompt
+from .client_utils import (
+    get_llm_client,
+    get_async_llm_client,
+    get_pool_stats,
+    close_llm_clients,
+    aclose_llm_clients
+)
+
+from .json_stream_utils import ToolArgumentsParser
+
+from .llm_governor import (
+    LLMOverloadedError,
+    LLMGovernor,
+    llm_governor,
+    get_llm_governor_stats
+)
+
+from .llm_resilience import (
+    LLMUnavailableError,
+    LLMDeadlineExceeded,
+    CircuitBreaker,
+    with_llm_deadline,
+    llm_monitor,
+    get_llm_latency_stats
+)
+
+from .trace import (
+    traced_view,
+    trace_writer,
+    get_trace_stats,
+    trace_files,
+    read_traces
+)
 
-from .ai_utils import call_ai_model
+from .metrics import (
+    metrics,
+    timed_view,
+    record_stage,
+    record_model_call,
+    record_model_error,
+    render_metrics
+)
+
+from .ai_utils import (
+    call_ai_model,
+    acall_ai_model,
+    aplay_character,
+    astream_ai_model,
+    astream_tool_call,
+    embed_texts,
+    aembed_texts
+)
+
+from .embedding_utils import (
+    EmbeddingProvider,
+    ZhipuEmbeddingProvider,
+    FakeEmbeddingProvider,
+    CachedEmbedder,
+    get_embedding_provider,
+    get_embedder,
+    get_embeddings,
+    aget_embeddings,
+    get_embedding_stats
+)
+
+from .ann_index import (
+    RoomANNIndex,
+    ANNIndexStore,
+    write_index,
+    ann_store,
+    get_ann_index_stats
+)
+
+from .long_term_memory_utils import (
+    encode_embedding,
+    decode_embedding,
+    load_room_embeddings,
+    long_term_index,
+    search_ann_index,
+    aretrieve_long_term_memories,
+    get_long_term_index_stats
+)
+
+from .compaction_utils import compact_room
+
+from .room_scheduler import (
+    RoomScheduler,
+    SingleFlight,
+    room_scheduler,
+    admin_flight,
+    get_room_scheduler_stats
+)
+
+from .speculation import (
+    aget_recent_speakers,
+    predict_next_speakers,
+    SpeculationBudget,
+    speculation_budget,
+    get_speculation_stats
+)
 
 __all__ = [
     'DEFAULT_MAX_TOKENS',
@@ -32,16 +190,132 @@ __all__ = [
     'AI_MODEL',
     'MAX_DIALOGUES_THRESHOLD',
     'RECENT_MEMORIES_COUNT',
+    'LONG_TERM_MEMORY_TOP_K',
+    'EMBEDDING_MODEL',
+    'EMBEDDING_DIMENSIONS',
+    'EMBEDDING_BATCH_SIZE',
+    'COMPACTION_THRESHOLD',
+    'COMPACTION_KEEP_RECENT',
+    'COMPACTION_BATCH_SIZE',
+    'COMPACTION_MAX_BATCHES_PER_REQUEST',
+    'LLM_PRIORITIES',
+    'BATCH_ACTOR_MAX_CHARACTERS',
     'SYSTEM_PROMPT',
-    'ACTOR_SYSTEM_PROMPT_TEMPLATE',
+    'ROOM_SYSTEM_PROMPT',
+    'ADMIN_INSTRUCTION',
+    'ACTOR_INSTRUCTION_TEMPLATE',
+    'MEMORY_SUMMARY_SYSTEM_PROMPT',
     'ADMIN_TOOL',
     'ACTOR_TOOL',
+    'MEMORY_SUMMARY_TOOL',
     'parse_json_request',
+    'parse_request',
+    'dump_json',
+    'response_profile',
+    'profile_payload',
+    'ai_json_response',
     'json_error_response',
     'method_not_allowed_response',
+    'too_many_requests_response',
+    'gateway_timeout_response',
+    'sse_event',
+    'idempotency_cache',
+    'idempotent',
+    'idempotent_step_done',
+    'mark_idempotent_step',
+    'get_idempotency_stats',
     'get_recent_dialogues',
+    'aget_recent_dialogues',
     'get_recent_memories',
+    'aget_recent_memories',
+    'dialogue_to_core_memory',
+    'memory_to_core_memory',
     'build_core_memory',
-    'build_prompt',
-    'call_ai_model'
+    'add_pending_dialogues',
+    'load_core_memory',
+    'aload_core_memory',
+    'memory_cache',
+    'get_memory_cache_stats',
+    'save_dialogues',
+    'asave_dialogues',
+    'asave_admin_analysis',
+    'GroupCommitWriter',
+    'write_buffer',
+    'get_write_buffer_stats',
+    'get_room_stats',
+    'aget_room_stats',
+    'estimate_tokens',
+    'truncate_to_tokens',
+    'format_core_memory_item',
+    'prefix_cache',
+    'render_room_prefix',
+    'build_room_prompts',
+    'build_room_prompt',
+    'get_prompt_prefix_stats',
+    'get_llm_client',
+    'get_async_llm_client',
+    'get_pool_stats',
+    'close_llm_clients',
+    'aclose_llm_clients',
+    'call_ai_model',
+    'acall_ai_model',
+    'aplay_character',
+    'ToolArgumentsParser',
+    'LLMOverloadedError',
+    'LLMGovernor',
+    'llm_governor',
+    'get_llm_governor_stats',
+    'LLMUnavailableError',
+    'LLMDeadlineExceeded',
+    'CircuitBreaker',
+    'with_llm_deadline',
+    'llm_monitor',
+    'get_llm_latency_stats',
+    'metrics',
+    'timed_view',
+    'record_stage',
+    'record_model_call',
+    'record_model_error',
+    'render_metrics',
+    'traced_view',
+    'trace_writer',
+    'get_trace_stats',
+    'trace_files',
+    'read_traces',
+    'astream_ai_model',
+    'astream_tool_call',
+    'embed_texts',
+    'aembed_texts',
+    'EmbeddingProvider',
+    'ZhipuEmbeddingProvider',
+    'FakeEmbeddingProvider',
+    'CachedEmbedder',
+    'get_embedding_provider',
+    'get_embedder',
+    'get_embeddings',
+    'aget_embeddings',
+    'get_embedding_stats',
+    'encode_embedding',
+    'decode_embedding',
+    'load_room_embeddings',
+    'long_term_index',
+    'search_ann_index',
+    'aretrieve_long_term_memories',
+    'get_long_term_index_stats',
+    'RoomANNIndex',
+    'ANNIndexStore',
+    'write_index',
+    'ann_store',
+    'get_ann_index_stats',
+    'compact_room',
+    'RoomScheduler',
+    'SingleFlight',
+    'room_scheduler',
+    'admin_flight',
+    'get_room_scheduler_stats',
+    'aget_recent_speakers',
+    'predict_next_speakers',
+    'SpeculationBudget',
+    'speculation_budget',
+    'get_speculation_stats'
 ]
@@ -2,31 +2,48 @@
 AI model utilities for LLM views module.
 """
 
+import asyncio
 import json
-from typing import Dict, Any, Optional, List
-from django.conf import settings
-from zai import ZhipuAiClient
+import time
+from typing import Dict, Any, Optional, List, AsyncIterator
 
 from .constants import (
     DEFAULT_MAX_TOKENS,
     DEFAULT_TEMPERATURE,
     AI_MODEL,
-    SYSTEM_PROMPT
+    SYSTEM_PROMPT,
+    EMBEDDING_MODEL,
+    EMBEDDING_DIMENSIONS,
+    LLM_COMPLETION_TOKEN_RESERVE,
+    ACTOR_TOOL
 )
+from .client_utils import client_registry, get_llm_client, get_async_llm_client, build_timeout
+from .json_stream_utils import ToolArgumentsParser
+from .llm_governor import llm_governor
+from .llm_resilience import (
+    LLMTarget,
+    LLMDeadlineExceeded,
+    llm_targets,
+    pick_target,
+    call_timeout,
+    deadline_remaining,
+    llm_monitor
+)
+from .metrics import record_model_call, record_model_error
+from .trace import trace_model_call
+from .prompt_utils import prefix_cache, estimate_tokens
 
 
-def call_ai_model(
+def _build_request_params(
     prompt: str,
-    system_prompt: Optional[str] = None,
-    tools: Optional[List[Dict[str, Any]]] = None,
-    tool_choice: Optional[str] = None
+    system_prompt: Optional[str],
+    tools: Optional[List[Dict[str, Any]]],
+    tool_choice: Optional[str]
 ) -> Dict[str, Any]:
-    """Call Zhipu AI model and return the response."""
+    """Build the chat completion request parameters."""
     if system_prompt is None:
         system_prompt = SYSTEM_PROMPT
-    
-    client = ZhipuAiClient(api_key=settings.ZHIPU_API_KEY)
-    
+
     request_params = {
         "model": AI_MODEL,
         "messages": [
@@ -36,26 +53,467 @@ def call_ai_model(
         "max_tokens": DEFAULT_MAX_TOKENS,
         "temperature": DEFAULT_TEMPERATURE
     }
-    
+
     if tools is not None:
         request_params["tools"] = tools
-    
+
     if tool_choice is not None:
         request_params["tool_choice"] = tool_choice
-    
-    response = client.chat.completions.create(**request_params)
-    
-    message = response.choices[0].message
-    
-    if message.tool_calls:
-        tool_call = message.tool_calls[0]
+
+    return request_params
+
+
+def _estimate_call_tokens(request_params: Dict[str, Any]) -> int:
+    """Estimate the tokens a call will use, for admission control."""
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in request_params["messages"])
+    return prompt_tokens + LLM_COMPLETION_TOKEN_RESERVE
+
+
+def _call_kind(request_params: Dict[str, Any]) -> str:
+    """Kind of a call for latency tracking: its tool name, or ``text``."""
+    tools = request_params.get("tools")
+    return tools[0]["function"]["name"] if tools else "text"
+
+
+def _usage_tokens(usage: Optional[Dict[str, Any]]) -> Optional[int]:
+    return usage.get("total_tokens") if usage else None
+
+
+def _streamed_completion(
+    content: List[str],
+    tool_name: Optional[str],
+    arguments: List[str],
+    usage: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """The chat completion the chunks of a streamed call add up to."""
+    message = {"role": "assistant", "content": "".join(content) or None}
+    if tool_name is not None:
+        message["tool_calls"] = [{
+            "type": "function",
+            "function": {"name": tool_name, "arguments": "".join(arguments)}
+        }]
+    return {
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if tool_name is not None else "stop"
+        }],
+        "usage": usage
+    }
+
+
+def _parse_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a completion message into the result format used by the views."""
+    tool_calls = message.get("tool_calls")
+    if tool_calls:
+        tool_call = tool_calls[0]
         return {
             "type": "tool_call",
-            "tool_name": tool_call.function.name,
-            "tool_arguments": json.loads(tool_call.function.arguments)
+            "tool_name": tool_call["function"]["name"],
+            "tool_arguments": json.loads(tool_call["function"]["arguments"])
         }
     else:
         return {
             "type": "text",
-            "content": message.content
+            "content": message.get("content")
         }
+
+
+def call_ai_model(
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_choice: Optional[str] = None,
+    timeout: Optional[float] = None,
+    priority: str = "admin"
+) -> Dict[str, Any]:
+    """Call Zhipu AI model and return the response."""
+    request_params = _build_request_params(prompt, system_prompt, tools, tool_choice)
+    target = pick_target(llm_targets())
+    client = get_llm_client(target.api_key, target.model)
+
+    ticket = llm_governor.admit(priority, _estimate_call_tokens(request_params), timeout=deadline_remaining())
+    usage = None
+    try:
+        started = time.monotonic()
+        try:
+            with client_registry.track_call():
+                response = client.chat.completions.create(
+                    **dict(request_params, model=target.model),
+                    timeout=build_timeout(call_timeout(timeout))
+                )
+        except Exception as error:
+            target.breaker.record_failure(error)
+            record_model_error(_call_kind(request_params), error)
+            raise
+        target.breaker.record_success()
+        llm_monitor.record(_call_kind(request_params), time.monotonic() - started)
+        llm_monitor.record_call(hedged=False, hedge_won=False)
+        if response.usage is not None:
+            usage = response.usage.model_dump()
+        record_model_call(_call_kind(request_params), time.monotonic() - started, usage)
+        trace_model_call(_call_kind(request_params), request_params, response, time.monotonic() - started)
+    finally:
+        llm_governor.release(ticket, _usage_tokens(usage))
+
+    message = response.choices[0].message
+    prefix_cache.record_usage(usage)
+
+    return _parse_message(message.model_dump())
+
+
+async def _apost_completion(
+    target: LLMTarget,
+    request_params: Dict[str, Any],
+    timeout: Optional[float]
+) -> Dict[str, Any]:
+    """Send one chat completion request to a target."""
+    client = get_async_llm_client(target.api_key, target.model)
+    started = time.monotonic()
+    try:
+        with client_registry.track_call():
+            response = await client.post(
+                "chat/completions",
+                json=dict(request_params, model=target.model),
+                timeout=build_timeout(timeout)
+            )
+            response.raise_for_status()
+        data = response.json()
+    except Exception as error:
+        target.breaker.record_failure(error)
+        record_model_error(_call_kind(request_params), error)
+        raise
+    target.breaker.record_success()
+    llm_monitor.record(_call_kind(request_params), time.monotonic() - started)
+    record_model_call(_call_kind(request_params), time.monotonic() - started, data.get("usage"))
+    trace_model_call(_call_kind(request_params), request_params, data, time.monotonic() - started)
+    return data
+
+
+async def _ahedged_completion(
+    request_params: Dict[str, Any],
+    timeout: Optional[float],
+    priority: str
+) -> Dict[str, Any]:
+    """
+    Run a chat completion within the current deadline, hedging it on the
+    other target (``LLM_HEDGE_MODEL`` / ``LLM_HEDGE_API_KEY``) if it runs
+    longer than usual for its kind; the first success wins. Without a
+    second target calls are not hedged.
+    """
+    tokens = _estimate_call_tokens(request_params)
+    targets = llm_targets()
+    target = pick_target(targets)
+    hedge_target = next((other for other in targets if other is not target), None)
+
+    ticket = await llm_governor.aadmit(priority, tokens, timeout=deadline_remaining())
+    attempts = {}
+    first = winner = error = None
+    try:
+        first = asyncio.ensure_future(_apost_completion(target, request_params, call_timeout(timeout)))
+        attempts[first] = ticket
+
+        delay = None if hedge_target is None else llm_monitor.hedge_delay(_call_kind(request_params))
+        hedge_at = None if delay is None else time.monotonic() + delay
+        while winner is None:
+            pending = [task for task in attempts if not task.done()]
+            if not pending:
+                raise error
+            wait = deadline_remaining()
+            if hedge_at is not None:
+                until_hedge = max(0.0, hedge_at - time.monotonic())
+                wait = until_hedge if wait is None else min(wait, until_hedge)
+
+            done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    break
+                error = task.exception()
+            if done:
+                continue
+
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                # Hedge on the other target, only if it can run right away
+                hedge_at = None
+                if hedge_target.breaker.allow():
+                    hedge_ticket = llm_governor.try_admit(priority, tokens)
+                    if hedge_ticket is not None:
+                        hedge = asyncio.ensure_future(
+                            _apost_completion(hedge_target, request_params, call_timeout(timeout))
+                        )
+                        attempts[hedge] = hedge_ticket
+                continue
+
+            llm_monitor.record_deadline_exceeded()
+            raise LLMDeadlineExceeded()
+
+        return winner.result()
+    finally:
+        if not attempts:
+            llm_governor.release(ticket)
+        for task, task_ticket in attempts.items():
+            usage = None
+            if task is winner:
+                usage = winner.result().get("usage")
+            elif not task.done():
+                task.cancel()
+            llm_governor.release(task_ticket, _usage_tokens(usage))
+        llm_monitor.record_call(
+            hedged=len(attempts) > 1,
+            hedge_won=winner is not None and winner is not first
+        )
+
+
+async def acall_ai_model(
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_choice: Optional[str] = None,
+    timeout: Optional[float] = None,
+    priority: str = "admin"
+) -> Dict[str, Any]:
+    """
+    Call Zhipu AI model without blocking a worker thread.
+
+    The zai SDK only ships a synchronous client, so the chat completions
+    endpoint is called directly over the pooled ``httpx.AsyncClient``. The
+    result has the same shape as ``call_ai_model``. Slow calls are hedged
+    and bounded by the request's deadline (see ``llm_resilience``).
+    """
+    request_params = _build_request_params(prompt, system_prompt, tools, tool_choice)
+
+    data = await _ahedged_completion(request_params, timeout, priority)
+
+    prefix_cache.record_usage(data.get("usage"))
+
+    return _parse_message(data["choices"][0]["message"])
+
+
+async def aplay_character(
+    character,
+    prompt: str,
+    system_prompt: str,
+    priority: str = "actor"
+) -> Dict[str, Any]:
+    """
+    Run the actor call of a character and extract its reply.
+
+    ``character`` provides ``characterId``, ``character_name``,
+    ``current_location`` and ``status``, the fallbacks for fields the
+    model leaves out.
+    """
+    started = time.monotonic()
+    ai_result = await acall_ai_model(
+        prompt,
+        system_prompt,
+        tools=[ACTOR_TOOL],
+        tool_choice="required",
+        priority=priority
+    )
+    if ai_result["type"] == "tool_call":
+        tool_args = ai_result["tool_arguments"]
+        reply = {
+            "characterId": character.characterId,
+            "character_name": tool_args.get("character_name", character.character_name),
+            "current_location": tool_args.get("current_location", character.current_location),
+            "status": tool_args.get("status", character.status),
+            "next_speaker": tool_args.get("next_speaker", ""),
+            "ai_response": tool_args.get("response_content", "")
+        }
+    else:
+        reply = {
+            "characterId": character.characterId,
+            "character_name": character.character_name,
+            "current_location": character.current_location,
+            "status": character.status,
+            "next_speaker": "",
+            "ai_response": ai_result.get("content", "")
+        }
+    reply["ai_result"] = ai_result
+    reply["seconds"] = round(time.monotonic() - started, 4)
+    return reply
+
+
+async def astream_ai_model(
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_choice: Optional[str] = None,
+    timeout: Optional[float] = None,
+    priority: str = "admin"
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Call Zhipu AI model in streaming mode.
+
+    Yields one event per delta: ``{"type": "text", "delta": ...}`` for plain
+    content and ``{"type": "tool_call", "tool_name": ..., "delta": ...}`` for
+    fragments of the tool call arguments. ``tool_stream`` asks the provider
+    to stream tool call arguments instead of sending them in one final chunk.
+    Streams are not hedged, since a reply may already be partly delivered.
+    """
+    request_params = _build_request_params(prompt, system_prompt, tools, tool_choice)
+    request_params["stream"] = True
+    if tools is not None:
+        request_params["tool_stream"] = True
+
+    target = pick_target(llm_targets())
+    client = get_async_llm_client(target.api_key, target.model)
+
+    tool_name = None
+    usage = None
+    content = []
+    arguments = []
+    ticket = await llm_governor.aadmit(
+        priority,
+        _estimate_call_tokens(request_params),
+        timeout=deadline_remaining()
+    )
+    started = time.monotonic()
+    try:
+        with client_registry.track_call():
+            async with client.stream(
+                "POST",
+                "chat/completions",
+                json=dict(request_params, model=target.model),
+                timeout=build_timeout(call_timeout(timeout))
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+
+                    chunk = json.loads(data)
+                    # The last chunk carries the usage of the whole call
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                        prefix_cache.record_usage(usage)
+                    choices = chunk.get("choices") or []
+                    if not choices:
+                        continue
+                    delta = choices[0].get("delta") or {}
+
+                    if delta.get("content"):
+                        content.append(delta["content"])
+                        yield {"type": "text", "delta": delta["content"]}
+
+                    for tool_call in delta.get("tool_calls") or []:
+                        if tool_call.get("index", 0) != 0:
+                            continue
+                        function = tool_call.get("function") or {}
+                        tool_name = function.get("name") or tool_name
+                        if function.get("arguments"):
+                            arguments.append(function["arguments"])
+                            yield {
+                                "type": "tool_call",
+                                "tool_name": tool_name,
+                                "delta": function["arguments"]
+                            }
+    except Exception as error:
+        remaining = deadline_remaining()
+        if remaining is not None and remaining <= 0:
+            # The read timed out because the request's deadline passed
+            llm_monitor.record_deadline_exceeded()
+            raise LLMDeadlineExceeded() from error
+        target.breaker.record_failure(error)
+        record_model_error(_call_kind(request_params), error)
+        raise
+    else:
+        target.breaker.record_success()
+        record_model_call(_call_kind(request_params), time.monotonic() - started, usage)
+        trace_model_call(
+            _call_kind(request_params),
+            request_params,
+            _streamed_completion(content, tool_name, arguments, usage),
+            time.monotonic() - started
+        )
+    finally:
+        llm_governor.release(ticket, _usage_tokens(usage))
+
+
+async def astream_tool_call(
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_choice: Optional[str] = None,
+    timeout: Optional[float] = None,
+    priority: str = "admin"
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream a model call and report tool call arguments field by field.
+
+    Yields:
+    - ``{"type": "delta", "field": ..., "delta": ...}`` as string arguments
+      grow (plain text replies are reported as the ``content`` field)
+    - ``{"type": "field", "field": ..., "value": ...}`` once an argument is
+      complete, before the rest of the arguments have been generated
+    - ``{"type": "result", "result": ...}`` last, in the same shape as the
+      result of ``call_ai_model``
+    """
+    parser = ToolArgumentsParser()
+    tool_name = None
+    text_parts = []
+
+    async for event in astream_ai_model(prompt, system_prompt, tools, tool_choice, timeout, priority):
+        if event["type"] == "tool_call":
+            tool_name = event["tool_name"]
+            for kind, key, payload in parser.feed(event["delta"]):
+                if kind == "delta":
+                    yield {"type": "delta", "field": key, "delta": payload}
+                else:
+                    yield {"type": "field", "field": key, "value": payload}
+        else:
+            text_parts.append(event["delta"])
+            yield {"type": "delta", "field": "content", "delta": event["delta"]}
+
+    if tool_name is not None:
+        result = {
+            "type": "tool_call",
+            "tool_name": tool_name,
+            "tool_arguments": parser.result()
+        }
+    else:
+        result = {
+            "type": "text",
+            "content": "".join(text_parts)
+        }
+
+    yield {"type": "result", "result": result}
+
+
+def embed_texts(texts: List[str], timeout: Optional[float] = None) -> List[List[float]]:
+    """Embed texts with the Zhipu embedding model, in input order."""
+    client = get_llm_client(model=EMBEDDING_MODEL)
+
+    with client_registry.track_call():
+        response = client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=texts,
+            dimensions=EMBEDDING_DIMENSIONS,
+            timeout=build_timeout(timeout)
+        )
+
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+async def aembed_texts(texts: List[str], timeout: Optional[float] = None) -> List[List[float]]:
+    """Async version of ``embed_texts``."""
+    client = get_async_llm_client(model=EMBEDDING_MODEL)
+
+    with client_registry.track_call():
+        response = await client.post(
+            "embeddings",
+            json={
+                "model": EMBEDDING_MODEL,
+                "input": texts,
+                "dimensions": EMBEDDING_DIMENSIONS
+            },
+            timeout=build_timeout(timeout)
+        )
+        response.raise_for_status()
+
+    data = sorted(response.json()["data"], key=lambda item: item["index"])
+    return [item["embedding"] for item in data]
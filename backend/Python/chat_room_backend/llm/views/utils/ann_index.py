@@ -0,0 +1,484 @@
+"""
+On-disk approximate nearest neighbour index of long-term memories.
+
+Rooms with many long-term memories are searched through an IVF-PQ index
+instead of a full embedding matrix. Memories are assigned to the nearest of
+``nlist`` coarse centroids, and the residual to that centroid is compressed
+into ``m`` one-byte product quantization codes. A search scores only the
+memories of the ``nprobe`` closest lists, using a per-query lookup table,
+and the caller re-ranks the best candidates with their exact embeddings.
+
+Each room is stored under ``LONG_TERM_ANN_DIR/<sha256 of room_id>/``
+(room IDs come from requests and are never used as paths)::
+
+    CURRENT          name of the active version directory
+    lock             serializes appends and version switches
+    build.lock       held while the room is being built
+    v<timestamp>/
+        meta.json      dims, lists, subquantizers and row count
+        centroids.npy  coarse centroids, (nlist, dims) float32
+        codebooks.npy  PQ codebooks, (m, ksub, dims / m) float32
+        offsets.npy    first row of each list, (nlist + 1,) int64
+        ids.npy        memory ids sorted by list, (rows,) S36
+        codes.npy      PQ codes sorted by list, (rows, m) uint8
+        tail.bin       records appended since the build
+
+The arrays are memory-mapped read-only, so all workers on a host share one
+copy in the page cache. New memories are encoded with the existing
+quantizers and appended to ``tail.bin``; once the tail outgrows
+``LONG_TERM_ANN_REBUILD_RATIO`` of the index, the room is rebuilt in a
+background thread and the new version replaces the old one atomically.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+
+from ...db_router import room_db
+from ...models.db_models import LongTermMemory
+from .constants import (
+    ANN_SUBQUANTIZERS,
+    ANN_CODEBOOK_SIZE,
+    ANN_TRAIN_SAMPLE,
+    ANN_KMEANS_ITERATIONS
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only serialize threads of this process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ID_DTYPE = 'S36'
+
+# Rows per chunk when assigning vectors to centroids
+_CHUNK_ROWS = 16384
+
+
+def _tail_dtype(subquantizers: int) -> np.dtype:
+    return np.dtype([('id', ID_DTYPE), ('list', '<i4'), ('codes', 'u1', (subquantizers,))])
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid (L2) of every vector."""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _CHUNK_ROWS):
+        chunk = vectors[start:start + _CHUNK_ROWS]
+        assignment[start:start + len(chunk)] = np.argmin(
+            centroid_norms - 2 * (chunk @ centroids.T), axis=1
+        )
+    return assignment
+
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Plain Lloyd's k-means; empty clusters are reseeded with random vectors."""
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest(vectors, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        filled = counts > 0
+
+        order = np.argsort(assignment, kind='stable')
+        starts = (np.cumsum(counts) - counts)[filled]
+        centroids[filled] = np.add.reduceat(vectors[order], starts, axis=0) / counts[filled, None]
+
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+def train_quantizers(
+    vectors: np.ndarray,
+    nlist: int,
+    subquantizers: int,
+    seed: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Train coarse centroids and PQ codebooks on (a sample of) vectors.
+
+    Returns:
+        Tuple of (centroids, codebooks)
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > ANN_TRAIN_SAMPLE:
+        vectors = vectors[rng.choice(len(vectors), ANN_TRAIN_SAMPLE, replace=False)]
+
+    centroids = _kmeans(vectors, nlist, ANN_KMEANS_ITERATIONS, rng)
+    residuals = vectors - centroids[_nearest(vectors, centroids)]
+
+    codebook_size = min(ANN_CODEBOOK_SIZE, len(vectors))
+    sub_dims = vectors.shape[1] // subquantizers
+    codebooks = np.stack([
+        _kmeans(
+            np.ascontiguousarray(residuals[:, j * sub_dims:(j + 1) * sub_dims]),
+            codebook_size,
+            ANN_KMEANS_ITERATIONS,
+            rng
+        )
+        for j in range(subquantizers)
+    ])
+    return centroids, codebooks
+
+
+def encode(vectors: np.ndarray, centroids: np.ndarray, codebooks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Assign vectors to lists and PQ-encode their residuals.
+
+    Returns:
+        Tuple of (list of each vector, (rows, m) uint8 codes)
+    """
+    lists = _nearest(vectors, centroids)
+    residuals = vectors - centroids[lists]
+    subquantizers, _, sub_dims = codebooks.shape
+    codes = np.empty((len(vectors), subquantizers), dtype=np.uint8)
+    for j in range(subquantizers):
+        codes[:, j] = _nearest(np.ascontiguousarray(residuals[:, j * sub_dims:(j + 1) * sub_dims]), codebooks[j])
+    return lists.astype(np.int32), codes
+
+
+def write_index(directory: str, ids: Sequence[str], vectors: np.ndarray, seed: int = 0) -> Dict[str, Any]:
+    """Train and write an index version of normalized vectors into ``directory``."""
+    rows, dims = vectors.shape
+    nlist = max(1, min(rows, int(math.sqrt(rows))))
+    subquantizers = math.gcd(dims, ANN_SUBQUANTIZERS)
+
+    centroids, codebooks = train_quantizers(vectors, nlist, subquantizers, seed)
+    lists, codes = encode(vectors, centroids, codebooks)
+
+    order = np.argsort(lists, kind='stable')
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(lists, minlength=nlist))
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'centroids.npy'), centroids.astype(np.float32))
+    np.save(os.path.join(directory, 'codebooks.npy'), codebooks.astype(np.float32))
+    np.save(os.path.join(directory, 'offsets.npy'), offsets)
+    np.save(os.path.join(directory, 'ids.npy'), np.asarray(ids, dtype=ID_DTYPE)[order])
+    np.save(os.path.join(directory, 'codes.npy'), codes[order])
+    open(os.path.join(directory, 'tail.bin'), 'wb').close()
+
+    meta = {
+        'dims': dims,
+        'nlist': nlist,
+        'subquantizers': subquantizers,
+        'codebook_size': codebooks.shape[1],
+        'rows': rows,
+        'built_at': time.time()
+    }
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+
+class RoomANNIndex:
+    """One memory-mapped version of the ANN index of a room."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.centroids = np.load(os.path.join(directory, 'centroids.npy'), mmap_mode='r')
+        self.codebooks = np.load(os.path.join(directory, 'codebooks.npy'))
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        self.ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode='r')
+        self.codes = np.load(os.path.join(directory, 'codes.npy'), mmap_mode='r')
+        self.tail_dtype = _tail_dtype(self.meta['subquantizers'])
+        self._tail = np.empty(0, dtype=self.tail_dtype)
+        self._tail_lock = threading.Lock()
+
+    @property
+    def rows(self) -> int:
+        return self.meta['rows']
+
+    @property
+    def tail(self) -> np.ndarray:
+        """Appended records, re-mapped when another writer has grown the file."""
+        path = os.path.join(self.directory, 'tail.bin')
+        try:
+            count = os.path.getsize(path) // self.tail_dtype.itemsize
+        except OSError:
+            return self._tail
+        with self._tail_lock:
+            if count != len(self._tail):
+                self._tail = np.memmap(path, dtype=self.tail_dtype, mode='r', shape=(count,))
+            return self._tail
+
+    def append(self, ids: Sequence[str], vectors: np.ndarray) -> int:
+        """Encode vectors with this version's quantizers and append them; returns tail rows."""
+        lists, codes = encode(_normalize(vectors), np.asarray(self.centroids), self.codebooks)
+        records = np.empty(len(ids), dtype=self.tail_dtype)
+        records['id'] = np.asarray(ids, dtype=ID_DTYPE)
+        records['list'] = lists
+        records['codes'] = codes
+
+        fd = os.open(os.path.join(self.directory, 'tail.bin'), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, records.tobytes())
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        return size // self.tail_dtype.itemsize
+
+    def search(self, query: np.ndarray, candidates: int, nprobe: int) -> Tuple[List[str], np.ndarray]:
+        """
+        Approximate inner-product search of a normalized query.
+
+        Returns:
+            Tuple of (memory ids, approximate scores) of up to ``candidates``
+            best rows, best first
+        """
+        subquantizers, _, sub_dims = self.codebooks.shape
+        coarse = self.centroids @ query
+        nprobe = min(nprobe, len(coarse))
+        probed = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        # score(x) = q . centroid + sum_j q_j . codebook_j[code_j]
+        table = np.einsum('jcd,jd->jc', self.codebooks, query.reshape(subquantizers, sub_dims))
+        columns = np.arange(subquantizers)
+
+        id_parts, score_parts = [], []
+        for list_index in probed:
+            start, end = self.offsets[list_index], self.offsets[list_index + 1]
+            if start == end:
+                continue
+            id_parts.append(self.ids[start:end])
+            score_parts.append(coarse[list_index] + table[columns, self.codes[start:end]].sum(axis=1))
+
+        tail = self.tail
+        if len(tail):
+            matched = tail[np.isin(tail['list'], probed)]
+            if len(matched):
+                id_parts.append(matched['id'])
+                score_parts.append(coarse[matched['list']] + table[columns, matched['codes']].sum(axis=1))
+
+        if not id_parts:
+            return [], np.empty(0, dtype=np.float32)
+
+        ids = np.concatenate(id_parts)
+        scores = np.concatenate(score_parts)
+        if candidates < len(scores):
+            top = np.argpartition(-scores, candidates - 1)[:candidates]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [memory_id.decode() for memory_id in ids[top]], scores[top]
+
+
+class ANNIndexStore:
+    """
+    Opens, extends and rebuilds the per-room ANN indexes under a directory.
+
+    Opened versions are cached per process and re-opened when ``CURRENT``
+    of the room changes.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._opened: Dict[str, Tuple[int, RoomANNIndex]] = {}
+        self._building: set = set()
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.appended = 0
+
+    def room_dir(self, room_id: str) -> str:
+        return os.path.join(self.root, hashlib.sha256(room_id.encode('utf-8')).hexdigest())
+
+    @contextmanager
+    def _room_lock(self, room_id: str, name: str = 'lock', blocking: bool = True):
+        """Exclusive lock on a room across processes; yields False if not acquired."""
+        os.makedirs(self.room_dir(room_id), exist_ok=True)
+        with open(os.path.join(self.room_dir(room_id), name), 'a') as f:
+            if fcntl is None:
+                yield True
+                return
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, room_id: str) -> Optional[RoomANNIndex]:
+        """Open the current index version of a room, or None if it has none."""
+        current = os.path.join(self.room_dir(room_id), 'CURRENT')
+        try:
+            mtime = os.stat(current).st_mtime_ns
+        except OSError:
+            return None
+
+        with self._lock:
+            opened = self._opened.get(room_id)
+        if opened is not None and opened[0] == mtime:
+            return opened[1]
+
+        try:
+            with open(current) as f:
+                index = RoomANNIndex(os.path.join(self.room_dir(room_id), f.read().strip()))
+        except OSError:
+            # Switched and removed by a rebuild in another process meanwhile
+            return None
+        with self._lock:
+            self._opened[room_id] = (mtime, index)
+        return index
+
+    def search(self, room_id: str, query: np.ndarray, candidates: int, nprobe: int) -> Optional[Tuple[List[str], np.ndarray]]:
+        """Search the index of a room, or None if it has none."""
+        index = self.get(room_id)
+        if index is None or index.meta['dims'] != query.shape[0]:
+            return None
+
+        started = time.monotonic()
+        result = index.search(_normalize(query), candidates, nprobe)
+        with self._lock:
+            self.searches += 1
+            self.search_seconds += time.monotonic() - started
+        return result
+
+    def append(self, room_id: str, ids: Sequence[str], vectors: np.ndarray) -> None:
+        """Add new memories to the index of a room, if it has one."""
+        if not os.path.exists(os.path.join(self.room_dir(room_id), 'CURRENT')):
+            return
+
+        with self._room_lock(room_id):
+            index = self.get(room_id)
+            if index is None or index.meta['dims'] != vectors.shape[1]:
+                return
+            tail_rows = index.append(ids, vectors)
+
+        with self._lock:
+            self.appended += len(ids)
+        if tail_rows > settings.LONG_TERM_ANN_REBUILD_RATIO * index.rows:
+            self.schedule_build(room_id)
+
+    def build(self, room_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Build a new index version of a room from its stored embeddings.
+
+        Returns the version metadata, or None if the room has no embeddings
+        or another process is building it.
+        """
+        with self._room_lock(room_id, 'build.lock', blocking=False) as acquired:
+            if not acquired:
+                return None
+            return self._build(room_id)
+
+    def _build(self, room_id: str) -> Optional[Dict[str, Any]]:
+        started = time.monotonic()
+        ids, vectors = _load_embeddings(LongTermMemory.objects.using(room_db(room_id)).filter(room_id=room_id))
+        if not ids:
+            return None
+
+        version = f"v{time.time_ns()}"
+        directory = os.path.join(self.room_dir(room_id), version)
+        meta = write_index(directory, ids, vectors)
+        index = RoomANNIndex(directory)
+
+        with self._room_lock(room_id):
+            # Carry over memories appended to the old version during the build
+            old = self.get(room_id)
+            if old is not None:
+                built = set(ids)
+                missing = [memory_id.decode() for memory_id in old.tail['id']]
+                missing = [memory_id for memory_id in missing if memory_id not in built]
+                if missing:
+                    extra_ids, extra_vectors = _load_embeddings(LongTermMemory.objects.using(room_db(room_id)).filter(id__in=missing))
+                    if extra_ids:
+                        index.append(extra_ids, extra_vectors)
+
+            current = os.path.join(self.room_dir(room_id), 'CURRENT')
+            with open(current + '.tmp', 'w') as f:
+                f.write(version)
+            os.replace(current + '.tmp', current)
+
+            # Readers holding an old version keep their mappings until they re-open
+            for name in os.listdir(self.room_dir(room_id)):
+                if name.startswith('v') and name != version:
+                    shutil.rmtree(os.path.join(self.room_dir(room_id), name), ignore_errors=True)
+
+        with self._lock:
+            self.builds += 1
+            self.build_seconds += time.monotonic() - started
+        return meta
+
+    def schedule_build(self, room_id: str) -> None:
+        """Build a room in a background thread unless it is already building."""
+        with self._lock:
+            if room_id in self._building:
+                return
+            self._building.add(room_id)
+
+        def run():
+            try:
+                self.build(room_id)
+            except Exception:
+                logger.exception("Building the ANN index of room %s failed", room_id)
+            finally:
+                connections.close_all()
+                with self._lock:
+                    self._building.discard(room_id)
+
+        threading.Thread(target=run, name=f"ann-build-{room_id}", daemon=True).start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'rooms_opened': len(self._opened),
+                'building': len(self._building),
+                'builds': self.builds,
+                'build_seconds': round(self.build_seconds, 4),
+                'searches': self.searches,
+                'search_seconds': round(self.search_seconds, 4),
+                'appended': self.appended
+            }
+
+
+def _load_embeddings(queryset) -> Tuple[List[str], np.ndarray]:
+    """Read the ids and normalized embeddings of the rows of a queryset."""
+    ids, blobs = [], []
+    dimensions = None
+    for memory_id, embedding in queryset.values_list('id', 'embedding').iterator(chunk_size=2000):
+        embedding = bytes(embedding or b'')
+        if not embedding or (dimensions is not None and len(embedding) != dimensions):
+            continue
+        dimensions = len(embedding)
+        ids.append(memory_id)
+        blobs.append(embedding)
+
+    if not blobs:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    vectors = np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(len(blobs), -1)
+    return ids, _normalize(vectors)
+
+
+ann_store = ANNIndexStore(settings.LONG_TERM_ANN_DIR)
+
+
+def get_ann_index_stats() -> Dict[str, Any]:
+    """Get ANN index builds, searches and appends of this process."""
+    return ann_store.stats()
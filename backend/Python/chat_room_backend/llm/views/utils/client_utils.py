@@ -0,0 +1,191 @@
+"""
+Pooled LLM client utilities for LLM views module.
+
+Clients are built once per process for each (API key, model) pair and
+reuse their keep-alive HTTP connections across requests. Sync clients are
+closed at exit; async clients are closed by ``aclose_llm_clients`` on the
+ASGI lifespan shutdown (see ``chat_room.asgi``).
+"""
+
+import asyncio
+import atexit
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+
+import httpx
+from django.conf import settings
+from zai import ZhipuAiClient
+
+from .constants import AI_MODEL
+
+
+def build_timeout(timeout: Optional[float] = None) -> httpx.Timeout:
+    """Build an httpx timeout from the configured defaults."""
+    if timeout is None:
+        timeout = settings.LLM_REQUEST_TIMEOUT
+    return httpx.Timeout(timeout, connect=min(timeout, settings.LLM_CONNECT_TIMEOUT))
+
+
+def _build_limits() -> httpx.Limits:
+    """Build httpx connection pool limits from settings."""
+    return httpx.Limits(
+        max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.LLM_POOL_KEEPALIVE_EXPIRY
+    )
+
+
+def _pool_usage(http_client: httpx.Client | httpx.AsyncClient) -> Dict[str, int]:
+    """Count open and idle connections of an httpx client's pool."""
+    pool = getattr(getattr(http_client, '_transport', None), '_pool', None)
+    connections = getattr(pool, 'connections', [])
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        'connections': len(connections),
+        'idle_connections': idle,
+        'active_connections': len(connections) - idle
+    }
+
+
+class LLMClientRegistry:
+    """
+    Process-wide registry of pooled LLM clients.
+
+    Sync clients are shared by all threads. ``httpx.AsyncClient`` is bound
+    to the event loop that first uses it, so async clients are kept per
+    running loop and dropped together with that loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str], ZhipuAiClient] = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._clients_created = 0
+        self._calls = 0
+        self._in_flight = 0
+        self._peak_in_flight = 0
+
+    def get_client(self, api_key: Optional[str] = None, model: str = AI_MODEL) -> ZhipuAiClient:
+        """Return the shared sync client for an API key and model."""
+        key = (api_key or settings.ZHIPU_API_KEY, model)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = ZhipuAiClient(
+                    api_key=key[0],
+                    base_url=settings.ZHIPU_BASE_URL,
+                    timeout=build_timeout(),
+                    http_client=httpx.Client(
+                        base_url=settings.ZHIPU_BASE_URL,
+                        timeout=build_timeout(),
+                        limits=_build_limits()
+                    )
+                )
+                self._clients[key] = client
+                self._clients_created += 1
+            return client
+
+    def get_async_client(self, api_key: Optional[str] = None, model: str = AI_MODEL) -> httpx.AsyncClient:
+        """Return the async HTTP client for an API key and model on the running loop."""
+        key = (api_key or settings.ZHIPU_API_KEY, model)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_clients = self._async_clients.setdefault(loop, {})
+            client = loop_clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(
+                    base_url=settings.ZHIPU_BASE_URL,
+                    headers={"Authorization": f"Bearer {key[0]}"},
+                    timeout=build_timeout(),
+                    limits=_build_limits()
+                )
+                loop_clients[key] = client
+                self._clients_created += 1
+            return client
+
+    @contextmanager
+    def track_call(self):
+        """Count a model call as in flight for pool usage reporting."""
+        with self._lock:
+            self._calls += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Report client and connection pool usage."""
+        with self._lock:
+            http_clients = [client._client for client in self._clients.values()]
+            for loop_clients in self._async_clients.values():
+                http_clients.extend(loop_clients.values())
+            stats = {
+                'clients': len(http_clients),
+                'clients_created': self._clients_created,
+                'calls': self._calls,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'max_connections_per_client': settings.LLM_POOL_MAX_CONNECTIONS,
+                'max_keepalive_per_client': settings.LLM_POOL_MAX_KEEPALIVE,
+                'connections': 0,
+                'idle_connections': 0,
+                'active_connections': 0
+            }
+        for http_client in http_clients:
+            for name, value in _pool_usage(http_client).items():
+                stats[name] += value
+        return stats
+
+    def close(self) -> None:
+        """Close every sync client and forget async clients."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._async_clients.clear()
+        for client in clients:
+            client.close()
+
+    async def aclose(self) -> None:
+        """Close the async clients of the running loop and every sync client."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_clients = self._async_clients.pop(loop, {})
+        for client in loop_clients.values():
+            await client.aclose()
+        self.close()
+
+
+client_registry = LLMClientRegistry()
+
+
+def get_llm_client(api_key: Optional[str] = None, model: str = AI_MODEL) -> ZhipuAiClient:
+    """Get the pooled sync Zhipu client."""
+    return client_registry.get_client(api_key, model)
+
+
+def get_async_llm_client(api_key: Optional[str] = None, model: str = AI_MODEL) -> httpx.AsyncClient:
+    """Get the pooled async HTTP client for the running event loop."""
+    return client_registry.get_async_client(api_key, model)
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Get LLM client pool usage."""
+    return client_registry.stats()
+
+
+def close_llm_clients() -> None:
+    """Shutdown hook closing all pooled sync LLM clients."""
+    client_registry.close()
+
+
+async def aclose_llm_clients() -> None:
+    """Shutdown hook closing the async LLM clients of the running loop, then the sync ones."""
+    await client_registry.aclose()
+
+
+atexit.register(close_llm_clients)
@@ -0,0 +1,250 @@
+"""
+Memory compaction utilities for LLM views module.
+
+Once a room has more than ``COMPACTION_THRESHOLD`` history rows, its oldest
+rows (all but the latest ``COMPACTION_KEEP_RECENT``) are summarized by the
+AI model in batches of ``COMPACTION_BATCH_SIZE`` into ShortTermMemory rows,
+and the summarized rows are deleted in chunks of
+``COMPACTION_DELETE_CHUNK`` so no transaction holds the database lock for
+long.
+
+Each batch goes through these stages:
+- select: read the oldest rows of the room
+- summarize: call the AI model
+- persist: save the memory and a checkpoint of the summarized range in one
+  transaction
+- delete: delete the summarized range chunk by chunk
+
+A batch whose summary comes back empty fails the run before anything of
+it is saved or deleted.
+
+The checkpoint makes a run resumable: a run interrupted after persisting a
+summary finishes deleting that range on the next run instead of
+summarizing it again. A lease on the checkpoint row keeps concurrent runs
+for the same room from compacting the same rows.
+"""
+
+import time
+import uuid
+from datetime import timedelta
+from typing import Dict, Any, List, Optional
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ...db_router import room_db
+from ...models.db_models import (
+    ConversationHistory,
+    ShortTermMemory,
+    RoomStats,
+    CompactionCheckpoint
+)
+from .ai_utils import call_ai_model
+from .constants import (
+    COMPACTION_THRESHOLD,
+    COMPACTION_KEEP_RECENT,
+    COMPACTION_BATCH_SIZE,
+    COMPACTION_DELETE_CHUNK,
+    COMPACTION_LOCK_TTL,
+    MEMORY_SUMMARY_SYSTEM_PROMPT,
+    MEMORY_SUMMARY_TOOL
+)
+from .memory_cache import memory_cache
+from .memory_utils import dialogue_to_core_memory
+from .metrics import record_stage
+from .prompt_utils import format_core_memory_item
+
+COMPACTION_STAGES = ('select', 'summarize', 'persist', 'delete')
+
+
+class _StageReport:
+    """Rows processed and time taken per compaction stage."""
+
+    def __init__(self):
+        self.stages = {stage: {'rows': 0, 'seconds': 0.0} for stage in COMPACTION_STAGES}
+
+    def add(self, stage: str, rows: int, started: float) -> None:
+        seconds = time.monotonic() - started
+        self.stages[stage]['rows'] += rows
+        self.stages[stage]['seconds'] += seconds
+        record_stage(stage, seconds)
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            stage: {'rows': values['rows'], 'seconds': round(values['seconds'], 4)}
+            for stage, values in self.stages.items()
+        }
+
+
+def _acquire_lease(room_id: str, owner: str) -> bool:
+    """Take the compaction lease of a room unless another run holds it."""
+    database = room_db(room_id)
+    CompactionCheckpoint.objects.using(database).get_or_create(room_id=room_id)
+    now = timezone.now()
+    acquired = CompactionCheckpoint.objects.using(database).filter(
+        Q(lock_owner__isnull=True) | Q(locked_until__lt=now),
+        room_id=room_id
+    ).update(lock_owner=owner, locked_until=now + timedelta(seconds=COMPACTION_LOCK_TTL))
+    return acquired == 1
+
+
+def _renew_lease(room_id: str, owner: str) -> bool:
+    """Extend a held lease; False if it expired and was taken over."""
+    database = room_db(room_id)
+    renewed = CompactionCheckpoint.objects.using(database).filter(room_id=room_id, lock_owner=owner).update(
+        locked_until=timezone.now() + timedelta(seconds=COMPACTION_LOCK_TTL)
+    )
+    return renewed == 1
+
+
+def _release_lease(room_id: str, owner: str) -> None:
+    database = room_db(room_id)
+    CompactionCheckpoint.objects.using(database).filter(room_id=room_id, lock_owner=owner).update(
+        lock_owner=None,
+        locked_until=None
+    )
+
+
+def _summarize(dialogues: List[ConversationHistory]) -> str:
+    """
+    Summarize a batch of dialogues into short-term memory content.
+
+    Raises ``RuntimeError`` if the model returns no summary, so the batch is
+    neither saved nor deleted.
+    """
+    prompt = "\n".join(
+        ["请整理以下历史对话:"] + [format_core_memory_item(dialogue_to_core_memory(d)) for d in dialogues]
+    )
+    ai_result = call_ai_model(
+        prompt,
+        MEMORY_SUMMARY_SYSTEM_PROMPT,
+        tools=[MEMORY_SUMMARY_TOOL],
+        tool_choice="required",
+        priority="compaction"
+    )
+    if ai_result["type"] == "tool_call":
+        summary = ai_result["tool_arguments"].get("summary")
+    else:
+        summary = ai_result.get("content")
+    if not isinstance(summary, str) or not summary.strip():
+        raise RuntimeError("大模型未返回记忆摘要")
+    return summary.strip()
+
+
+def _delete_compacted(room_id: str, checkpoint: CompactionCheckpoint, report: _StageReport) -> int:
+    """Delete the summarized range of a checkpoint in bounded chunks."""
+    database = room_db(room_id)
+    compacted = ConversationHistory.objects.using(database).filter(
+        Q(created_at__lt=checkpoint.boundary_created_at) |
+        Q(created_at=checkpoint.boundary_created_at, id__lte=checkpoint.boundary_id),
+        room_id=room_id
+    )
+
+    deleted_rows = 0
+    while True:
+        started = time.monotonic()
+        chunk_ids = list(compacted.values_list('id', flat=True)[:COMPACTION_DELETE_CHUNK])
+        if not chunk_ids:
+            break
+
+        with transaction.atomic(using=database):
+            deleted, _ = ConversationHistory.objects.using(database).filter(id__in=chunk_ids).delete()
+            RoomStats.objects.using(database).filter(room_id=room_id).update(
+                dialogue_count=F('dialogue_count') - deleted
+            )
+        deleted_rows += deleted
+        report.add('delete', deleted, started)
+
+    CompactionCheckpoint.objects.using(database).filter(room_id=room_id).update(
+        status=CompactionCheckpoint.STATUS_IDLE,
+        compacted_rows=F('compacted_rows') + deleted_rows
+    )
+    return deleted_rows
+
+
+def compact_room(
+    room_id: str,
+    force: bool = False,
+    max_batches: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Compact the conversation history of a room into short-term memories.
+
+    Args:
+        room_id: The room to compact
+        force: Compact even if the room is below ``COMPACTION_THRESHOLD``
+        max_batches: Stop after this many batches (None for no limit)
+
+    Returns:
+        Report with the run status (``success``, ``skipped`` or ``busy``),
+        row counts and per-stage rows and seconds
+    """
+    started_at = time.monotonic()
+    owner = str(uuid.uuid4())
+    database = room_db(room_id)
+    report = _StageReport()
+    result = {
+        'room_id': room_id,
+        'status': 'success',
+        'batches': 0,
+        'memories_created': 0,
+        'rows_deleted': 0
+    }
+
+    if not _acquire_lease(room_id, owner):
+        result['status'] = 'busy'
+        result['stages'] = report.as_dict()
+        result['seconds'] = round(time.monotonic() - started_at, 4)
+        return result
+
+    try:
+        # Resume a run that stopped between persisting a summary and deleting its rows
+        checkpoint = CompactionCheckpoint.objects.using(database).get(room_id=room_id)
+        if checkpoint.status == CompactionCheckpoint.STATUS_SUMMARIZED:
+            result['rows_deleted'] += _delete_compacted(room_id, checkpoint, report)
+
+        history = ConversationHistory.objects.using(database).filter(room_id=room_id)
+        if not force and history.count() <= COMPACTION_THRESHOLD:
+            result['status'] = 'skipped'
+
+        while result['status'] == 'success':
+            if max_batches is not None and result['batches'] >= max_batches:
+                break
+            if not _renew_lease(room_id, owner):
+                result['status'] = 'busy'
+                break
+
+            started = time.monotonic()
+            if history.count() - COMPACTION_KEEP_RECENT < COMPACTION_BATCH_SIZE:
+                break
+            dialogues = list(history.order_by('created_at', 'id')[:COMPACTION_BATCH_SIZE])
+            report.add('select', len(dialogues), started)
+
+            started = time.monotonic()
+            summary = _summarize(dialogues)
+            report.add('summarize', len(dialogues), started)
+
+            started = time.monotonic()
+            with transaction.atomic(using=database):
+                memory = ShortTermMemory.objects.using(database).create(room_id=room_id, content=summary)
+                CompactionCheckpoint.objects.using(database).filter(room_id=room_id).update(
+                    status=CompactionCheckpoint.STATUS_SUMMARIZED,
+                    boundary_created_at=dialogues[-1].created_at,
+                    boundary_id=dialogues[-1].id,
+                    memory_id=memory.id
+                )
+            report.add('persist', len(dialogues), started)
+            result['memories_created'] += 1
+
+            checkpoint = CompactionCheckpoint.objects.using(database).get(room_id=room_id)
+            result['rows_deleted'] += _delete_compacted(room_id, checkpoint, report)
+            result['batches'] += 1
+    finally:
+        _release_lease(room_id, owner)
+        if result['rows_deleted']:
+            memory_cache.invalidate(room_id)
+
+    result['stages'] = report.as_dict()
+    result['seconds'] = round(time.monotonic() - started_at, 4)
+    return result
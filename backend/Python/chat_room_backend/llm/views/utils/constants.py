@@ -8,11 +8,80 @@ from typing import Dict, Any
 DEFAULT_MAX_TOKENS = 4096
 DEFAULT_TEMPERATURE = 0.7
 AI_MODEL = "glm-4.6"
+EMBEDDING_MODEL = "embedding-3"
+EMBEDDING_DIMENSIONS = 1024
+EMBEDDING_BATCH_SIZE = 64
 
 # Memory Configuration
 MAX_DIALOGUES_THRESHOLD = 10
 RECENT_MEMORIES_COUNT = 5
 
+# Token-budgeted prompts pick from a wider window of recent items
+BUDGET_DIALOGUES_WINDOW = 50
+BUDGET_MEMORIES_WINDOW = 20
+# Largest share of the budget a single entry may take before it is truncated
+PROMPT_MAX_ENTRY_SHARE = 0.25
+# Rendered room prompt prefixes kept per process
+PROMPT_PREFIX_CACHE_SIZE = 1024
+
+LONG_TERM_MEMORY_TOP_K = 3
+
+# Long-term Memory ANN Index Configuration (IVF-PQ)
+ANN_SUBQUANTIZERS = 64
+ANN_CODEBOOK_SIZE = 256
+ANN_TRAIN_SAMPLE = 20000
+ANN_KMEANS_ITERATIONS = 10
+ANN_RERANK_CANDIDATES = 300
+
+# Memory Compaction Configuration
+COMPACTION_THRESHOLD = 50
+COMPACTION_KEEP_RECENT = 20
+COMPACTION_BATCH_SIZE = 20
+COMPACTION_DELETE_CHUNK = 100
+COMPACTION_LOCK_TTL = 300
+# Batches one /api/memory/cleanup request summarizes at most; larger
+# backlogs are left to later requests or `manage.py compact_memories`
+COMPACTION_MAX_BATCHES_PER_REQUEST = 5
+
+# LLM Admission Control Configuration
+# Lower value = served first when calls queue up
+LLM_PRIORITIES = {
+    'actor': 0,
+    'admin': 1,
+    'compaction': 2,
+    'speculative': 3
+}
+# Completion tokens reserved per call until the provider reports usage
+LLM_COMPLETION_TOKEN_RESERVE = 512
+LLM_MAX_RETRY_AFTER = 120
+
+# LLM Call Latency Configuration
+# Recent successful calls kept per call kind for latency percentiles
+LLM_LATENCY_WINDOW = 200
+# Calls of a kind seen before its latency percentile is trusted for hedging
+LLM_HEDGE_MIN_SAMPLES = 20
+# Upper bounds (seconds) of the latency histogram buckets
+LLM_LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+# Upper bounds (seconds) of the request and stage latency histograms
+REQUEST_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Trace records waiting for the trace writer before new ones are dropped
+TRACE_QUEUE_MAX_RECORDS = 10000
+
+# Characters played by one /api/ai/actor/batch request
+BATCH_ACTOR_MAX_CHARACTERS = 8
+
+# Recent speakers read to predict the next speaker of a turn
+SPECULATIVE_HISTORY_WINDOW = 50
+
+# Response fields only sent with the debug response profile
+DEBUG_RESPONSE_FIELDS = frozenset({'core_memory', 'prompt', 'prompt_usage', 'ai_result'})
+
+# Room Scheduler Configuration
+ROOM_SCHEDULER_STATS_ROOMS = 1000
+ROOM_SCHEDULER_STATS_TOP = 20
+
 # System Prompts
 SYSTEM_PROMPT = (
     "你是一个专业的AI管理员，负责根据用户的世界观、人物设定和核心记忆，"
@@ -20,14 +89,27 @@ SYSTEM_PROMPT = (
     "重要：你必须使用提供的工具函数来返回你的分析结果，而不是直接输出文本。"
 )
 
-ACTOR_SYSTEM_PROMPT_TEMPLATE = (
-    "你现在要扮演角色【{character_name}】，请根据以下信息进行角色扮演：\n"
-    "1. 世界观设定\n"
-    "2. 角色设定\n"
-    "3. 核心记忆（历史对话和短期记忆）\n\n"
+# Shared by every admin and actor call of a room, so that the system
+# message (with worldview and settings) is an identical prompt prefix;
+# the role of a call is set by the instruction at the end of the user message
+ROOM_SYSTEM_PROMPT = (
+    "你是一个多角色聊天室的AI，负责根据房间的世界观、人物设定和核心记忆，"
+    "以用户消息末尾指定的身份（AI管理员或某个角色）生成回复。\n\n"
+    "重要：你必须使用提供的工具函数来返回结果，而不是直接输出文本。"
+)
+
+ADMIN_INSTRUCTION = "请根据以上信息，以AI管理员的身份生成适当的回复。"
+
+ACTOR_INSTRUCTION_TEMPLATE = (
+    "你现在要扮演角色【{character_name}】。"
     "请完全沉浸在【{character_name}】这个角色中，根据角色的性格、说话风格和当前状态，"
-    "结合历史对话的上下文，生成符合角色设定的回复。\n\n"
-    "重要：你必须使用提供的工具函数来返回你的回复，而不是直接输出文本。"
+    "结合历史对话的上下文，以【{character_name}】的身份生成符合角色设定的回复。"
+)
+
+MEMORY_SUMMARY_SYSTEM_PROMPT = (
+    "你是一个专业的记忆整理助手，负责把聊天室中的一段历史对话压缩成简洁的短期记忆。\n\n"
+    "请保留人物、地点、状态变化、关键事件和人物关系，省略寒暄和重复内容。\n\n"
+    "重要：你必须使用提供的工具函数来返回整理结果，而不是直接输出文本。"
 )
 
 # Function Call Tools
@@ -86,3 +168,21 @@ ACTOR_TOOL: Dict[str, Any] = {
         }
     }
 }
+
+MEMORY_SUMMARY_TOOL: Dict[str, Any] = {
+    "type": "function",
+    "function": {
+        "name": "memory_summary",
+        "description": "历史对话整理后的短期记忆",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "summary": {
+                    "type": "string",
+                    "description": "压缩后的记忆内容"
+                }
+            },
+            "required": ["summary"]
+        }
+    }
+}
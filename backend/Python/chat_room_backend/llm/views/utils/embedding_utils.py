@@ -0,0 +1,248 @@
+"""
+Embedding utilities for LLM views module.
+
+Texts are embedded through a pluggable ``EmbeddingProvider``, selected by
+``EMBEDDING_PROVIDER``. Embeddings are cached by a hash of the provider,
+model, dimensions and text, both in a process-local LRU and in the
+``embedding_cache`` table, so the same dialogue or summary text is only
+ever sent to the provider once. Texts that miss both caches are embedded
+in batches of ``EMBEDDING_BATCH_SIZE`` per call.
+"""
+
+import abc
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from ...models.db_models import EmbeddingCache
+from .ai_utils import embed_texts, aembed_texts
+from .constants import EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_BATCH_SIZE
+
+
+class EmbeddingProvider(abc.ABC):
+    """
+    Interface of embedding providers.
+
+    Subclasses implement ``embed`` for one batch of texts, and ``aembed``
+    if they can run without a thread.
+    """
+
+    name = 'base'
+    model = ''
+    dimensions = EMBEDDING_DIMENSIONS
+
+    @abc.abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch of texts."""
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed, texts)
+
+
+class ZhipuEmbeddingProvider(EmbeddingProvider):
+    """Zhipu ``embedding-3`` through the pooled LLM clients."""
+
+    name = 'zhipu'
+    model = EMBEDDING_MODEL
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return embed_texts(texts)
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        return await aembed_texts(texts)
+
+
+class FakeEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic local provider for tests and offline development.
+
+    Every text maps to a fixed pseudo-random unit vector seeded by its
+    hash, so equal texts get equal embeddings across runs and processes.
+    """
+
+    name = 'fake'
+    model = 'fake'
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+            vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts)
+
+
+EMBEDDING_PROVIDERS = {
+    'zhipu': ZhipuEmbeddingProvider,
+    'fake': FakeEmbeddingProvider
+}
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Create the provider configured by ``EMBEDDING_PROVIDER``."""
+    provider = settings.EMBEDDING_PROVIDER
+    if provider in EMBEDDING_PROVIDERS:
+        return EMBEDDING_PROVIDERS[provider]()
+    return import_string(provider)()
+
+
+class CachedEmbedder:
+    """Embeds texts through a provider behind an LRU and the cache table."""
+
+    def __init__(self, provider: EmbeddingProvider, max_items: int):
+        self.provider = provider
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._lru: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self.memory_hits = 0
+        self.table_hits = 0
+        self.embedded = 0
+        self.provider_calls = 0
+
+    def content_hash(self, text: str) -> str:
+        key = f"{self.provider.name}:{self.provider.model}:{self.provider.dimensions}:{text}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _from_memory(self, hashes: Dict[str, str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            for content_hash in hashes:
+                vector = self._lru.get(content_hash)
+                if vector is not None:
+                    self._lru.move_to_end(content_hash)
+                    found[content_hash] = vector
+            self.memory_hits += len(found)
+        return found
+
+    def _remember(self, vectors: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            for content_hash, vector in vectors.items():
+                self._lru[content_hash] = vector
+                self._lru.move_to_end(content_hash)
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+
+    def _from_table(self, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        rows = EmbeddingCache.objects.filter(content_hash__in=hashes).values_list('content_hash', 'embedding')
+        found = {content_hash: np.frombuffer(bytes(embedding), dtype=np.float32) for content_hash, embedding in rows}
+        with self._lock:
+            self.table_hits += len(found)
+        return found
+
+    def _store(self, vectors: Dict[str, np.ndarray]) -> None:
+        EmbeddingCache.objects.bulk_create(
+            [EmbeddingCache(content_hash=h, embedding=v.tobytes()) for h, v in vectors.items()],
+            ignore_conflicts=True
+        )
+
+    def _batches(self, missing: List[str]) -> List[List[str]]:
+        return [missing[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(missing), EMBEDDING_BATCH_SIZE)]
+
+    def _collect(self, batches: List[List[str]], results: List[List[List[float]]]) -> Dict[str, np.ndarray]:
+        embedded = {}
+        for batch, vectors in zip(batches, results):
+            for content_hash, vector in zip(batch, vectors):
+                embedded[content_hash] = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self.embedded += len(embedded)
+            self.provider_calls += len(batches)
+        return embedded
+
+    def embed(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """Embed texts, in input order, as float32 vectors."""
+        order = [self.content_hash(text) for text in texts]
+        hashes = dict(zip(order, texts))
+        vectors = self._from_memory(hashes)
+
+        missing = [h for h in hashes if h not in vectors]
+        if missing:
+            stored = self._from_table(missing)
+            vectors.update(stored)
+            missing = [h for h in missing if h not in stored]
+
+        if missing:
+            batches = self._batches(missing)
+            embedded = self._collect(
+                batches,
+                [self.provider.embed([hashes[h] for h in batch]) for batch in batches]
+            )
+            self._store(embedded)
+            vectors.update(embedded)
+
+        self._remember(vectors)
+        return [vectors[content_hash] for content_hash in order]
+
+    async def aembed(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """Async version of ``embed``; batches are sent concurrently."""
+        order = [self.content_hash(text) for text in texts]
+        hashes = dict(zip(order, texts))
+        vectors = self._from_memory(hashes)
+
+        missing = [h for h in hashes if h not in vectors]
+        if missing:
+            stored = await sync_to_async(self._from_table)(missing)
+            vectors.update(stored)
+            missing = [h for h in missing if h not in stored]
+
+        if missing:
+            batches = self._batches(missing)
+            embedded = self._collect(
+                batches,
+                await asyncio.gather(*[self.provider.aembed([hashes[h] for h in batch]) for batch in batches])
+            )
+            await sync_to_async(self._store)(embedded)
+            vectors.update(embedded)
+
+        self._remember(vectors)
+        return [vectors[content_hash] for content_hash in order]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'provider': self.provider.name,
+                'cached_items': len(self._lru),
+                'max_items': self.max_items,
+                'memory_hits': self.memory_hits,
+                'table_hits': self.table_hits,
+                'embedded': self.embedded,
+                'provider_calls': self.provider_calls
+            }
+
+
+_embedder: Optional[CachedEmbedder] = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> CachedEmbedder:
+    """Get the process-wide cached embedder of the configured provider."""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = CachedEmbedder(get_embedding_provider(), settings.EMBEDDING_CACHE_MAX_ITEMS)
+    return _embedder
+
+
+def get_embeddings(texts: Sequence[str]) -> List[np.ndarray]:
+    """Embed texts through the cache, in input order."""
+    return get_embedder().embed(texts)
+
+
+async def aget_embeddings(texts: Sequence[str]) -> List[np.ndarray]:
+    """Async version of ``get_embeddings``."""
+    return await get_embedder().aembed(texts)
+
+
+def get_embedding_stats() -> Dict[str, Any]:
+    """Get embedding cache hits and provider calls."""
+    return get_embedder().stats()
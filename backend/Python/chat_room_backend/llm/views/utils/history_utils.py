@@ -0,0 +1,361 @@
+"""
+Conversation history utilities for LLM views module.
+
+Conversation history rows are inserted together with the per-room stats
+row in one transaction, so the dialogue count, last activity time and last
+speaker of a room can be read without scanning its history.
+
+Inserts from concurrent requests are group committed: a writer thread per
+room database collects the writes arriving within ``WRITE_BUFFER_WINDOW_MS`` (up to
+``WRITE_BUFFER_MAX_ROWS`` rows) and commits them in one transaction, so
+concurrent requests share one database write lock and fsync instead of
+queueing for one each. Dialogue writes are awaited until they are
+committed, so a request, and the next turn of its room, always read its
+own dialogues. Admin analyses are not read back while serving requests and
+are written behind, without waiting; pending writes are flushed when the
+process exits.
+"""
+
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Sequence
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ...db_router import room_db
+from ...models.db_models import ConversationHistory, AdminAnalysisRecord, RoomStats
+from .memory_cache import memory_cache
+from .memory_utils import dialogue_to_core_memory
+
+logger = logging.getLogger(__name__)
+
+
+def _bump_room_stats(room_id: str, dialogues: List[ConversationHistory]) -> None:
+    """Add newly inserted dialogues to the stats row of a room."""
+    database = room_db(room_id)
+    last_dialogue = dialogues[-1]
+    changes = {
+        'last_activity_at': last_dialogue.created_at,
+        'last_speaker_id': last_dialogue.character_id,
+        'last_speaker_name': last_dialogue.character_name,
+        'updated_at': timezone.now()
+    }
+
+    updated = RoomStats.objects.using(database).filter(room_id=room_id).update(
+        dialogue_count=F('dialogue_count') + len(dialogues),
+        **changes
+    )
+    if updated:
+        return
+
+    # First insert since the stats table exists: count the room once,
+    # including the rows inserted by this transaction
+    try:
+        with transaction.atomic(using=database):
+            RoomStats.objects.using(database).create(
+                room_id=room_id,
+                dialogue_count=ConversationHistory.objects.using(database).filter(room_id=room_id).count(),
+                **changes
+            )
+    except IntegrityError:
+        # Created concurrently by another writer
+        RoomStats.objects.using(database).filter(room_id=room_id).update(
+            dialogue_count=F('dialogue_count') + len(dialogues),
+            **changes
+        )
+
+
+def save_dialogues(dialogues: List[ConversationHistory]) -> None:
+    """
+    Insert conversation history rows and update room stats in one
+    transaction per room database.
+
+    The rows are written through to the core memory cache after commit.
+    """
+    if not dialogues:
+        return
+
+    databases: 'OrderedDict[str, OrderedDict[str, List[ConversationHistory]]]' = OrderedDict()
+    for dialogue in dialogues:
+        rooms = databases.setdefault(room_db(dialogue.room_id), OrderedDict())
+        rooms.setdefault(dialogue.room_id, []).append(dialogue)
+
+    for database, rooms in databases.items():
+        with transaction.atomic(using=database):
+            database_dialogues = [dialogue for room_dialogues in rooms.values() for dialogue in room_dialogues]
+            ConversationHistory.objects.using(database).bulk_create(database_dialogues)
+            for room_id, room_dialogues in rooms.items():
+                _bump_room_stats(room_id, room_dialogues)
+
+            # bulk_create sends no post_save signal, so update the cache here
+            for dialogue in database_dialogues:
+                transaction.on_commit(
+                    lambda dialogue=dialogue: memory_cache.append(
+                        dialogue.room_id, dialogue.id, dialogue_to_core_memory(dialogue)
+                    ),
+                    using=database
+                )
+
+
+def _write(dialogues: Sequence[ConversationHistory], analyses: Sequence[AdminAnalysisRecord]) -> None:
+    """Insert dialogues and admin analyses in one transaction per room database."""
+    databases: 'OrderedDict[str, tuple[List[ConversationHistory], List[AdminAnalysisRecord]]]' = OrderedDict()
+    for dialogue in dialogues:
+        databases.setdefault(room_db(dialogue.room_id), ([], []))[0].append(dialogue)
+    for analysis in analyses:
+        databases.setdefault(room_db(analysis.room_id), ([], []))[1].append(analysis)
+
+    for database, (database_dialogues, database_analyses) in databases.items():
+        with transaction.atomic(using=database):
+            save_dialogues(database_dialogues)
+            if database_analyses:
+                AdminAnalysisRecord.objects.using(database).bulk_create(database_analyses)
+
+
+class _WriteJob:
+    def __init__(self, dialogues: Sequence[ConversationHistory], analyses: Sequence[AdminAnalysisRecord]):
+        self.dialogues = dialogues
+        self.analyses = analyses
+        self.rows = len(dialogues) + len(analyses)
+        self.database = room_db((list(dialogues) + list(analyses))[0].room_id)
+        self.future: Future = Future()
+        self.submitted = time.monotonic()
+
+
+class _WriteQueue:
+    """Pending writes of one database and the thread committing them."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.jobs: List[_WriteJob] = []
+        self.rows = 0
+        self.thread: Optional[threading.Thread] = None
+
+
+class GroupCommitWriter:
+    """
+    Writer threads committing the inserts of concurrent requests together,
+    one per room database so that shards are written in parallel.
+    """
+
+    def __init__(self, window: float, max_rows: int):
+        self.window = window
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._queues: Dict[str, _WriteQueue] = {}
+        self._closed = False
+        self.batches = 0
+        self.jobs = 0
+        self.dialogues = 0
+        self.analyses = 0
+        self.max_batch_jobs = 0
+        self.commit_seconds = 0.0
+        self.max_commit_seconds = 0.0
+        self.write_seconds = 0.0
+        self.split_batches = 0
+        self.failed_jobs = 0
+
+    def submit(
+        self,
+        dialogues: Sequence[ConversationHistory] = (),
+        analyses: Sequence[AdminAnalysisRecord] = ()
+    ) -> Optional[Future]:
+        """
+        Queue a write; the future is resolved once it is committed.
+
+        A write is committed by the writer of the database of its first
+        row. Returns None if the writer is shut down, in which case the
+        caller must write itself.
+        """
+        job = _WriteJob(dialogues, analyses)
+        with self._lock:
+            if self._closed:
+                return None
+            queue = self._queues.get(job.database)
+            if queue is None:
+                queue = self._queues[job.database] = _WriteQueue()
+        with queue.cond:
+            queue.jobs.append(job)
+            queue.rows += job.rows
+            if queue.thread is None:
+                queue.thread = threading.Thread(
+                    target=self._run,
+                    args=(queue,),
+                    name=f"group-commit-{job.database}",
+                    daemon=True
+                )
+                queue.thread.start()
+            queue.cond.notify()
+        return job.future
+
+    async def awrite(
+        self,
+        dialogues: Sequence[ConversationHistory] = (),
+        analyses: Sequence[AdminAnalysisRecord] = ()
+    ) -> None:
+        """Write rows and wait until they are committed."""
+        future = self.submit(dialogues, analyses) if settings.WRITE_BUFFER_ENABLED else None
+        if future is None:
+            await sync_to_async(_write)(dialogues, analyses)
+            return
+        # Shielded so a disconnecting client does not lose the rows
+        await asyncio.shield(asyncio.wrap_future(future))
+
+    def _run(self, queue: _WriteQueue) -> None:
+        try:
+            while True:
+                with queue.cond:
+                    while not queue.jobs and not self._closed:
+                        queue.cond.wait()
+                    if not queue.jobs:
+                        return
+                    # Gather the writes of the next window into the batch
+                    window_end = time.monotonic() + self.window
+                    while queue.rows < self.max_rows and not self._closed:
+                        remaining = window_end - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        queue.cond.wait(remaining)
+                    jobs, queue.jobs, queue.rows = queue.jobs, [], 0
+                self._commit(jobs)
+        finally:
+            connections.close_all()
+
+    def _commit(self, jobs: List[_WriteJob]) -> None:
+        started = time.monotonic()
+        split = False
+        try:
+            _write(
+                [dialogue for job in jobs for dialogue in job.dialogues],
+                [analysis for job in jobs for analysis in job.analyses]
+            )
+            outcomes = [None] * len(jobs)
+        except Exception as error:
+            if len(jobs) == 1:
+                outcomes = [error]
+            else:
+                # Do not fail every request of the batch for one bad write
+                split = True
+                outcomes = []
+                for job in jobs:
+                    try:
+                        _write(job.dialogues, job.analyses)
+                        outcomes.append(None)
+                    except Exception as job_error:
+                        outcomes.append(job_error)
+        finished = time.monotonic()
+
+        with self._lock:
+            self.batches += 1
+            self.jobs += len(jobs)
+            self.dialogues += sum(len(job.dialogues) for job in jobs)
+            self.analyses += sum(len(job.analyses) for job in jobs)
+            self.max_batch_jobs = max(self.max_batch_jobs, len(jobs))
+            self.commit_seconds += finished - started
+            self.max_commit_seconds = max(self.max_commit_seconds, finished - started)
+            self.write_seconds += sum(finished - job.submitted for job in jobs)
+            self.split_batches += split
+            self.failed_jobs += sum(outcome is not None for outcome in outcomes)
+
+        for job, outcome in zip(jobs, outcomes):
+            if outcome is None:
+                job.future.set_result(None)
+            else:
+                job.future.set_exception(outcome)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Commit pending writes and stop the writer threads."""
+        with self._lock:
+            self._closed = True
+            queues = list(self._queues.values())
+        for queue in queues:
+            with queue.cond:
+                queue.cond.notify()
+        for queue in queues:
+            if queue.thread is not None:
+                queue.thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queues = list(self._queues.values())
+        pending_jobs = 0
+        for queue in queues:
+            with queue.cond:
+                pending_jobs += len(queue.jobs)
+        with self._lock:
+            return {
+                'enabled': settings.WRITE_BUFFER_ENABLED,
+                'window_ms': round(self.window * 1000, 3),
+                'writers': len(queues),
+                'pending_jobs': pending_jobs,
+                'batches': self.batches,
+                'jobs': self.jobs,
+                'dialogues': self.dialogues,
+                'analyses': self.analyses,
+                'avg_batch_jobs': round(self.jobs / self.batches, 2) if self.batches else 0.0,
+                'max_batch_jobs': self.max_batch_jobs,
+                'avg_commit_ms': round(self.commit_seconds / self.batches * 1000, 3) if self.batches else 0.0,
+                'max_commit_ms': round(self.max_commit_seconds * 1000, 3),
+                'avg_write_ms': round(self.write_seconds / self.jobs * 1000, 3) if self.jobs else 0.0,
+                'split_batches': self.split_batches,
+                'failed_jobs': self.failed_jobs
+            }
+
+
+write_buffer = GroupCommitWriter(settings.WRITE_BUFFER_WINDOW_MS / 1000.0, settings.WRITE_BUFFER_MAX_ROWS)
+atexit.register(write_buffer.close)
+
+
+async def asave_dialogues(
+    dialogues: List[ConversationHistory],
+    analyses: Sequence[AdminAnalysisRecord] = ()
+) -> None:
+    """
+    Async version of ``save_dialogues``, group committed with concurrent
+    writes. ``analyses`` are inserted in the same transaction.
+    """
+    if not dialogues and not analyses:
+        return
+    await write_buffer.awrite(dialogues, analyses)
+
+
+def _log_failed_write(future: Future) -> None:
+    if future.exception() is not None:
+        logger.error("Writing an admin analysis failed", exc_info=future.exception())
+
+
+async def asave_admin_analysis(analysis: AdminAnalysisRecord) -> None:
+    """Save an admin analysis behind the request, without waiting for the commit."""
+    future = write_buffer.submit(analyses=[analysis]) if settings.WRITE_BUFFER_ENABLED else None
+    if future is None:
+        await analysis.asave()
+        return
+    future.add_done_callback(_log_failed_write)
+
+
+def get_write_buffer_stats() -> Dict[str, Any]:
+    """Get group commit batch sizes and commit latency."""
+    return write_buffer.stats()
+
+
+def get_room_stats(room_id: str) -> Optional[Dict[str, Any]]:
+    """Get the maintained stats of a room, or None if it has none yet."""
+    return RoomStats.objects.using(room_db(room_id)).filter(room_id=room_id).values(
+        'dialogue_count', 'last_activity_at', 'last_speaker_id', 'last_speaker_name'
+    ).first()
+
+
+async def aget_room_stats(room_id: str) -> Optional[Dict[str, Any]]:
+    """Async version of ``get_room_stats``."""
+    return await RoomStats.objects.using(room_db(room_id)).filter(room_id=room_id).values(
+        'dialogue_count', 'last_activity_at', 'last_speaker_id', 'last_speaker_name'
+    ).afirst()
@@ -0,0 +1,222 @@
+"""
+Idempotency utilities for LLM views module.
+
+A retried AI call is recognized by its ``Idempotency-Key`` header or, with
+``IDEMPOTENCY_HASH_BODY``, by a hash of its body. Body hashing is off by
+default: a turn repeating the same short line is a new turn, not a retry.
+The first call runs the view; a retry that arrives while it is still
+running waits for its response, and a retry within
+``IDEMPOTENCY_TTL_SECONDS`` after it succeeded gets the stored response
+back without calling the model again. Failed responses are not stored, so
+a later retry runs the view again; the steps it already completed (e.g.
+saving the incoming dialogue) can be skipped with ``idempotent_step_done``.
+
+Futures are ``concurrent.futures`` futures because requests may run on
+different event loops (one per request under WSGI).
+"""
+
+import asyncio
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, Set, Tuple
+
+from django.conf import settings
+from django.http import HttpResponse
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+class StoredResponse:
+    """Status, body and content type of a finished response."""
+
+    def __init__(self, response: HttpResponse):
+        self.status = response.status_code
+        self.content = response.content
+        self.content_type = response.get('Content-Type')
+
+    def to_response(self) -> HttpResponse:
+        response = HttpResponse(self.content, status=self.status, content_type=self.content_type)
+        response[REPLAYED_HEADER] = 'true'
+        return response
+
+
+class _Entry:
+    def __init__(self):
+        self.future: Optional[Future] = Future()
+        self.expires = float('inf')
+        self.steps: Set[str] = set()
+
+
+class IdempotencyCache:
+    """
+    TTL/LRU of AI call results by idempotency key.
+
+    Entries expire ``ttl`` seconds after their call finished. In-flight
+    calls never expire, but may be evicted by ``max_items``; their waiters
+    still get the result.
+    """
+
+    def __init__(self, ttl: float, max_items: int):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self.hits = 0
+        self.waits = 0
+        self.misses = 0
+        self.stored = 0
+        self.skipped_steps = 0
+
+    def _purge(self, now: float) -> None:
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires > now and len(self._entries) <= self.max_items:
+                break
+            del self._entries[key]
+
+    def begin(self, key: str) -> Tuple[_Entry, Future, bool]:
+        """
+        Look up a key, starting a call if there is none.
+
+        Returns:
+            Tuple of (entry, future of the call, whether the caller runs it)
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= now:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            elif entry.future is not None:
+                if entry.future.done():
+                    self.hits += 1
+                else:
+                    self.waits += 1
+                return entry, entry.future, False
+            else:
+                # The previous call failed; run again, keeping its steps
+                entry.future = Future()
+                entry.expires = float('inf')
+
+            self.misses += 1
+            return entry, entry.future, True
+
+    def finish(self, key: str, entry: _Entry, future: Future, response: Optional[HttpResponse]) -> None:
+        """Hand a call's response to its waiters, storing it if it succeeded."""
+        stored = StoredResponse(response) if response is not None and response.status_code < 400 else None
+        with self._lock:
+            entry.expires = time.monotonic() + self.ttl
+            if stored is None:
+                entry.future = None
+            else:
+                self.stored += 1
+            if self._entries.get(key) is entry:
+                self._entries.move_to_end(key)
+        # Waiters of a failed call get None and retry it themselves
+        future.set_result(stored)
+
+    def step_done(self, key: str, step: str) -> bool:
+        """Return whether an earlier call of a key already completed a step."""
+        with self._lock:
+            entry = self._entries.get(key)
+            done = entry is not None and step in entry.steps
+            if done:
+                self.skipped_steps += 1
+            return done
+
+    def mark_step(self, key: str, step: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.steps.add(step)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'in_flight': sum(
+                    1 for entry in self._entries.values()
+                    if entry.future is not None and not entry.future.done()
+                ),
+                'max_items': self.max_items,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'waits': self.waits,
+                'misses': self.misses,
+                'stored': self.stored,
+                'skipped_steps': self.skipped_steps
+            }
+
+
+idempotency_cache = IdempotencyCache(settings.IDEMPOTENCY_TTL_SECONDS, settings.IDEMPOTENCY_CACHE_MAX_ITEMS)
+
+
+def get_idempotency_key(request) -> Optional[str]:
+    """Get the idempotency key of a POST request, scoped to its path."""
+    if not settings.IDEMPOTENCY_ENABLED or request.method != 'POST':
+        return None
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        if not settings.IDEMPOTENCY_HASH_BODY:
+            return None
+        key = 'body:' + hashlib.sha256(request.body).hexdigest()
+    return f"{request.path}:{key}"
+
+
+def idempotent(view):
+    """Decorate an async view so retried calls share one response."""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = get_idempotency_key(request)
+        if key is None:
+            return await view(request, *args, **kwargs)
+
+        while True:
+            entry, future, owner = idempotency_cache.begin(key)
+            if owner:
+                break
+            # Shielded so a disconnecting retry does not cancel the original
+            stored = await asyncio.shield(asyncio.wrap_future(future))
+            if stored is not None:
+                return stored.to_response()
+
+        request.idempotency_key = key
+        response = None
+        try:
+            response = await view(request, *args, **kwargs)
+            return response
+        finally:
+            idempotency_cache.finish(key, entry, future, response)
+
+    return wrapper
+
+
+def idempotent_step_done(request, step: str) -> bool:
+    """
+    Return whether a side effect of a request was already done by an
+    earlier, failed attempt with the same key.
+    """
+    key = getattr(request, 'idempotency_key', None)
+    return key is not None and idempotency_cache.step_done(key, step)
+
+
+def mark_idempotent_step(request, step: str) -> None:
+    """Record that a side effect of a request is done."""
+    key = getattr(request, 'idempotency_key', None)
+    if key is not None:
+        idempotency_cache.mark_step(key, step)
+
+
+def get_idempotency_stats() -> Dict[str, Any]:
+    """Get idempotency cache size and replay counters."""
+    return idempotency_cache.stats()
@@ -0,0 +1,269 @@
+"""
+Incremental JSON utilities for LLM views module.
+
+Parses streamed tool call arguments, which arrive as fragments of one JSON
+object, and reports each top-level field as soon as its value is complete.
+"""
+
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+# Parser states
+_EXPECT_OBJECT = 0
+_EXPECT_KEY = 1
+_IN_KEY = 2
+_EXPECT_COLON = 3
+_EXPECT_VALUE = 4
+_IN_STRING_VALUE = 5
+_IN_SCALAR_VALUE = 6
+_IN_NESTED_VALUE = 7
+_EXPECT_COMMA = 8
+_DONE = 9
+
+_WHITESPACE = ' \t\r\n'
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t'
+}
+
+# Event produced by ToolArgumentsParser.feed: (kind, field name, payload)
+ParserEvent = Tuple[str, str, Any]
+
+
+class ToolArgumentsParser:
+    """
+    Incremental parser for the JSON object of streamed tool call arguments.
+
+    ``feed`` accepts argument fragments and returns events:
+    - ``("delta", key, text)`` when more of a top-level string value has
+      been decoded
+    - ``("field", key, value)`` when a top-level value is complete
+
+    Nested objects and arrays are reported once complete, as decoded values.
+    """
+
+    def __init__(self):
+        self._state = _EXPECT_OBJECT
+        self._key = None
+        self._chars: List[str] = []
+        self._escape = ''
+        self._high_surrogate: Optional[int] = None
+        self._nested_depth = 0
+        self._nested_in_string = False
+        self._nested_escape = False
+        self.fields: Dict[str, Any] = {}
+        self._partials: Dict[str, List[str]] = {}
+
+    @property
+    def done(self) -> bool:
+        """Whether the whole arguments object has been parsed."""
+        return self._state == _DONE
+
+    def partial(self, key: str) -> str:
+        """Return the decoded part of a string field, complete or not."""
+        if key in self.fields and isinstance(self.fields[key], str):
+            return self.fields[key]
+        return ''.join(self._partials.get(key, []))
+
+    def result(self) -> Dict[str, Any]:
+        """Return all fields once the arguments object is complete."""
+        if not self.done:
+            raise ValueError("工具调用参数不完整")
+        return dict(self.fields)
+
+    def feed(self, chunk: str) -> List[ParserEvent]:
+        """Consume an arguments fragment and return the produced events."""
+        events: List[ParserEvent] = []
+        index = 0
+        length = len(chunk)
+
+        while index < length:
+            state = self._state
+
+            if state in (_IN_KEY, _IN_STRING_VALUE):
+                index = self._consume_string(chunk, index, events)
+                continue
+
+            if state == _IN_NESTED_VALUE:
+                index = self._consume_nested(chunk, index, events)
+                continue
+
+            char = chunk[index]
+
+            if state == _IN_SCALAR_VALUE:
+                if char in ',}' or char in _WHITESPACE:
+                    self._finish_value(json.loads(''.join(self._chars)), events)
+                    continue
+                self._chars.append(char)
+                index += 1
+                continue
+
+            index += 1
+            if char in _WHITESPACE:
+                continue
+
+            if state == _EXPECT_OBJECT:
+                self._expect(char, '{')
+                self._state = _EXPECT_KEY
+            elif state == _EXPECT_KEY:
+                if char == '}' and not self.fields:
+                    self._state = _DONE
+                else:
+                    self._expect(char, '"')
+                    self._start_string(_IN_KEY)
+            elif state == _EXPECT_COLON:
+                self._expect(char, ':')
+                self._state = _EXPECT_VALUE
+            elif state == _EXPECT_VALUE:
+                if char == '"':
+                    self._partials[self._key] = []
+                    self._start_string(_IN_STRING_VALUE)
+                elif char in '{[':
+                    self._chars = [char]
+                    self._nested_depth = 1
+                    self._nested_in_string = False
+                    self._nested_escape = False
+                    self._state = _IN_NESTED_VALUE
+                else:
+                    self._chars = [char]
+                    self._state = _IN_SCALAR_VALUE
+            elif state == _EXPECT_COMMA:
+                if char == ',':
+                    self._state = _EXPECT_KEY
+                else:
+                    self._expect(char, '}')
+                    self._state = _DONE
+            elif state == _DONE:
+                raise ValueError("工具调用参数在JSON对象结束后仍有内容")
+
+        return events
+
+    def _expect(self, char: str, expected: str) -> None:
+        if char != expected:
+            raise ValueError(f"工具调用参数JSON格式错误: 期望 {expected!r}，实际为 {char!r}")
+
+    def _start_string(self, state: int) -> None:
+        self._chars = []
+        self._escape = ''
+        self._high_surrogate = None
+        self._state = state
+
+    def _append_decoded(self, text: str, events: List[ParserEvent]) -> None:
+        self._chars.append(text)
+        if self._state == _IN_STRING_VALUE:
+            self._partials[self._key].append(text)
+            if events and events[-1][0] == 'delta' and events[-1][1] == self._key:
+                events[-1] = ('delta', self._key, events[-1][2] + text)
+            else:
+                events.append(('delta', self._key, text))
+
+    def _consume_string(self, chunk: str, index: int, events: List[ParserEvent]) -> int:
+        """Decode string characters until the closing quote or the end of the chunk."""
+        length = len(chunk)
+        while index < length:
+            if self._escape:
+                index = self._consume_escape(chunk, index, events)
+                continue
+
+            # Copy runs of plain characters in one step
+            end = index
+            while end < length and chunk[end] not in '"\\':
+                end += 1
+            if end > index:
+                self._flush_surrogate(events)
+                self._append_decoded(chunk[index:end], events)
+                index = end
+                continue
+
+            char = chunk[index]
+            index += 1
+            if char == '\\':
+                self._escape = '\\'
+                continue
+
+            # Closing quote
+            self._flush_surrogate(events)
+            value = ''.join(self._chars)
+            if self._state == _IN_KEY:
+                self._key = value
+                self._state = _EXPECT_COLON
+            else:
+                del self._partials[self._key]
+                self._finish_value(value, events)
+            return index
+        return index
+
+    def _consume_escape(self, chunk: str, index: int, events: List[ParserEvent]) -> int:
+        """Decode one escape sequence, which may span several chunks."""
+        self._escape += chunk[index]
+        index += 1
+
+        if self._escape[1] != 'u':
+            if self._escape[1] not in _SIMPLE_ESCAPES:
+                raise ValueError(f"工具调用参数JSON格式错误: 无效转义 {self._escape!r}")
+            self._flush_surrogate(events)
+            self._append_decoded(_SIMPLE_ESCAPES[self._escape[1]], events)
+            self._escape = ''
+            return index
+
+        if len(self._escape) < 6:
+            return index
+
+        code = int(self._escape[2:], 16)
+        self._escape = ''
+        if 0xD800 <= code <= 0xDBFF:
+            self._flush_surrogate(events)
+            self._high_surrogate = code
+        elif 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            combined = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+            self._append_decoded(chr(combined), events)
+        else:
+            self._flush_surrogate(events)
+            self._append_decoded(chr(code), events)
+        return index
+
+    def _flush_surrogate(self, events: List[ParserEvent]) -> None:
+        """Emit a high surrogate that was not followed by a low surrogate."""
+        if self._high_surrogate is not None:
+            self._append_decoded(chr(self._high_surrogate), events)
+            self._high_surrogate = None
+
+    def _consume_nested(self, chunk: str, index: int, events: List[ParserEvent]) -> int:
+        """Collect a nested object or array until its brackets balance."""
+        length = len(chunk)
+        start = index
+        while index < length:
+            char = chunk[index]
+            index += 1
+            if self._nested_in_string:
+                if self._nested_escape:
+                    self._nested_escape = False
+                elif char == '\\':
+                    self._nested_escape = True
+                elif char == '"':
+                    self._nested_in_string = False
+            elif char == '"':
+                self._nested_in_string = True
+            elif char in '{[':
+                self._nested_depth += 1
+            elif char in '}]':
+                self._nested_depth -= 1
+                if self._nested_depth == 0:
+                    self._chars.append(chunk[start:index])
+                    self._finish_value(json.loads(''.join(self._chars)), events)
+                    return index
+        self._chars.append(chunk[start:index])
+        return index
+
+    def _finish_value(self, value: Any, events: List[ParserEvent]) -> None:
+        self.fields[self._key] = value
+        events.append(('field', self._key, value))
+        self._chars = []
+        self._state = _EXPECT_COMMA
@@ -0,0 +1,310 @@
+"""
+LLM admission control for LLM views module.
+
+Every chat completion call is admitted by a process-wide ``LLMGovernor``
+before it is sent. A call runs when a concurrency slot is free and the
+request and token buckets (``LLM_REQUESTS_PER_MINUTE``,
+``LLM_TOKENS_PER_MINUTE``) allow it; otherwise it queues by priority
+(actor turns, then admin analyses, then memory compaction).
+
+The queue holds at most ``LLM_QUEUE_MAX`` calls. When it is full, a new
+call either takes the place of a queued call of lower priority or is
+rejected at once with ``LLMOverloadedError``, which the views turn into a
+429 with ``Retry-After``. Calls queued longer than ``LLM_QUEUE_TIMEOUT``
+are rejected the same way.
+
+Token costs are estimated before the call and corrected with the usage the
+provider reports. Waiters are ``concurrent.futures`` futures, so the
+governor serves async views on any event loop as well as synchronous
+callers in worker threads.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, List, Optional
+
+from django.conf import settings
+
+from .constants import LLM_PRIORITIES, LLM_MAX_RETRY_AFTER
+
+
+class LLMOverloadedError(Exception):
+    """The LLM queue is full or a call waited too long to be admitted."""
+
+    def __init__(self, retry_after: int, message: str = "大模型调用繁忙，请稍后重试"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _TokenBucket:
+    """Refills ``per_minute`` units over a minute, up to ``per_minute``."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until ``amount`` (at most the capacity) is available."""
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+
+class _Ticket:
+    def __init__(self, priority: int, sequence: int, tokens: int):
+        self.priority = priority
+        self.sequence = sequence
+        self.tokens = tokens
+        self.future: Future = Future()
+        self.granted = False
+        self.abandoned = False
+        self.queued_at = time.monotonic()
+        self.started = 0.0
+
+    def __lt__(self, other: '_Ticket') -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class LLMGovernor:
+    """Priority admission queue with concurrency and rate limits."""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_queue: int,
+        queue_timeout: float
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._requests = _TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+        self._heap: List[_Ticket] = []
+        self._sequence = itertools.count()
+        self._timer_at: Optional[float] = None
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.call_seconds = 0.0
+        self.shed: Dict[str, int] = {name: 0 for name in LLM_PRIORITIES}
+        self.timed_out = 0
+
+    # Must be called with the lock held
+
+    def _bucket_wait(self, tokens: int, now: float) -> float:
+        wait = 0.0
+        for bucket, amount in ((self._requests, 1), (self._tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_for(amount))
+        return wait
+
+    def _grant(self, ticket: _Ticket, now: float) -> None:
+        if self._requests is not None:
+            self._requests.level -= 1
+        if self._tokens is not None:
+            self._tokens.level -= ticket.tokens
+        self.in_flight += 1
+        self.admitted += 1
+        ticket.granted = True
+        ticket.started = now
+
+    def _dispatch(self, now: float) -> None:
+        """Admit queued calls in priority order while limits allow."""
+        while self._heap:
+            ticket = self._heap[0]
+            if ticket.abandoned:
+                heapq.heappop(self._heap)
+                continue
+            if self.in_flight >= self.max_concurrency:
+                return
+            wait = self._bucket_wait(ticket.tokens, now)
+            if wait > 0:
+                self._schedule(wait, now)
+                return
+            heapq.heappop(self._heap)
+            self.queued -= 1
+            self.waited += 1
+            self.wait_seconds += now - ticket.queued_at
+            self._grant(ticket, now)
+            ticket.future.set_result(None)
+
+    def _schedule(self, wait: float, now: float) -> None:
+        """Dispatch again once the buckets have refilled."""
+        if self._timer_at is not None and self._timer_at <= now + wait:
+            return
+        self._timer_at = now + wait
+        timer = threading.Timer(wait, self._on_timer)
+        timer.daemon = True
+        timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer_at = None
+            self._dispatch(time.monotonic())
+
+    def _retry_after(self, now: float, tokens: int = 0) -> int:
+        seconds = max(1.0, self._bucket_wait(tokens, now))
+        if self._requests is not None:
+            seconds = max(seconds, (self.queued + 1) / self._requests.rate)
+        if self.admitted:
+            average = self.call_seconds / self.admitted
+            seconds = max(seconds, average * (self.queued + 1) / self.max_concurrency)
+        return min(LLM_MAX_RETRY_AFTER, math.ceil(seconds))
+
+    def _enter(self, priority: str, tokens: int) -> _Ticket:
+        rank = LLM_PRIORITIES[priority]
+        now = time.monotonic()
+        with self._lock:
+            ticket = _Ticket(rank, next(self._sequence), tokens)
+            if not self.queued and self.in_flight < self.max_concurrency and not self._bucket_wait(tokens, now):
+                self._grant(ticket, now)
+                return ticket
+
+            if self.queued >= self.max_queue:
+                queued = [t for t in self._heap if not t.abandoned]
+                worst = max(queued) if queued else None
+                if worst is None or worst.priority <= rank:
+                    self.shed[priority] += 1
+                    raise LLMOverloadedError(self._retry_after(now, tokens))
+                # Make room by shedding the newest call of the lowest priority
+                worst.abandoned = True
+                self.queued -= 1
+                self.shed[_priority_name(worst.priority)] += 1
+                worst.future.set_exception(LLMOverloadedError(self._retry_after(now)))
+
+            heapq.heappush(self._heap, ticket)
+            self.queued += 1
+            self._dispatch(now)
+            return ticket
+
+    def _abandon(self, ticket: _Ticket) -> bool:
+        """Leave the queue; returns True if the call was admitted meanwhile."""
+        with self._lock:
+            if ticket.future.done():
+                return ticket.granted
+            ticket.abandoned = True
+            self.queued -= 1
+            self.timed_out += 1
+            return False
+
+    def _timed_out(self, ticket: _Ticket) -> LLMOverloadedError:
+        with self._lock:
+            return LLMOverloadedError(self._retry_after(time.monotonic(), ticket.tokens))
+
+    def _wait_timeout(self, timeout: Optional[float]) -> float:
+        return self.queue_timeout if timeout is None else max(0.0, min(self.queue_timeout, timeout))
+
+    def try_admit(self, priority: str, tokens: int) -> Optional[_Ticket]:
+        """Admit a call only if it can run right away, without queueing."""
+        now = time.monotonic()
+        with self._lock:
+            if self.queued or self.in_flight >= self.max_concurrency or self._bucket_wait(tokens, now):
+                return None
+            ticket = _Ticket(LLM_PRIORITIES[priority], next(self._sequence), tokens)
+            self._grant(ticket, now)
+            return ticket
+
+    def admit(self, priority: str, tokens: int, timeout: Optional[float] = None) -> _Ticket:
+        """
+        Wait until a call may run; raises ``LLMOverloadedError`` if it may not.
+
+        ``timeout`` shortens the wait below ``LLM_QUEUE_TIMEOUT``, e.g. to
+        the time left until the caller's deadline.
+        """
+        ticket = self._enter(priority, tokens)
+        if ticket.granted:
+            return ticket
+        try:
+            ticket.future.result(timeout=self._wait_timeout(timeout))
+        except FutureTimeoutError:
+            if not self._abandon(ticket):
+                raise self._timed_out(ticket)
+        return ticket
+
+    async def aadmit(self, priority: str, tokens: int, timeout: Optional[float] = None) -> _Ticket:
+        """Async version of ``admit``."""
+        ticket = self._enter(priority, tokens)
+        if ticket.granted:
+            return ticket
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(ticket.future)),
+                timeout=self._wait_timeout(timeout)
+            )
+        except asyncio.TimeoutError:
+            if not self._abandon(ticket):
+                raise self._timed_out(ticket)
+        except asyncio.CancelledError:
+            if self._abandon(ticket):
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: _Ticket, total_tokens: Optional[int] = None) -> None:
+        """Free the slot of a finished call, correcting its token estimate."""
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            self.call_seconds += now - ticket.started
+            if self._tokens is not None and total_tokens is not None:
+                self._tokens.level -= total_tokens - ticket.tokens
+            self._dispatch(now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queued: Dict[str, int] = {name: 0 for name in LLM_PRIORITIES}
+            for ticket in self._heap:
+                if not ticket.abandoned:
+                    queued[_priority_name(ticket.priority)] += 1
+            now = time.monotonic()
+            self._bucket_wait(0, now)
+            return {
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'max_queue': self.max_queue,
+                'queued': queued,
+                'admitted': self.admitted,
+                'waited': self.waited,
+                'wait_seconds': round(self.wait_seconds, 4),
+                'shed': dict(self.shed),
+                'timed_out': self.timed_out,
+                'requests_available': round(self._requests.level, 2) if self._requests else None,
+                'tokens_available': round(self._tokens.level, 2) if self._tokens else None
+            }
+
+
+def _priority_name(rank: int) -> str:
+    for name, value in LLM_PRIORITIES.items():
+        if value == rank:
+            return name
+    return str(rank)
+
+
+llm_governor = LLMGovernor(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+    tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+    max_queue=settings.LLM_QUEUE_MAX,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT
+)
+
+
+def get_llm_governor_stats() -> Dict[str, Any]:
+    """Get LLM admission queue depths, rate limit levels and shed calls."""
+    return llm_governor.stats()
@@ -0,0 +1,326 @@
+"""
+LLM call deadlines, hedging and circuit breaking for LLM views module.
+
+Deadlines: ``with_llm_deadline`` gives every AI request a deadline,
+``LLM_REQUEST_DEADLINE`` seconds after it arrived or sooner with the
+``X-Request-Timeout`` header. Model calls made while handling the request
+wait for admission and for the provider only until then, and fail with
+``LLMDeadlineExceeded`` instead of holding the request open.
+
+Hedging: with ``LLM_HEDGE_MODEL`` / ``LLM_HEDGE_API_KEY`` configured and
+once a kind of call (admin, actor, ...) has enough latency samples, a
+call still running at the ``LLM_HEDGE_PERCENTILE`` percentile of recent
+latency gets a duplicate on the other target. Calls are never duplicated
+to the same target, which would only add spend and rate-limit pressure.
+The first successful response wins and the other is cancelled. A hedge is
+only sent if the LLM governor can admit it without queueing, so hedges
+never delay first attempts.
+
+Circuit breaking: after ``LLM_BREAKER_FAILURES`` consecutive provider
+failures (timeouts, connection errors, 429 and 5xx responses) a target is
+considered degraded and calls to it fail fast with ``LLMUnavailableError``
+for ``LLM_BREAKER_COOLDOWN`` seconds; then one call per cooldown probes it
+until one succeeds.
+"""
+
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Deque, List, NamedTuple, Optional
+
+import httpx
+from django.conf import settings
+from zai.core._errors import APIConnectionError, APIStatusError
+
+from .constants import (
+    AI_MODEL,
+    LLM_LATENCY_WINDOW,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_LATENCY_BUCKETS,
+    LLM_MAX_RETRY_AFTER
+)
+from .llm_governor import LLMOverloadedError
+
+DEADLINE_HEADER = 'X-Request-Timeout'
+
+
+class LLMUnavailableError(LLMOverloadedError):
+    """The model provider is failing; calls fail fast until it recovers."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after, "大模型服务暂不可用，请稍后重试")
+
+
+class LLMDeadlineExceeded(Exception):
+    """A model call did not finish before the request's deadline; answered with 504."""
+
+    def __init__(self):
+        super().__init__("大模型响应超时")
+
+
+# Deadlines
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('llm_deadline', default=None)
+
+
+def deadline_remaining() -> Optional[float]:
+    """Seconds left until the current request's deadline, if it has one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def call_timeout(timeout: Optional[float] = None) -> Optional[float]:
+    """
+    Shorten a call timeout to the current deadline.
+
+    Raises ``LLMDeadlineExceeded`` if the deadline has already passed.
+    """
+    remaining = deadline_remaining()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        llm_monitor.record_deadline_exceeded()
+        raise LLMDeadlineExceeded()
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def _request_deadline(request) -> float:
+    seconds = settings.LLM_REQUEST_DEADLINE
+    header = request.headers.get(DEADLINE_HEADER)
+    if header:
+        try:
+            seconds = min(seconds, float(header))
+        except ValueError:
+            pass
+    return time.monotonic() + seconds
+
+
+async def _stream_with_deadline(deadline: float, content):
+    iterator = content.__aiter__()
+    while True:
+        token = _deadline.set(deadline)
+        try:
+            chunk = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            _deadline.reset(token)
+        yield chunk
+
+
+def with_llm_deadline(view):
+    """
+    Decorate an async view so its model calls share the request's deadline.
+
+    The deadline also applies to the model calls of a streamed response,
+    which run after the view has returned.
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        deadline = _request_deadline(request)
+        token = _deadline.set(deadline)
+        try:
+            response = await view(request, *args, **kwargs)
+        finally:
+            _deadline.reset(token)
+        if response.streaming and response.is_async:
+            response.streaming_content = _stream_with_deadline(deadline, response.streaming_content)
+        return response
+
+    return wrapper
+
+
+# Circuit breaking
+
+def is_provider_failure(error: BaseException) -> bool:
+    """Whether an error means the provider, not the request, is at fault."""
+    if isinstance(error, (httpx.TransportError, APIConnectionError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    elif isinstance(error, APIStatusError):
+        status = error.status_code
+    else:
+        return False
+    return status == 429 or status >= 500
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker of one model target."""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may be sent; an open breaker lets one probe through per cooldown."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at >= self.cooldown:
+                self._opened_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_after(self) -> int:
+        with self._lock:
+            if self._opened_at is None:
+                return 1
+            left = self.cooldown - (time.monotonic() - self._opened_at)
+            return min(LLM_MAX_RETRY_AFTER, max(1, int(left + 0.999)))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self, error: BaseException) -> None:
+        if not is_provider_failure(error):
+            return
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold and self._opened_at is None:
+                self._opened_at = time.monotonic()
+                self.opened += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._opened_at is None:
+                state = 'closed'
+            elif time.monotonic() - self._opened_at >= self.cooldown:
+                state = 'half_open'
+            else:
+                state = 'open'
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'opened': self.opened,
+                'rejected': self.rejected
+            }
+
+
+class LLMTarget(NamedTuple):
+    """API key and model a call is sent to, with the breaker guarding them."""
+    name: str
+    api_key: Optional[str]
+    model: str
+    breaker: CircuitBreaker
+
+
+_breakers = {
+    'primary': CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_COOLDOWN),
+    'hedge': CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_COOLDOWN)
+}
+
+
+def llm_targets() -> List[LLMTarget]:
+    """The primary model and, if configured, the hedge model or key."""
+    targets = [LLMTarget('primary', None, AI_MODEL, _breakers['primary'])]
+    if settings.LLM_HEDGE_MODEL or settings.LLM_HEDGE_API_KEY:
+        targets.append(LLMTarget(
+            'hedge',
+            settings.LLM_HEDGE_API_KEY or None,
+            settings.LLM_HEDGE_MODEL or AI_MODEL,
+            _breakers['hedge']
+        ))
+    return targets
+
+
+def pick_target(targets: List[LLMTarget]) -> LLMTarget:
+    """
+    First target whose breaker lets a call through; raises
+    ``LLMUnavailableError`` if every target is failing.
+    """
+    for target in targets:
+        if target.breaker.allow():
+            return target
+    raise LLMUnavailableError(min(target.breaker.retry_after() for target in targets))
+
+
+# Latency tracking
+
+class LLMLatencyMonitor:
+    """Recent call latencies per call kind, with hedge and deadline counters."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._histogram = [0] * (len(LLM_LATENCY_BUCKETS) + 1)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+
+    def record(self, kind: str, seconds: float) -> None:
+        """Record the latency of a successful provider call."""
+        with self._lock:
+            self._samples.setdefault(kind, deque(maxlen=self.window)).append(seconds)
+            self._histogram[bisect.bisect_left(LLM_LATENCY_BUCKETS, seconds)] += 1
+
+    def record_call(self, hedged: bool, hedge_won: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.hedged += hedged
+            self.hedge_wins += hedge_won
+
+    def record_deadline_exceeded(self) -> None:
+        with self._lock:
+            self.deadline_exceeded += 1
+
+    def hedge_delay(self, kind: str) -> Optional[float]:
+        """Seconds after which a call of this kind is hedged, or None."""
+        if not settings.LLM_HEDGE_ENABLED:
+            return None
+        with self._lock:
+            samples = self._samples.get(kind)
+            if samples is None or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            return _percentile(sorted(samples), settings.LLM_HEDGE_PERCENTILE)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latency = {}
+            for kind, samples in self._samples.items():
+                ordered = sorted(samples)
+                latency[kind] = {
+                    'samples': len(ordered),
+                    'p50': round(_percentile(ordered, 50), 4),
+                    'p90': round(_percentile(ordered, 90), 4),
+                    'p99': round(_percentile(ordered, 99), 4)
+                }
+            bounds = [str(bound) for bound in LLM_LATENCY_BUCKETS] + ['+Inf']
+            return {
+                'calls': self.calls,
+                'hedged': self.hedged,
+                'hedge_rate': self.hedged / self.calls if self.calls else 0.0,
+                'hedge_wins': self.hedge_wins,
+                'deadline_exceeded': self.deadline_exceeded,
+                'latency': latency,
+                'histogram': dict(zip(bounds, self._histogram)),
+                'breakers': {name: breaker.stats() for name, breaker in _breakers.items()}
+            }
+
+
+def _percentile(ordered: List[float], percentile: float) -> float:
+    index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+    return ordered[index]
+
+
+llm_monitor = LLMLatencyMonitor(LLM_LATENCY_WINDOW)
+
+
+def get_llm_latency_stats() -> Dict[str, Any]:
+    """Get model call latency percentiles, hedge rate and breaker states."""
+    return llm_monitor.stats()
@@ -0,0 +1,385 @@
+"""
+Long-term memory retrieval utilities for LLM views module.
+
+Embeddings are stored in ``LongTermMemory.embedding`` as raw float32 bytes.
+The embeddings of a room are stacked once into an L2-normalized matrix and
+cached, so scoring a query against every memory of the room is a single
+matrix-vector product followed by ``argpartition`` for the top k. Saves in
+this process drop the cached room (see ``llm.signals``). At most every
+``LONG_TERM_INDEX_CHECK_SECONDS`` a cached room is also checked against the
+row count and latest ``updated_at`` of the room, so memories added or
+embedded by another process (e.g. ``backfill_embeddings``) are picked up.
+
+Rooms with at least ``LONG_TERM_ANN_MIN_ROWS`` memories get an on-disk ANN
+index (see ``ann_index``), built in the background the first time the room
+is loaded. Once it exists the room is searched through it, and only the
+best candidates are re-ranked with their exact embeddings.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max
+
+from ...db_router import room_db
+from ...models.db_models import LongTermMemory
+from .ann_index import ann_store
+from .constants import LONG_TERM_MEMORY_TOP_K, ANN_RERANK_CANDIDATES
+from .embedding_utils import aget_embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def encode_embedding(vector: Sequence[float]) -> bytes:
+    """Encode an embedding vector for ``LongTermMemory.embedding``."""
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def decode_embedding(data: bytes) -> np.ndarray:
+    """Decode ``LongTermMemory.embedding`` bytes into a float32 vector."""
+    return np.frombuffer(data, dtype=np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class RoomEmbeddings:
+    """Stacked, normalized long-term memory embeddings of one room."""
+
+    def __init__(
+        self,
+        ids: List[str],
+        contents: List[str],
+        timestamps: List[str],
+        matrix: np.ndarray,
+        version: Optional[tuple] = None
+    ):
+        self.ids = ids
+        self.contents = contents
+        self.timestamps = timestamps
+        self.matrix = matrix
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + sum(len(content) for content in self.contents)
+
+    def search(self, query: np.ndarray, k: int) -> List[Dict[str, Any]]:
+        """Return the k memories most similar to the query vector."""
+        if not self.ids or query.shape[0] != self.matrix.shape[1]:
+            return []
+
+        scores = self.matrix @ _normalize(query.astype(np.float32, copy=False))
+        if k < len(scores):
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            _to_core_memory(self.contents[index], self.timestamps[index], scores[index])
+            for index in top
+        ]
+
+
+def _to_core_memory(content: str, timestamp: str, score: float) -> Dict[str, Any]:
+    return {
+        'type': 'long_term_memory',
+        'content': content,
+        'timestamp': timestamp,
+        'score': round(float(score), 4)
+    }
+
+
+def search_ann_index(room_id: str, query: np.ndarray, k: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Search a room through its ANN index and re-rank the best candidates
+    exactly. Returns None if the room has no ANN index.
+    """
+    found = ann_store.search(room_id, query, max(k, ANN_RERANK_CANDIDATES), settings.LONG_TERM_ANN_NPROBE)
+    if found is None:
+        return None
+
+    candidate_ids, _ = found
+    rows = LongTermMemory.objects.using(room_db(room_id)).filter(id__in=candidate_ids).values_list(
+        'content', 'created_at', 'embedding'
+    )
+    rows = [row for row in rows if len(row[2] or b'') == query.shape[0] * 4]
+    if not rows:
+        return []
+
+    matrix = np.frombuffer(b''.join(bytes(row[2]) for row in rows), dtype=np.float32).reshape(len(rows), -1)
+    scores = _normalize(matrix) @ _normalize(query)
+    top = np.argsort(-scores)[:k]
+    return [_to_core_memory(rows[i][0], rows[i][1].isoformat(), scores[i]) for i in top]
+
+
+def room_embeddings_version(room_id: str) -> tuple:
+    """Row count and latest ``updated_at`` of the long-term memories of a room."""
+    version = LongTermMemory.objects.using(room_db(room_id)).filter(room_id=room_id).aggregate(
+        rows=Count('id'),
+        updated_at=Max('updated_at')
+    )
+    return version['rows'], version['updated_at']
+
+
+def load_room_embeddings(room_id: str) -> RoomEmbeddings:
+    """Read and stack the embeddings of a room from the database."""
+    # Read before the rows, so a write racing with the load triggers a reload
+    version = room_embeddings_version(room_id)
+    rows = LongTermMemory.objects.using(room_db(room_id)).filter(room_id=room_id).values_list(
+        'id', 'content', 'created_at', 'embedding'
+    ).order_by('created_at')
+
+    ids, contents, timestamps, blobs = [], [], [], []
+    dimensions = None
+    for memory_id, content, created_at, embedding in rows.iterator(chunk_size=2000):
+        embedding = bytes(embedding or b'')
+        if not embedding:
+            continue
+        # Skip rows embedded with a different dimension than the first row
+        if dimensions is None:
+            dimensions = len(embedding)
+        elif len(embedding) != dimensions:
+            continue
+        ids.append(memory_id)
+        contents.append(content)
+        timestamps.append(created_at.isoformat())
+        blobs.append(embedding)
+
+    if not blobs:
+        return RoomEmbeddings([], [], [], np.zeros((0, 0), dtype=np.float32), version)
+
+    matrix = np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(len(blobs), -1)
+    return RoomEmbeddings(ids, contents, timestamps, _normalize(matrix), version)
+
+
+class LongTermMemoryIndex:
+    """
+    LRU cache of per-room embedding matrices.
+
+    A room is dropped when its long-term memories change in this process,
+    and reloaded when ``load``, at most every ``check_seconds``, finds the
+    database version of the room moved on. Concurrent searches of a cold room share one load, and
+    rooms without embeddings are cached as empty, so they cost no
+    embedding call per turn.
+    """
+
+    def __init__(self, max_bytes: int, check_seconds: float = 0.0):
+        self.max_bytes = max_bytes
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._rooms: 'OrderedDict[str, RoomEmbeddings]' = OrderedDict()
+        self._loading: Dict[str, Future] = {}
+        # Bumped on invalidation so a load that raced with a write is not cached
+        self._versions: Dict[str, int] = {}
+        self._bytes = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.budget_exceeded = 0
+        self.errors = 0
+        self.checks = 0
+        self.stale = 0
+
+    def get(self, room_id: str) -> Optional[RoomEmbeddings]:
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is not None:
+                self._rooms.move_to_end(room_id)
+            return room
+
+    def load(self, room_id: str) -> RoomEmbeddings:
+        """
+        Return the embeddings of a room, loading them if they are not cached
+        or the cached ones are found behind the database.
+        """
+        cached = self.get(room_id)
+        if cached is not None:
+            now = time.monotonic()
+            if now - cached.checked_at < self.check_seconds:
+                return cached
+            with self._lock:
+                self.checks += 1
+            if room_embeddings_version(room_id) == cached.version:
+                cached.checked_at = now
+                return cached
+            with self._lock:
+                if self._rooms.get(room_id) is cached:
+                    del self._rooms[room_id]
+                    self._bytes -= cached.nbytes
+                    self.stale += 1
+
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is not None and room is not cached:
+                self._rooms.move_to_end(room_id)
+                return room
+            future = self._loading.get(room_id)
+            if future is None:
+                future = self._loading[room_id] = Future()
+                version = self._versions.get(room_id, 0)
+                loader = True
+            else:
+                loader = False
+
+        if not loader:
+            return future.result()
+
+        started = time.monotonic()
+        try:
+            room = load_room_embeddings(room_id)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[room_id]
+            future.set_exception(e)
+            raise
+
+        if settings.LONG_TERM_ANN_ENABLED and len(room.ids) >= settings.LONG_TERM_ANN_MIN_ROWS:
+            ann_store.schedule_build(room_id)
+
+        with self._lock:
+            del self._loading[room_id]
+            self.loads += 1
+            self.load_seconds += time.monotonic() - started
+            if self._versions.get(room_id, 0) == version:
+                self._rooms[room_id] = room
+                self._bytes += room.nbytes
+                while self._bytes > self.max_bytes and len(self._rooms) > 1:
+                    _, evicted = self._rooms.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+        future.set_result(room)
+        return room
+
+    def invalidate(self, room_id: str) -> None:
+        """Drop a room, e.g. after a long-term memory of it was saved."""
+        with self._lock:
+            self._versions[room_id] = self._versions.get(room_id, 0) + 1
+            room = self._rooms.pop(room_id, None)
+            if room is not None:
+                self._bytes -= room.nbytes
+
+    def record_search(self, seconds: float) -> None:
+        with self._lock:
+            self.searches += 1
+            self.search_seconds += seconds
+
+    def record_budget_exceeded(self) -> None:
+        with self._lock:
+            self.budget_exceeded += 1
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'rooms': len(self._rooms),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'loads': self.loads,
+                'checks': self.checks,
+                'stale': self.stale,
+                'load_seconds': round(self.load_seconds, 4),
+                'searches': self.searches,
+                'search_seconds': round(self.search_seconds, 4),
+                'budget_exceeded': self.budget_exceeded,
+                'errors': self.errors
+            }
+
+
+long_term_index = LongTermMemoryIndex(
+    max_bytes=settings.LONG_TERM_INDEX_MAX_BYTES,
+    check_seconds=settings.LONG_TERM_INDEX_CHECK_SECONDS
+)
+
+
+async def _search_long_term_memories(room_id: str, query_text: str, k: int) -> List[Dict[str, Any]]:
+    if settings.LONG_TERM_ANN_ENABLED and await asyncio.to_thread(ann_store.get, room_id) is not None:
+        # The ANN index replaces the cached matrix of the room
+        long_term_index.invalidate(room_id)
+        query = (await aget_embeddings([query_text]))[0]
+        started = time.monotonic()
+        results = await sync_to_async(search_ann_index, thread_sensitive=False)(room_id, query, k)
+        if results is not None:
+            long_term_index.record_search(time.monotonic() - started)
+            return results
+
+    # Loads and version checks run outside the shared sync thread so a
+    # large room does not hold up other requests' database work
+    cached = long_term_index.get(room_id)
+    load = asyncio.ensure_future(
+        sync_to_async(long_term_index.load, thread_sensitive=False)(room_id)
+    )
+    # Rooms known to have no embeddings cost no embedding call
+    embedding = None
+    if cached is None or cached.ids:
+        embedding = asyncio.ensure_future(aget_embeddings([query_text]))
+    try:
+        room = await load
+    except BaseException:
+        if embedding is not None:
+            embedding.cancel()
+        raise
+    if not room.ids:
+        if embedding is not None:
+            embedding.cancel()
+        return []
+    vectors = await (embedding if embedding is not None else aget_embeddings([query_text]))
+
+    query = vectors[0]
+
+    started = time.monotonic()
+    results = await asyncio.to_thread(room.search, query, k)
+    long_term_index.record_search(time.monotonic() - started)
+    return results
+
+
+async def aretrieve_long_term_memories(
+    room_id: str,
+    query_text: str,
+    k: int = LONG_TERM_MEMORY_TOP_K
+) -> List[Dict[str, Any]]:
+    """
+    Retrieve the long-term memories of a room most relevant to a query.
+
+    Gives up and returns no memories once ``LONG_TERM_MEMORY_BUDGET_MS``
+    has passed, so retrieval never holds up a turn for long. A cold load
+    interrupted this way still completes in the background and serves the
+    next turn. Retrieval is optional: failures (embedding provider errors,
+    database errors) are logged and also return no memories.
+    """
+    if not settings.LONG_TERM_MEMORY_ENABLED or not query_text:
+        return []
+
+    try:
+        return await asyncio.wait_for(
+            _search_long_term_memories(room_id, query_text, k),
+            timeout=settings.LONG_TERM_MEMORY_BUDGET_MS / 1000
+        )
+    except asyncio.TimeoutError:
+        long_term_index.record_budget_exceeded()
+        return []
+    except Exception:
+        logger.warning("Retrieving long-term memories of room %s failed", room_id, exc_info=True)
+        long_term_index.record_error()
+        return []
+
+
+def get_long_term_index_stats() -> Dict[str, Any]:
+    """Get long-term memory index usage."""
+    return long_term_index.stats()
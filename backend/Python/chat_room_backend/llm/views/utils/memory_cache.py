@@ -0,0 +1,184 @@
+"""
+Per-room core memory cache for LLM views module.
+
+Keeps the latest dialogues and short-term memories of recently active
+rooms in process memory, so building core memory for a hot room needs no
+database reads. The cache is write-through: new ConversationHistory and
+ShortTermMemory rows are appended as they are committed (see
+``llm.signals``). Rooms written by other processes are not seen, so run a
+single worker per room or disable the cache with
+``CORE_MEMORY_CACHE_ENABLED``.
+"""
+
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from django.conf import settings
+
+from .constants import (
+    MAX_DIALOGUES_THRESHOLD,
+    RECENT_MEMORIES_COUNT,
+    BUDGET_DIALOGUES_WINDOW,
+    BUDGET_MEMORIES_WINDOW
+)
+
+# Recent dialogues and memories kept per room; token-budgeted prompts choose
+# from a wider window than the fixed counts
+DIALOGUES_WINDOW = BUDGET_DIALOGUES_WINDOW if settings.PROMPT_TOKEN_BUDGET else MAX_DIALOGUES_THRESHOLD
+MEMORIES_WINDOW = BUDGET_MEMORIES_WINDOW if settings.PROMPT_TOKEN_BUDGET else RECENT_MEMORIES_COUNT
+
+# Rough per-item bookkeeping overhead in bytes, on top of the field text
+_ITEM_OVERHEAD = 200
+
+
+def _item_size(item: Dict[str, Any]) -> int:
+    """Approximate memory footprint of a core memory item."""
+    return _ITEM_OVERHEAD + sum(len(value) for value in item.values() if isinstance(value, str))
+
+
+class _RoomEntry:
+    """Cached core memory of one room."""
+
+    def __init__(self):
+        self.dialogues: deque = deque(maxlen=DIALOGUES_WINDOW)
+        self.memories: deque = deque(maxlen=MEMORIES_WINDOW)
+        self.total_dialogues = 0
+        self.loading = True
+        # (row id, item) of writes committed while the entry was being loaded
+        self.pending: List[Tuple[str, Dict[str, Any]]] = []
+        self.size = 0
+
+    def append(self, item: Dict[str, Any]) -> None:
+        if item['type'] == 'dialogue':
+            self.dialogues.append(item)
+            self.total_dialogues += 1
+        else:
+            self.memories.append(item)
+
+    def resize(self) -> int:
+        old_size = self.size
+        self.size = sum(_item_size(item) for item in self.dialogues) + sum(
+            _item_size(item) for item in self.memories
+        )
+        return self.size - old_size
+
+
+class RoomMemoryCache:
+    """
+    LRU cache of per-room ring buffers of dialogues and short-term memories.
+
+    Idle rooms are evicted first once the cache holds more than
+    ``max_rooms`` rooms or more than ``max_bytes`` of cached text.
+    """
+
+    def __init__(self, max_rooms: int, max_bytes: int):
+        self.max_rooms = max_rooms
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._rooms: 'OrderedDict[str, _RoomEntry]' = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, room_id: str) -> Optional[Tuple[List[Dict[str, Any]], int]]:
+        """Return (core memory, total dialogues) of a cached room, or None."""
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is None or entry.loading:
+                self.misses += 1
+                return None
+            self._rooms.move_to_end(room_id)
+            self.hits += 1
+            return list(entry.dialogues) + list(entry.memories), entry.total_dialogues
+
+    def begin_load(self, room_id: str) -> None:
+        """Start collecting writes for a room that is about to be loaded."""
+        with self._lock:
+            if room_id not in self._rooms:
+                self._rooms[room_id] = _RoomEntry()
+
+    def finish_load(
+        self,
+        room_id: str,
+        core_memory: List[Dict[str, Any]],
+        total_dialogues: int,
+        loaded_ids: Set[str]
+    ) -> None:
+        """Fill a room loaded from the database, merging writes seen meanwhile."""
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is None or not entry.loading:
+                return
+
+            for item in core_memory:
+                if item['type'] == 'dialogue':
+                    entry.dialogues.append(item)
+                else:
+                    entry.memories.append(item)
+            entry.total_dialogues = total_dialogues
+            for row_id, item in entry.pending:
+                if row_id not in loaded_ids:
+                    entry.append(item)
+            entry.pending = []
+            entry.loading = False
+
+            self._bytes += entry.resize()
+            self._evict()
+
+    def append(self, room_id: str, row_id: str, item: Dict[str, Any]) -> None:
+        """Write a committed dialogue or memory item through to a cached room."""
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is None:
+                return
+            if entry.loading:
+                entry.pending.append((row_id, item))
+                return
+            entry.append(item)
+            self._bytes += entry.resize()
+            self._evict()
+
+    def invalidate(self, room_id: str) -> None:
+        """Drop a room, e.g. after its rows were deleted."""
+        with self._lock:
+            entry = self._rooms.pop(room_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rooms.clear()
+            self._bytes = 0
+
+    def _evict(self) -> None:
+        while len(self._rooms) > self.max_rooms or (self._bytes > self.max_bytes and len(self._rooms) > 1):
+            _, entry = self._rooms.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'rooms': len(self._rooms),
+                'bytes': self._bytes,
+                'max_rooms': self.max_rooms,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions
+            }
+
+
+memory_cache = RoomMemoryCache(
+    max_rooms=settings.CORE_MEMORY_CACHE_MAX_ROOMS,
+    max_bytes=settings.CORE_MEMORY_CACHE_MAX_BYTES
+)
+
+
+def get_memory_cache_stats() -> Dict[str, Any]:
+    """Get core memory cache usage and hit/miss counters."""
+    return memory_cache.stats()
@@ -2,65 +2,213 @@
 Memory utilities for LLM views module.
 """
 
-from typing import List, Dict, Any
-from ...models.db_models import ConversationHistory, ShortTermMemory
-from .constants import MAX_DIALOGUES_THRESHOLD, RECENT_MEMORIES_COUNT
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple
+from django.conf import settings
+from ...db_router import room_db
+from ...models.db_models import ConversationHistory, ShortTermMemory, RoomStats
+from .memory_cache import memory_cache, DIALOGUES_WINDOW, MEMORIES_WINDOW
+from .long_term_memory_utils import aretrieve_long_term_memories
+from .trace import trace_core_memory
 
 
 def get_recent_dialogues(room_id: str) -> tuple[List[ConversationHistory], int]:
     """
     Get recent dialogues for a room.
 
-    Returns the latest 10 dialogues in chronological order.
+    Returns the latest ``DIALOGUES_WINDOW`` dialogues (10, or 50 with a
+    prompt token budget) in chronological order.
 
     Returns:
         Tuple of (dialogues list, total count)
     """
-    all_dialogues = ConversationHistory.objects.filter(room_id=room_id)
-    total_dialogues = all_dialogues.count()
+    database = room_db(room_id)
+    all_dialogues = ConversationHistory.objects.using(database).filter(room_id=room_id)
 
-    # Get latest 10 dialogues in chronological order
-    recent_dialogues = list(all_dialogues.order_by('-created_at')[:MAX_DIALOGUES_THRESHOLD])
+    # Read the maintained count; rooms without a stats row yet are counted
+    total_dialogues = RoomStats.objects.using(database).filter(room_id=room_id).values_list(
+        'dialogue_count', flat=True
+    ).first()
+    if total_dialogues is None:
+        total_dialogues = all_dialogues.count()
+
+    # Get latest dialogues in chronological order
+    recent_dialogues = list(all_dialogues.order_by('-created_at')[:DIALOGUES_WINDOW])
     recent_dialogues.reverse()
 
     return recent_dialogues, total_dialogues
 
 
-def get_recent_memories(room_id: str, limit: int = RECENT_MEMORIES_COUNT) -> List[ShortTermMemory]:
+async def aget_recent_dialogues(room_id: str) -> tuple[List[ConversationHistory], int]:
+    """Async version of ``get_recent_dialogues``."""
+    database = room_db(room_id)
+    all_dialogues = ConversationHistory.objects.using(database).filter(room_id=room_id)
+
+    total_dialogues = await RoomStats.objects.using(database).filter(room_id=room_id).values_list(
+        'dialogue_count', flat=True
+    ).afirst()
+    if total_dialogues is None:
+        total_dialogues = await all_dialogues.acount()
+
+    recent_dialogues = [
+        dialogue async for dialogue in
+        all_dialogues.order_by('-created_at')[:DIALOGUES_WINDOW]
+    ]
+    recent_dialogues.reverse()
+
+    return recent_dialogues, total_dialogues
+
+
+def get_recent_memories(room_id: str, limit: int = MEMORIES_WINDOW) -> List[ShortTermMemory]:
     """Get recent short-term memories for a room."""
     recent_memories = list(
-        ShortTermMemory.objects.filter(room_id=room_id)
+        ShortTermMemory.objects.using(room_db(room_id)).filter(room_id=room_id)
         .order_by('-created_at')[:limit]
     )
     recent_memories.reverse()
     return recent_memories
 
 
+async def aget_recent_memories(room_id: str, limit: int = MEMORIES_WINDOW) -> List[ShortTermMemory]:
+    """Async version of ``get_recent_memories``."""
+    recent_memories = [
+        memory async for memory in
+        ShortTermMemory.objects.using(room_db(room_id)).filter(room_id=room_id).order_by('-created_at')[:limit]
+    ]
+    recent_memories.reverse()
+    return recent_memories
+
+
+def dialogue_to_core_memory(dialogue: ConversationHistory) -> Dict[str, Any]:
+    """Convert a conversation history row into a core memory item."""
+    return {
+        'type': 'dialogue',
+        'character_id': dialogue.character_id,
+        'character_name': dialogue.character_name,
+        'content': dialogue.content,
+        'location': dialogue.current_location,
+        'status': dialogue.status,
+        'timestamp': dialogue.created_at.isoformat()
+    }
+
+
+def memory_to_core_memory(memory: ShortTermMemory) -> Dict[str, Any]:
+    """Convert a short-term memory row into a core memory item."""
+    return {
+        'type': 'memory',
+        'content': memory.content,
+        'timestamp': memory.created_at.isoformat()
+    }
+
+
 def build_core_memory(
     dialogues: List[ConversationHistory],
-    memories: List[ShortTermMemory]
+    memories: List[ShortTermMemory],
+    long_term_memories: Optional[List[Dict[str, Any]]] = None
 ) -> List[Dict[str, Any]]:
-    """Build core memory from dialogues and short-term memories."""
-    core_memory = []
-
-    # Add dialogues to core memory
-    for dialogue in dialogues:
-        core_memory.append({
-            'type': 'dialogue',
-            'character_id': dialogue.character_id,
-            'character_name': dialogue.character_name,
-            'content': dialogue.content,
-            'location': dialogue.current_location,
-            'status': dialogue.status,
-            'timestamp': dialogue.created_at.isoformat()
-        })
-
-    # Add short-term memories to core memory
-    for memory in memories:
-        core_memory.append({
-            'type': 'memory',
-            'content': memory.content,
-            'timestamp': memory.created_at.isoformat()
-        })
-
+    """
+    Build core memory from dialogues, short-term memories and retrieved
+    long-term memories (see ``aretrieve_long_term_memories``).
+    """
+    core_memory = [dialogue_to_core_memory(dialogue) for dialogue in dialogues]
+    core_memory.extend(memory_to_core_memory(memory) for memory in memories)
+    core_memory.extend(long_term_memories or [])
     return core_memory
+
+
+def add_pending_dialogues(
+    core_memory: List[Dict[str, Any]],
+    total_dialogues: int,
+    dialogues: List[ConversationHistory]
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Add dialogues that are not saved yet to loaded core memory, as if they
+    had been saved before it was loaded.
+
+    Returns:
+        Tuple of (core memory, total dialogue count)
+    """
+    recent_dialogues = [item for item in core_memory if item['type'] == 'dialogue']
+    recent_dialogues.extend(dialogue_to_core_memory(dialogue) for dialogue in dialogues)
+    others = [item for item in core_memory if item['type'] != 'dialogue']
+    return recent_dialogues[-DIALOGUES_WINDOW:] + others, total_dialogues + len(dialogues)
+
+
+def load_core_memory(room_id: str) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Get core memory and total dialogue count of a room.
+
+    Served from the per-room memory cache when the room is cached, otherwise
+    loaded from the database and cached.
+
+    Returns:
+        Tuple of (core memory, total dialogue count)
+    """
+    core_memory, total_dialogues = _load_core_memory(room_id)
+    trace_core_memory(room_id, core_memory, total_dialogues)
+    return core_memory, total_dialogues
+
+
+def _load_core_memory(room_id: str) -> Tuple[List[Dict[str, Any]], int]:
+    if not settings.CORE_MEMORY_CACHE_ENABLED:
+        recent_dialogues, total_dialogues = get_recent_dialogues(room_id)
+        return build_core_memory(recent_dialogues, get_recent_memories(room_id)), total_dialogues
+
+    cached = memory_cache.get(room_id)
+    if cached is not None:
+        return cached
+
+    memory_cache.begin_load(room_id)
+    recent_dialogues, total_dialogues = get_recent_dialogues(room_id)
+    recent_memories = get_recent_memories(room_id)
+    return _finish_load(room_id, recent_dialogues, recent_memories, total_dialogues)
+
+
+async def aload_core_memory(
+    room_id: str,
+    query_text: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Async version of ``load_core_memory``.
+
+    With ``query_text``, the long-term memories of the room most relevant
+    to it are retrieved alongside and appended to the core memory.
+    """
+    if query_text:
+        (core_memory, total_dialogues), long_term_memories = await asyncio.gather(
+            _aload_core_memory(room_id),
+            aretrieve_long_term_memories(room_id, query_text)
+        )
+        core_memory = core_memory + long_term_memories
+    else:
+        core_memory, total_dialogues = await _aload_core_memory(room_id)
+
+    trace_core_memory(room_id, core_memory, total_dialogues)
+    return core_memory, total_dialogues
+
+
+async def _aload_core_memory(room_id: str) -> Tuple[List[Dict[str, Any]], int]:
+    if not settings.CORE_MEMORY_CACHE_ENABLED:
+        recent_dialogues, total_dialogues = await aget_recent_dialogues(room_id)
+        return build_core_memory(recent_dialogues, await aget_recent_memories(room_id)), total_dialogues
+
+    cached = memory_cache.get(room_id)
+    if cached is not None:
+        return cached
+
+    memory_cache.begin_load(room_id)
+    recent_dialogues, total_dialogues = await aget_recent_dialogues(room_id)
+    recent_memories = await aget_recent_memories(room_id)
+    return _finish_load(room_id, recent_dialogues, recent_memories, total_dialogues)
+
+
+def _finish_load(
+    room_id: str,
+    dialogues: List[ConversationHistory],
+    memories: List[ShortTermMemory],
+    total_dialogues: int
+) -> Tuple[List[Dict[str, Any]], int]:
+    core_memory = build_core_memory(dialogues, memories)
+    loaded_ids = {dialogue.id for dialogue in dialogues} | {memory.id for memory in memories}
+    memory_cache.finish_load(room_id, core_memory, total_dialogues, loaded_ids)
+    return core_memory, total_dialogues
@@ -0,0 +1,252 @@
+"""
+Request metrics for LLM views module.
+
+``timed_view`` wraps a view: it counts requests in flight and responses by
+status, and times the whole request. Inside the view, stages (history
+insert, core memory, prompt, model call, save, ...) are reported with
+``record_stage``; they are added to the response's ``Server-Timing``
+header and to per-stage latency histograms. Model calls report their
+latency, errors and the prompt and completion tokens of the provider's
+``usage`` with ``record_model_call`` and ``record_model_error``.
+
+``render_metrics`` renders all of it, with gauges read at scrape time, in
+the Prometheus text format. Recording
+takes one lock and a few additions, so metrics can stay on in production.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from .constants import LLM_LATENCY_BUCKETS, REQUEST_LATENCY_BUCKETS
+from .trace import trace_stage
+
+# name -> (type, help, histogram buckets)
+_METRICS = {
+    'llm_http_requests_total': ('counter', "AI requests by view and response status", None),
+    'llm_http_request_errors_total': ('counter', "AI requests answered with an error status", None),
+    'llm_http_requests_in_flight': ('gauge', "AI requests being handled", None),
+    'llm_http_request_duration_seconds': ('histogram', "AI request latency", REQUEST_LATENCY_BUCKETS),
+    'llm_stage_duration_seconds': ('histogram', "Latency of the stages of AI requests", REQUEST_LATENCY_BUCKETS),
+    'llm_model_call_duration_seconds': ('histogram', "Latency of successful model calls", LLM_LATENCY_BUCKETS),
+    'llm_model_call_errors_total': ('counter', "Failed model calls", None),
+    'llm_prompt_tokens_total': ('counter', "Prompt tokens reported by the provider", None),
+    'llm_completion_tokens_total': ('counter', "Completion tokens reported by the provider", None),
+    'llm_cached_prompt_tokens_total': ('counter', "Prompt tokens served from the provider's cache", None)
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms by metric name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, Dict[Labels, Any]] = {name: {} for name in _METRICS}
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        buckets = _METRICS[name][2]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._values[name].get(key)
+            if histogram is None:
+                histogram = self._values[name][key] = _Histogram(buckets)
+            histogram.counts[bisect.bisect_left(buckets, value)] += 1
+            histogram.sum += value
+            histogram.count += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in _METRICS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in self._values[name].items():
+                    if kind != 'histogram':
+                        lines.append(f"{name}{_labels(key)} {_number(value)}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + ['+Inf'], value.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(key + (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(key)} {_number(value.sum)}")
+                    lines.append(f"{name}_count{_labels(key)} {value.count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key: Iterable[Tuple[str, Any]]) -> str:
+    pairs = ','.join(f'{name}="{_escape(str(value))}"' for name, value in key)
+    return '{' + pairs + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+metrics = MetricsRegistry()
+
+
+# Stages of the current request
+
+class _RequestTimer:
+    def __init__(self, view: str):
+        self.view = view
+        self.started = time.monotonic()
+        self.stages: Dict[str, float] = {}
+
+
+_timer: contextvars.ContextVar[Optional[_RequestTimer]] = contextvars.ContextVar('request_timer', default=None)
+
+
+def record_stage(stage: str, seconds: float) -> float:
+    """
+    Record a stage of the current request; repeated stages add up.
+
+    Returns the seconds rounded for reporting in the response body.
+    """
+    trace_stage(stage, seconds)
+    timer = _timer.get()
+    if timer is not None:
+        timer.stages[stage] = timer.stages.get(stage, 0.0) + seconds
+        metrics.observe('llm_stage_duration_seconds', seconds, view=timer.view, stage=stage)
+    return round(seconds, 4)
+
+
+def _server_timing(timer: _RequestTimer) -> str:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timer.stages.items()]
+    entries.append(f"total;dur={(time.monotonic() - timer.started) * 1000:.1f}")
+    return ', '.join(entries)
+
+
+def _begin(view: str) -> Tuple[_RequestTimer, contextvars.Token]:
+    metrics.inc('llm_http_requests_in_flight', view=view)
+    timer = _RequestTimer(view)
+    return timer, _timer.set(timer)
+
+
+def _finish(timer: _RequestTimer, status: int) -> None:
+    metrics.inc('llm_http_requests_in_flight', -1, view=timer.view)
+    metrics.inc('llm_http_requests_total', view=timer.view, status=str(status))
+    if status >= 400:
+        metrics.inc('llm_http_request_errors_total', view=timer.view, status=str(status))
+    metrics.observe('llm_http_request_duration_seconds', time.monotonic() - timer.started, view=timer.view)
+
+
+def _respond(timer: _RequestTimer, response):
+    response['Server-Timing'] = _server_timing(timer)
+    if response.streaming and response.is_async:
+        # The request is in flight, and its stages are recorded, until the stream ends
+        response.streaming_content = _timed_stream(timer, response.status_code, response.streaming_content)
+    else:
+        _finish(timer, response.status_code)
+    return response
+
+
+async def _timed_stream(timer: _RequestTimer, status: int, content):
+    iterator = content.__aiter__()
+    try:
+        while True:
+            token = _timer.set(timer)
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                _timer.reset(token)
+            yield chunk
+    finally:
+        _finish(timer, status)
+
+
+def timed_view(name: str):
+    """Decorate a view so its requests and stages are measured as ``name``."""
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if not settings.METRICS_ENABLED:
+                    return await view(request, *args, **kwargs)
+                timer, token = _begin(name)
+                try:
+                    response = await view(request, *args, **kwargs)
+                except BaseException:
+                    _finish(timer, 500)
+                    raise
+                finally:
+                    _timer.reset(token)
+                return _respond(timer, response)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if not settings.METRICS_ENABLED:
+                    return view(request, *args, **kwargs)
+                timer, token = _begin(name)
+                try:
+                    response = view(request, *args, **kwargs)
+                except BaseException:
+                    _finish(timer, 500)
+                    raise
+                finally:
+                    _timer.reset(token)
+                return _respond(timer, response)
+        return wrapper
+
+    return decorator
+
+
+# Model calls
+
+def record_model_call(kind: str, seconds: float, usage: Optional[Dict[str, Any]]) -> None:
+    """Record the latency and token usage of a successful model call."""
+    if not settings.METRICS_ENABLED:
+        return
+    metrics.observe('llm_model_call_duration_seconds', seconds, kind=kind)
+    if usage:
+        details = usage.get('prompt_tokens_details') or {}
+        metrics.inc('llm_prompt_tokens_total', usage.get('prompt_tokens') or 0, kind=kind)
+        metrics.inc('llm_completion_tokens_total', usage.get('completion_tokens') or 0, kind=kind)
+        metrics.inc('llm_cached_prompt_tokens_total', details.get('cached_tokens') or 0, kind=kind)
+
+
+def record_model_error(kind: str, error: BaseException) -> None:
+    if settings.METRICS_ENABLED:
+        metrics.inc('llm_model_call_errors_total', kind=kind, error=type(error).__name__)
+
+
+def render_metrics(gauges: Iterable[Tuple[str, str, Any]] = ()) -> str:
+    """
+    All metrics as Prometheus text, followed by ``gauges``: (name, help,
+    value) with value a number or a dict of label tuples to numbers.
+    """
+    lines = metrics.render()
+    for name, help_text, value in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        series = value if isinstance(value, dict) else {(): value}
+        lines += [f"{name}{_labels(key)} {_number(number)}" for key, number in series.items()]
+    return '\n'.join(lines) + '\n'
@@ -1,41 +1,317 @@
 """
 Prompt utilities for LLM views module.
+
+Prompts are split into a stable per-room prefix and a variable suffix. The
+system message holds ``ROOM_SYSTEM_PROMPT``, the worldview and the
+character settings. It is identical for every admin and actor call of a
+room, so the provider can reuse its prompt cache across calls. It is
+rendered once per content hash. The user message holds the core memory,
+with the most stable parts first (short-term memories, then dialogues,
+then retrieved long-term memories), and ends with the role instruction of
+the call.
+
+With ``PROMPT_TOKEN_BUDGET`` set, prompts are filled by priority up to the
+budget instead of including everything: worldview and character settings
+first, then dialogues from the most recent back, then short-term and
+long-term memories. Entries larger than ``PROMPT_MAX_ENTRY_SHARE`` of the
+budget are truncated. Token counts are a fast local estimate, not the
+model's tokenizer.
 """
 
-from typing import List, Dict, Any, Optional
+import hashlib
+import json
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+from django.conf import settings
+
+from .constants import (
+    PROMPT_MAX_ENTRY_SHARE,
+    PROMPT_PREFIX_CACHE_SIZE,
+    ROOM_SYSTEM_PROMPT,
+    ADMIN_INSTRUCTION,
+    ACTOR_INSTRUCTION_TEMPLATE
+)
+
+# CJK characters and full-width punctuation are about one token each
+_WIDE_CHARS = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+_TRUNCATION_MARK = "…"
+
+# Core memory item type -> usage section, in prompt order
+_MEMORY_SECTIONS = {
+    'memory': 'memories',
+    'dialogue': 'dialogues',
+    'long_term_memory': 'long_term_memories'
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of text: one per CJK character, one per 4 other characters."""
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + math.ceil((len(text) - wide) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to about ``max_tokens`` estimated tokens, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    # Binary search the longest prefix that fits with the mark
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) + 1 <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + _TRUNCATION_MARK
+
+
+def format_core_memory_item(item: Dict[str, Any]) -> str:
+    """Render one core memory item as a prompt line."""
+    if item['type'] == 'dialogue':
+        return (
+            f"[{item['timestamp']}] {item['character_name']}({item['character_id']}) "
+            f"[{item['location']}] [{item['status']}]: {item['content']}"
+        )
+    if item['type'] == 'long_term_memory':
+        return f"[{item['timestamp']}] [长期记忆]: {item['content']}"
+    return f"[{item['timestamp']}] [记忆]: {item['content']}"
+
+
+class _BudgetedPrompt:
+    """Prompt lines with per-section estimated token usage."""
+
+    def __init__(self, budget: int, usage: Optional[Dict[str, Any]] = None):
+        self.budget = budget
+        usage = usage or {}
+        self.used = usage.get('used', 0)
+        self.sections: Dict[str, int] = dict(usage.get('sections', {}))
+        self.included: Dict[str, int] = dict(usage.get('included', {}))
+        self.dropped: Dict[str, int] = dict(usage.get('dropped', {}))
+        self.truncated = usage.get('truncated', 0)
+        self.entry_limit = max(1, int(budget * PROMPT_MAX_ENTRY_SHARE)) if budget else 0
+
+    def add(self, section: str, line: str, entry: bool = True) -> Optional[str]:
+        """Account for a line; returns it, possibly truncated, or None if it does not fit."""
+        if self.budget and entry and estimate_tokens(line) > self.entry_limit:
+            line = truncate_to_tokens(line, self.entry_limit)
+            self.truncated += 1
+        # +1 for the newline joining the lines
+        tokens = estimate_tokens(line) + 1
+        if self.budget and entry and self.used + tokens > self.budget:
+            self.dropped[section] = self.dropped.get(section, 0) + 1
+            return None
+        self.used += tokens
+        self.sections[section] = self.sections.get(section, 0) + tokens
+        if entry:
+            self.included[section] = self.included.get(section, 0) + 1
+        return line
+
+    def usage(self) -> Dict[str, Any]:
+        return {
+            'budget': self.budget or None,
+            'used': self.used,
+            'sections': self.sections,
+            'included': self.included,
+            'dropped': self.dropped,
+            'truncated': self.truncated
+        }
+
+
+class PromptPrefixCache:
+    """
+    LRU of rendered room prefixes by content hash, with reuse counters.
+
+    ``hits`` counts calls whose prefix this process has already sent, i.e.
+    calls the provider's prefix cache can serve. Provider-side reuse is
+    tracked from the ``cached_tokens`` the provider reports.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._prefixes: 'OrderedDict[str, Tuple[str, Dict[str, Any]]]' = OrderedDict()
+        self.hits = 0
+        self.renders = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def get(self, content_hash: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            prefix = self._prefixes.get(content_hash)
+            if prefix is not None:
+                self._prefixes.move_to_end(content_hash)
+                self.hits += 1
+            return prefix
+
+    def put(self, content_hash: str, text: str, usage: Dict[str, Any]) -> None:
+        with self._lock:
+            self.renders += 1
+            self._prefixes[content_hash] = (text, usage)
+            while len(self._prefixes) > self.max_items:
+                self._prefixes.popitem(last=False)
+
+    def record_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        """Count prompt tokens and provider cache hits of a completion's usage."""
+        if not usage:
+            return
+        details = usage.get('prompt_tokens_details') or {}
+        with self._lock:
+            self.prompt_tokens += usage.get('prompt_tokens') or 0
+            self.cached_tokens += details.get('cached_tokens') or 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.renders
+            return {
+                'prefixes': len(self._prefixes),
+                'max_prefixes': self.max_items,
+                'hits': self.hits,
+                'renders': self.renders,
+                'reuse_rate': self.hits / lookups if lookups else 0.0,
+                'prompt_tokens': self.prompt_tokens,
+                'cached_tokens': self.cached_tokens,
+                'provider_cache_rate': self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+            }
+
 
+prefix_cache = PromptPrefixCache(PROMPT_PREFIX_CACHE_SIZE)
 
-def build_prompt(
+
+def render_room_prefix(
     worldview: str,
     character_settings: List[str],
-    core_memory: List[Dict[str, Any]],
-    character_name: Optional[str] = None
-) -> str:
-    """Build the prompt for AI model."""
-    prompt_parts = [
-        f"世界观: {worldview}",
-        "人物设定:"
-    ]
+    max_tokens: Optional[int] = None
+) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Render the stable system message of a room.
+
+    Returns:
+        Tuple of (system message, content hash, token usage of the prefix)
+    """
+    budget = settings.PROMPT_TOKEN_BUDGET if max_tokens is None else max_tokens
+    content_hash = hashlib.sha256(
+        json.dumps([ROOM_SYSTEM_PROMPT, budget, worldview, character_settings], ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+    cached = prefix_cache.get(content_hash)
+    if cached is not None:
+        return cached[0], content_hash, cached[1]
+
+    prompt = _BudgetedPrompt(budget)
+    prompt_parts = [ROOM_SYSTEM_PROMPT]
+    prompt.add('instructions', ROOM_SYSTEM_PROMPT, entry=False)
+
+    line = prompt.add('worldview', f"\n世界观: {worldview}")
+    if line is not None:
+        prompt_parts.append(line)
+    prompt_parts.append("人物设定:")
+    prompt.add('instructions', "人物设定:", entry=False)
 
     # Add character settings
     for setting in character_settings:
-        prompt_parts.append(f"- {setting}")
+        line = prompt.add('character_settings', f"- {setting}")
+        if line is not None:
+            prompt_parts.append(line)
 
-    prompt_parts.append("\n核心记忆:")
+    text = "\n".join(prompt_parts)
+    prefix_cache.put(content_hash, text, prompt.usage())
+    return text, content_hash, prompt.usage()
 
-    # Add core memory
-    for item in core_memory:
-        if item['type'] == 'dialogue':
-            prompt_parts.append(
-                f"[{item['timestamp']}] {item['character_name']}({item['character_id']}) "
-                f"[{item['location']}] [{item['status']}]: {item['content']}"
-            )
-        else:
-            prompt_parts.append(f"[{item['timestamp']}] [记忆]: {item['content']}")
 
-    if character_name:
-        prompt_parts.append(f"\n请根据以上信息，以【{character_name}】的身份生成适当的回复。")
-    else:
-        prompt_parts.append("\n请根据以上信息，以AI管理员的身份生成适当的回复。")
+def build_room_prompts(
+    worldview: str,
+    character_settings: List[str],
+    core_memory: List[Dict[str, Any]],
+    character_names: List[Optional[str]],
+    max_tokens: Optional[int] = None
+) -> Tuple[str, List[str], Dict[str, Any]]:
+    """
+    Build the messages of several calls that share one core memory.
+
+    The core memory is rendered once; the prompts only differ in their
+    role instruction. The budget is applied with the longest instruction,
+    so every prompt fits it.
+
+    Args:
+        character_names: The character each call plays; None for the AI
+            admin
+        max_tokens: Token budget; defaults to ``PROMPT_TOKEN_BUDGET``, and 0
+            includes everything
+
+    Returns:
+        Tuple of (system prompt, prompt per call, usage with the budget,
+        tokens used in total and per section, entries included, dropped
+        and truncated, and the prefix hash)
+    """
+    budget = settings.PROMPT_TOKEN_BUDGET if max_tokens is None else max_tokens
+    system_prompt, prefix_hash, prefix_usage = render_room_prefix(worldview, character_settings, budget)
+    prompt = _BudgetedPrompt(budget, prefix_usage)
+
+    instructions = [
+        ACTOR_INSTRUCTION_TEMPLATE.format(character_name=character_name) if character_name else ADMIN_INSTRUCTION
+        for character_name in character_names
+    ]
+    prompt.add('instructions', "核心记忆:", entry=False)
+    prompt.add('instructions', f"\n{max(instructions, key=estimate_tokens)}", entry=False)
+
+    # Pick dialogues from the most recent back, then memories in their order
+    kept: Dict[int, str] = {}
+    dialogues = [i for i, item in enumerate(core_memory) if item['type'] == 'dialogue']
+    memories = [i for i, item in enumerate(core_memory) if item['type'] != 'dialogue']
+    for index in list(reversed(dialogues)) + memories:
+        item = core_memory[index]
+        section = _MEMORY_SECTIONS.get(item['type'], 'memories')
+        if section == 'dialogues' and prompt.dropped.get('dialogues'):
+            # Keep the dialogue window contiguous
+            prompt.dropped['dialogues'] += 1
+            continue
+        line = prompt.add(section, format_core_memory_item(item))
+        if line is not None:
+            kept[index] = line
+
+    # Most stable sections first, each in its original order
+    section_order = list(_MEMORY_SECTIONS.values())
+    order = sorted(
+        kept,
+        key=lambda index: (section_order.index(_MEMORY_SECTIONS.get(core_memory[index]['type'], 'memories')), index)
+    )
+    memory_text = "\n".join(["核心记忆:"] + [kept[index] for index in order])
+
+    usage = prompt.usage()
+    usage['prefix_hash'] = prefix_hash
+    return system_prompt, [f"{memory_text}\n\n{instruction}" for instruction in instructions], usage
+
+
+def build_room_prompt(
+    worldview: str,
+    character_settings: List[str],
+    core_memory: List[Dict[str, Any]],
+    character_name: Optional[str] = None,
+    max_tokens: Optional[int] = None
+) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Build the messages for AI model and report their estimated token usage.
+
+    Args:
+        character_name: The character an actor call plays; None for the
+            AI admin
+        max_tokens: Token budget; defaults to ``PROMPT_TOKEN_BUDGET``, and 0
+            includes everything
+
+    Returns:
+        Tuple of (system prompt, prompt, usage as in ``build_room_prompts``)
+    """
+    system_prompt, prompts, usage = build_room_prompts(
+        worldview, character_settings, core_memory, [character_name], max_tokens
+    )
+    return system_prompt, prompts[0], usage
+
 
-    return "\n".join(prompt_parts)
+def get_prompt_prefix_stats() -> Dict[str, Any]:
+    """Get prompt prefix reuse in this process and provider prompt cache hits."""
+    return prefix_cache.stats()
@@ -1,10 +1,30 @@
 """
 Request and response utilities for LLM views module.
+
+With ``FAST_JSON_ENABLED``, request bodies are parsed with orjson when it
+is installed, or otherwise validated straight from bytes by pydantic, and
+responses are encoded with orjson.
 """
 
 import json
-from typing import Dict, Any
-from django.http import JsonResponse
+from typing import Dict, Any, Type, TypeVar
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from pydantic import BaseModel, ValidationError
+
+from .constants import DEBUG_RESPONSE_FIELDS
+
+try:
+    import orjson
+except ImportError:  # Optional: responses fall back to the stdlib encoder
+    orjson = None
+
+PROFILE_HEADER = 'X-Response-Profile'
+RESPONSE_PROFILES = ('minimal', 'debug')
+
+RequestModel = TypeVar('RequestModel', bound=BaseModel)
 
 
 def parse_json_request(request_body: bytes) -> Dict[str, Any]:
@@ -15,11 +35,104 @@ def parse_json_request(request_body: bytes) -> Dict[str, Any]:
         raise ValueError("无效的JSON格式")
 
 
+def parse_request(model: Type[RequestModel], request_body: bytes) -> RequestModel:
+    """Parse a JSON request body into its schema."""
+    if not settings.FAST_JSON_ENABLED:
+        request_data = parse_json_request(request_body)
+        if not isinstance(request_data, dict):
+            raise ValueError("请求体必须是JSON对象")
+        return model(**request_data)
+
+    if orjson is not None:
+        # Measured faster than pydantic's own JSON parser for these bodies
+        try:
+            request_data = orjson.loads(request_body)
+        except orjson.JSONDecodeError:
+            raise ValueError("无效的JSON格式")
+        if not isinstance(request_data, dict):
+            raise ValueError("请求体必须是JSON对象")
+        return model.model_validate(request_data)
+
+    try:
+        return model.model_validate_json(request_body)
+    except ValidationError as e:
+        if any(error['type'] == 'json_invalid' for error in e.errors()):
+            raise ValueError("无效的JSON格式")
+        if any(error['type'] == 'model_type' for error in e.errors()):
+            raise ValueError("请求体必须是JSON对象")
+        raise
+
+
+def dump_json(data: Any) -> bytes:
+    """Encode a payload as UTF-8 JSON."""
+    if settings.FAST_JSON_ENABLED and orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+def response_profile(request) -> str:
+    """Response profile asked for by a request, else the configured one."""
+    profile = request.headers.get(PROFILE_HEADER, '').strip().lower()
+    return profile if profile in RESPONSE_PROFILES else settings.AI_RESPONSE_PROFILE
+
+
+def _strip_debug_fields(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            key: _strip_debug_fields(item)
+            for key, item in value.items()
+            if key not in DEBUG_RESPONSE_FIELDS
+        }
+    if isinstance(value, list):
+        return [_strip_debug_fields(item) for item in value]
+    return value
+
+
+def profile_payload(request, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Drop the debug fields of a payload unless the debug profile applies.
+
+    Returns a copy, so shared payloads (coalesced admin calls) stay whole.
+    """
+    if response_profile(request) == 'debug':
+        return data
+    return _strip_debug_fields(data)
+
+
+def ai_json_response(request, data: Dict[str, Any], status: int = 200) -> HttpResponse:
+    """Create the JSON response of an AI endpoint in the request's profile."""
+    return HttpResponse(
+        dump_json(profile_payload(request, data)),
+        status=status,
+        content_type='application/json'
+    )
+
+
 def json_error_response(error_message: str, status: int = 400) -> JsonResponse:
     """Create a JSON error response."""
     return JsonResponse({"error": error_message}, status=status)
 
 
+def too_many_requests_response(error_message: str, retry_after: int) -> JsonResponse:
+    """Create a 429 response asking the client to retry later."""
+    response = JsonResponse({"error": error_message, "retry_after": retry_after}, status=429)
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+def gateway_timeout_response(error_message: str) -> JsonResponse:
+    """Create a 504 response for a request whose model calls ran past its deadline."""
+    return JsonResponse({"error": error_message}, status=504)
+
+
 def method_not_allowed_response() -> JsonResponse:
     """Create a method not allowed response."""
     return JsonResponse({"error": "只支持POST请求"}, status=405)
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> bytes:
+    """Encode one Server-Sent Events message with a JSON payload."""
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + dump_json(data) + b"\n\n"
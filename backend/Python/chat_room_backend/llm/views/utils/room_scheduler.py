@@ -0,0 +1,210 @@
+"""
+Per-room turn scheduling for LLM views module.
+
+Turns of one room run one at a time in arrival order, so each turn saves
+its dialogue, reads core memory and (for actors) saves the reply before
+the next turn of the room starts. Different rooms run in parallel.
+Identical admin analyses of a room that arrive while one is running share
+its result through ``SingleFlight``.
+
+Scheduling is per process; waiters are ``concurrent.futures`` futures so
+requests on different event loops (one per request under WSGI) queue
+together.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Tuple
+
+from .constants import ROOM_SCHEDULER_STATS_ROOMS, ROOM_SCHEDULER_STATS_TOP
+from .metrics import record_stage
+
+
+class _RoomQueue:
+    def __init__(self):
+        self.waiters: Deque[Future] = deque()
+
+
+class RoomScheduler:
+    """FIFO turn lock per room, with queue depth and wait time per room."""
+
+    def __init__(self, max_tracked_rooms: int):
+        self.max_tracked_rooms = max_tracked_rooms
+        self._lock = threading.Lock()
+        # Rooms with a running turn; removed once the room is idle
+        self._queues: Dict[str, _RoomQueue] = {}
+        self._rooms: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.turns = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+
+    def _room_stats(self, room_id: str) -> Dict[str, Any]:
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = {
+                'turns': 0,
+                'waited': 0,
+                'wait_seconds': 0.0,
+                'max_wait_seconds': 0.0,
+                'max_queue_depth': 0,
+                'coalesced': 0
+            }
+            while len(self._rooms) > self.max_tracked_rooms:
+                self._rooms.popitem(last=False)
+        self._rooms.move_to_end(room_id)
+        return room
+
+    def _record_turn(self, room_id: str, waited: float) -> None:
+        with self._lock:
+            room = self._room_stats(room_id)
+            room['turns'] += 1
+            self.turns += 1
+            if waited:
+                room['waited'] += 1
+                room['wait_seconds'] += waited
+                room['max_wait_seconds'] = max(room['max_wait_seconds'], waited)
+                self.waited += 1
+                self.wait_seconds += waited
+
+    def record_coalesced(self, room_id: str) -> None:
+        with self._lock:
+            self._room_stats(room_id)['coalesced'] += 1
+
+    async def acquire(self, room_id: str) -> None:
+        """Wait for the turn of a room."""
+        started = time.monotonic()
+        with self._lock:
+            queue = self._queues.get(room_id)
+            if queue is None:
+                self._queues[room_id] = _RoomQueue()
+                future = None
+            else:
+                future = Future()
+                queue.waiters.append(future)
+                room = self._room_stats(room_id)
+                room['max_queue_depth'] = max(room['max_queue_depth'], len(queue.waiters))
+
+        if future is not None:
+            try:
+                # Shielded so a cancelled waiter does not cancel the hand-off
+                await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                with self._lock:
+                    handed_off = future.done()
+                    if not handed_off:
+                        queue.waiters.remove(future)
+                if handed_off:
+                    self.release(room_id)
+                raise
+
+        waited = time.monotonic() - started if future is not None else 0.0
+        self._record_turn(room_id, waited)
+        record_stage("queue", waited)
+
+    def release(self, room_id: str) -> None:
+        """End the turn of a room, handing it to the next waiter."""
+        with self._lock:
+            queue = self._queues[room_id]
+            if queue.waiters:
+                queue.waiters.popleft().set_result(None)
+            else:
+                del self._queues[room_id]
+
+    @asynccontextmanager
+    async def turn(self, room_id: str):
+        """Run the body as the next turn of a room."""
+        await self.acquire(room_id)
+        try:
+            yield
+        finally:
+            self.release(room_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            depths = {room_id: len(queue.waiters) for room_id, queue in self._queues.items()}
+            busiest = sorted(
+                self._rooms.items(),
+                key=lambda item: (depths.get(item[0], 0), item[1]['wait_seconds']),
+                reverse=True
+            )[:ROOM_SCHEDULER_STATS_TOP]
+            return {
+                'active_rooms': len(depths),
+                'queued': sum(depths.values()),
+                'turns': self.turns,
+                'waited': self.waited,
+                'wait_seconds': round(self.wait_seconds, 4),
+                'rooms': {
+                    room_id: dict(
+                        room,
+                        queue_depth=depths.get(room_id, 0),
+                        wait_seconds=round(room['wait_seconds'], 4),
+                        max_wait_seconds=round(room['max_wait_seconds'], 4)
+                    )
+                    for room_id, room in busiest
+                }
+            }
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run ``func`` unless a call of the key is already running.
+
+        Returns:
+            Tuple of (result, whether it was shared from another call)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return await asyncio.shield(asyncio.wrap_future(future)), True
+
+        try:
+            result = await func()
+        except BaseException as e:
+            with self._lock:
+                del self._calls[key]
+            # Followers get an error, not the leader's cancellation
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("合并的请求已取消"))
+            raise
+        with self._lock:
+            del self._calls[key]
+        future.set_result(result)
+        return result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'calls': self.calls,
+                'coalesced': self.coalesced
+            }
+
+
+room_scheduler = RoomScheduler(ROOM_SCHEDULER_STATS_ROOMS)
+admin_flight = SingleFlight()
+
+
+def get_room_scheduler_stats() -> Dict[str, Any]:
+    """Get turn counts, queue depths and wait times per room."""
+    stats = room_scheduler.stats()
+    stats['admin_single_flight'] = admin_flight.stats()
+    return stats
@@ -0,0 +1,137 @@
+"""
+Speculative actor generation for LLM views module.
+
+In a turn, the actor can only start once the admin has picked the next
+speaker. With ``SPECULATIVE_ACTOR_ENABLED``, the turn guesses the next
+speaker from the room's recent speaker order and starts that character's
+actor call alongside the admin call. If the admin picks it, the reply is
+already (partly) generated; otherwise the speculative call is cancelled.
+
+Speculative calls run at the lowest LLM priority and are limited to
+``SPECULATIVE_CALLS_PER_MINUTE``, so misses cost a bounded number of calls.
+"""
+
+import threading
+import time
+from typing import Dict, Any, List, Sequence
+
+from django.conf import settings
+
+from ...db_router import room_db
+from ...models.db_models import ConversationHistory
+from .constants import SPECULATIVE_HISTORY_WINDOW
+
+
+async def aget_recent_speakers(room_id: str, limit: int = SPECULATIVE_HISTORY_WINDOW) -> List[str]:
+    """Get the character IDs of the latest dialogues of a room, newest first."""
+    return [
+        character_id async for character_id in
+        ConversationHistory.objects.using(room_db(room_id)).filter(room_id=room_id)
+        .order_by('-created_at')
+        .values_list('character_id', flat=True)[:limit]
+    ]
+
+
+def predict_next_speakers(
+    recent_speakers: Sequence[str],
+    candidates: Sequence[str],
+    limit: int
+) -> List[str]:
+    """
+    Rank candidate characters as the next speaker.
+
+    A candidate ranks higher the more often it spoke right after the
+    latest speaker, then the longer it has not spoken.
+
+    Args:
+        recent_speakers: Character IDs of recent dialogues, newest first
+        candidates: Character IDs that may speak next
+        limit: Number of candidates to return
+    """
+    if not recent_speakers:
+        return list(candidates[:limit])
+
+    last_speaker = recent_speakers[0]
+    follows: Dict[str, int] = {}
+    last_spoke: Dict[str, int] = {}
+    for index, speaker in enumerate(recent_speakers):
+        last_spoke.setdefault(speaker, index)
+        if index + 1 < len(recent_speakers) and recent_speakers[index + 1] == last_speaker:
+            follows[speaker] = follows.get(speaker, 0) + 1
+
+    ranked = sorted(
+        candidates,
+        key=lambda candidate: (
+            -follows.get(candidate, 0),
+            -last_spoke.get(candidate, len(recent_speakers))
+        )
+    )
+    return ranked[:limit]
+
+
+class SpeculationBudget:
+    """Per-minute allowance of speculative calls, with hit and saving counters."""
+
+    def __init__(self, calls_per_minute: int):
+        self.calls_per_minute = calls_per_minute
+        self._lock = threading.Lock()
+        self._level = float(calls_per_minute)
+        self._updated = time.monotonic()
+        self.turns = 0
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+        self.failed = 0
+        self.seconds_saved = 0.0
+
+    def acquire(self, wanted: int) -> int:
+        """Take up to ``wanted`` calls from the budget; returns how many."""
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(
+                float(self.calls_per_minute),
+                self._level + (now - self._updated) * self.calls_per_minute / 60.0
+            )
+            self._updated = now
+            granted = min(wanted, int(self._level))
+            self._level -= granted
+            self.turns += 1
+            self.started += granted
+            self.skipped += wanted - granted
+            return granted
+
+    def record(self, hit: bool, seconds_saved: float = 0.0, failed: bool = False) -> None:
+        with self._lock:
+            if failed:
+                self.failed += 1
+            elif hit:
+                self.hits += 1
+                self.seconds_saved += seconds_saved
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            decided = self.hits + self.misses
+            return {
+                'enabled': settings.SPECULATIVE_ACTOR_ENABLED,
+                'calls_per_minute': self.calls_per_minute,
+                'turns': self.turns,
+                'started': self.started,
+                'skipped_over_budget': self.skipped,
+                'hits': self.hits,
+                'misses': self.misses,
+                'failed': self.failed,
+                'hit_rate': self.hits / decided if decided else 0.0,
+                'seconds_saved': round(self.seconds_saved, 4),
+                'wasted_calls': self.started - self.hits
+            }
+
+
+speculation_budget = SpeculationBudget(settings.SPECULATIVE_CALLS_PER_MINUTE)
+
+
+def get_speculation_stats() -> Dict[str, Any]:
+    """Get speculative actor call hits, misses and latency saved."""
+    return speculation_budget.stats()
@@ -0,0 +1,348 @@
+"""
+Request traces for LLM views module.
+
+With ``TRACE_ENABLED``, ``traced_view`` records requests of a view
+(a ``TRACE_SAMPLE_RATE`` share of them): the parsed request body, the
+core memory snapshots loaded for it, each model call with its messages,
+raw provider response and latency, the stage timings and the response
+status. Records are JSON lines appended to gzip files in ``TRACE_DIR`` by
+a background thread, so the request does not wait for compression or
+disk. A file is rotated once it reaches ``TRACE_ROTATE_MB`` and only the
+newest ``TRACE_KEEP_FILES`` are kept.
+
+``read_traces`` reads the records back, including those of a file whose
+process was killed. ``replay_traces`` sends them to the views again
+against the recorded provider responses.
+"""
+
+import asyncio
+import atexit
+import contextvars
+import functools
+import glob
+import gzip
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from django.conf import settings
+
+from .constants import TRACE_QUEUE_MAX_RECORDS
+from .request_utils import dump_json
+
+logger = logging.getLogger(__name__)
+
+# Request headers kept in a trace, so a replay is handled the same way
+TRACE_HEADERS = ('X-Response-Profile', 'Idempotency-Key')
+TRACE_FILE_PATTERN = 'trace-*.ndjson.gz'
+
+
+class TraceWriter:
+    """Background thread appending trace records to rotated gzip files."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._lines: List[bytes] = []
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._raw = None
+        self._file: Optional[gzip.GzipFile] = None
+        self.path: Optional[str] = None
+        self.records = 0
+        self.dropped = 0
+        self.files = 0
+        self.write_errors = 0
+
+    def write(self, line: bytes) -> None:
+        """Queue one JSON record; dropped when the writer falls too far behind."""
+        with self._cond:
+            if self._closed or len(self._lines) >= TRACE_QUEUE_MAX_RECORDS:
+                self.dropped += 1
+                return
+            self._lines.append(line)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-writer', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def drop(self) -> None:
+        with self._cond:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self._cond:
+                    while not self._lines and not self._closed:
+                        self._cond.wait()
+                    if not self._lines:
+                        return
+                    lines, self._lines = self._lines, []
+                try:
+                    self._append(lines)
+                except OSError:
+                    logger.warning("Writing %d trace records failed", len(lines), exc_info=True)
+                    self._close_file()
+                    with self._cond:
+                        self.write_errors += len(lines)
+        finally:
+            self._close_file()
+
+    def _append(self, lines: List[bytes]) -> None:
+        if self._file is None:
+            self._open()
+        self._file.write(b'\n'.join(lines) + b'\n')
+        # A sync flush keeps the file readable up to here if the process dies
+        self._file.flush(zlib.Z_SYNC_FLUSH)
+        with self._cond:
+            self.records += len(lines)
+        if self._raw.tell() >= settings.TRACE_ROTATE_MB * 1024 * 1024:
+            self._close_file()
+            self._prune()
+
+    def _open(self) -> None:
+        os.makedirs(settings.TRACE_DIR, exist_ok=True)
+        name = f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.files:04d}.ndjson.gz"
+        self.path = os.path.join(settings.TRACE_DIR, name)
+        self._raw = open(self.path, 'ab')
+        self._file = gzip.GzipFile(filename=name, mode='ab', fileobj=self._raw)
+        self.files += 1
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+                self._raw.close()
+            except OSError:
+                pass
+            self._file = self._raw = None
+
+    def _prune(self) -> None:
+        """Delete the oldest trace files beyond ``TRACE_KEEP_FILES``."""
+        if not settings.TRACE_KEEP_FILES:
+            return
+        files = sorted(glob.glob(os.path.join(settings.TRACE_DIR, TRACE_FILE_PATTERN)), key=os.path.getmtime)
+        for path in files[:-settings.TRACE_KEEP_FILES]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Write queued records and close the current file."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'enabled': settings.TRACE_ENABLED,
+                'sample_rate': settings.TRACE_SAMPLE_RATE,
+                'records': self.records,
+                'pending': len(self._lines),
+                'dropped': self.dropped,
+                'write_errors': self.write_errors,
+                'files': self.files,
+                'current_file': self.path
+            }
+
+
+trace_writer = TraceWriter()
+atexit.register(trace_writer.close)
+
+
+def get_trace_stats() -> Dict[str, Any]:
+    """Get recorded, pending and dropped trace records."""
+    return trace_writer.stats()
+
+
+# Trace of the current request
+
+class _Trace:
+    def __init__(self, view: str, request):
+        self.started = time.monotonic()
+        self.record: Dict[str, Any] = {
+            'ts': round(time.time(), 6),
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'headers': {name: request.headers[name] for name in TRACE_HEADERS if name in request.headers},
+            **_request_body(request.body),
+            'core_memory': [],
+            'model_calls': [],
+            'stages': {}
+        }
+
+
+def _request_body(body: bytes) -> Dict[str, Any]:
+    try:
+        return {'request': json.loads(body) if body else None}
+    except ValueError:
+        return {'request': None, 'raw_body': body.decode('utf-8', 'replace')}
+
+
+_trace: contextvars.ContextVar[Optional[_Trace]] = contextvars.ContextVar('request_trace', default=None)
+
+
+def trace_stage(stage: str, seconds: float) -> None:
+    """Add a stage timing to the current trace; repeated stages add up."""
+    trace = _trace.get()
+    if trace is not None:
+        stages = trace.record['stages']
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def trace_core_memory(room_id: str, core_memory: List[Dict[str, Any]], total_dialogues: int) -> None:
+    """Add the core memory loaded for a room to the current trace."""
+    trace = _trace.get()
+    if trace is not None:
+        # Copied, since cached core memory lists are shared with later requests
+        trace.record['core_memory'].append({
+            'room_id': room_id,
+            'core_memory': list(core_memory),
+            'total_dialogues': total_dialogues
+        })
+
+
+def trace_model_call(kind: str, request_params: Dict[str, Any], response: Any, seconds: float) -> None:
+    """
+    Add a successful model call to the current trace.
+
+    ``response`` is the provider's chat completion, as a dict or an SDK
+    object; a streamed call is recorded as the completion its chunks add
+    up to.
+    """
+    trace = _trace.get()
+    if trace is not None:
+        if hasattr(response, 'model_dump'):
+            response = response.model_dump()
+        trace.record['model_calls'].append({
+            'kind': kind,
+            'stream': bool(request_params.get('stream')),
+            'latency': round(seconds, 4),
+            'messages': request_params['messages'],
+            'response': response
+        })
+
+
+def _finish(trace: _Trace, status: int) -> None:
+    record = trace.record
+    record['status'] = status
+    record['duration'] = round(time.monotonic() - trace.started, 4)
+    record['stages'] = {stage: round(seconds, 4) for stage, seconds in record['stages'].items()}
+    try:
+        line = dump_json(record)
+    except (TypeError, ValueError):
+        logger.warning("Trace of a %s request is not serializable", record['view'], exc_info=True)
+        trace_writer.drop()
+        return
+    trace_writer.write(line)
+
+
+def _begin(view: str, request) -> Optional[_Trace]:
+    if not settings.TRACE_ENABLED or random.random() >= settings.TRACE_SAMPLE_RATE:
+        return None
+    return _Trace(view, request)
+
+
+def _respond(trace: _Trace, response):
+    if response.streaming and response.is_async:
+        # The stream's model call and stages belong to the trace
+        response.streaming_content = _traced_stream(trace, response.status_code, response.streaming_content)
+    else:
+        _finish(trace, response.status_code)
+    return response
+
+
+async def _traced_stream(trace: _Trace, status: int, content):
+    iterator = content.__aiter__()
+    try:
+        while True:
+            token = _trace.set(trace)
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                _trace.reset(token)
+            yield chunk
+    finally:
+        _finish(trace, status)
+
+
+def traced_view(name: str):
+    """Decorate a view so its requests are traced as ``name``."""
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                trace = _begin(name, request)
+                if trace is None:
+                    return await view(request, *args, **kwargs)
+                token = _trace.set(trace)
+                try:
+                    response = await view(request, *args, **kwargs)
+                except BaseException:
+                    _finish(trace, 500)
+                    raise
+                finally:
+                    _trace.reset(token)
+                return _respond(trace, response)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                trace = _begin(name, request)
+                if trace is None:
+                    return view(request, *args, **kwargs)
+                token = _trace.set(trace)
+                try:
+                    response = view(request, *args, **kwargs)
+                except BaseException:
+                    _finish(trace, 500)
+                    raise
+                finally:
+                    _trace.reset(token)
+                return _respond(trace, response)
+        return wrapper
+
+    return decorator
+
+
+# Reading traces back
+
+def trace_files(paths: Iterable[str]) -> List[str]:
+    """Trace files named by ``paths`` (files or directories), oldest first."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, TRACE_FILE_PATTERN)))
+        else:
+            files.append(path)
+    return sorted(files, key=os.path.getmtime)
+
+
+def read_traces(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Records of trace files. A file cut short by a killed process yields
+    the records up to its last complete line.
+    """
+    for path in trace_files(paths):
+        with gzip.open(path, 'rb') as file:
+            try:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        break
+            except EOFError:
+                pass